@@ -1,17 +1,23 @@
 # backend/routers/auth.py
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form, Request
 from sqlalchemy.orm import Session
 from database import get_db
 from models import User, MedicalDocument
+from rate_limit import check_upload_rate
+from blob_store import SCAN_CLEAN, acquire_blob, release_blob, serve_blob, store_upload
+from file_validation import file_validation_worker
+from document_previews import PDF_MIME_TYPE, PREVIEW_MIME_TYPE, PREVIEW_READY
+from utils.file_response import file_response
 from pydantic import BaseModel
 import jwt
 from datetime import datetime, timedelta
 import os
 from typing import List, Optional
-import shutil
+from urllib.parse import quote
 
 # Dossier pour stocker les documents
 UPLOAD_DIR = "uploads/medical_documents"
+MAX_DOCUMENT_SIZE = int(os.getenv("MEDICAL_DOCUMENT_MAX_SIZE", str(20 * 1024 * 1024)))  # 20 MB
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 router = APIRouter(prefix="/users", tags=["Authentication"])
@@ -246,6 +252,11 @@ def register(request: RegisterRequest, db: Session = Depends(get_db)):
 
 
 # ===== ENDPOINTS DOCUMENTS =====
+def legacy_document_path(document: MedicalDocument) -> str:
+    """Ancien fichier propre au document (avant le stockage dédupliqué)"""
+    return os.path.join(UPLOAD_DIR, document.filename)
+
+
 @router.post("/upload-document/{user_id}")
 async def upload_document(
     user_id: int,
@@ -263,6 +274,9 @@ async def upload_document(
             "message": "Utilisateur non trouvé"
         }
     
+    # Débit d'uploads par utilisateur (429 + Retry-After)
+    check_upload_rate(user_id)
+    
     # Validation du type de document
     valid_types = ["mutuelle", "ordonnance", "analyse", "radio", "autre"]
     if document_type not in valid_types:
@@ -272,29 +286,30 @@ async def upload_document(
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     file_extension = os.path.splitext(file.filename)[1]
     unique_filename = f"{user_id}_{document_type}_{timestamp}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
     
-    # Sauvegarder le fichier physique
+    # Contenu stocké une seule fois (en flux, taille limitée, dédupliqué par SHA-256)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        stored = await store_upload(file, MAX_DOCUMENT_SIZE)
         
-        file_size = os.path.getsize(file_path)
-        
-        # Créer l'entrée en base de données
+        # Créer l'entrée en base de données, avec sa référence au contenu
         new_document = MedicalDocument(
             user_id=user_id,
             filename=unique_filename,
             original_filename=file.filename,
             file_type=document_type,
-            file_size=file_size,
-            mime_type=file.content_type
+            file_size=stored["size"],
+            mime_type=stored["mime_type"],
+            blob_sha256=stored["sha256"]
         )
         
         db.add(new_document)
+        acquire_blob(db, stored["sha256"])
         db.commit()
         db.refresh(new_document)
         
+        # Téléchargeable une fois analysé (type réel, image, antivirus)
+        file_validation_worker.submit(stored["sha256"])
+        
         return {
             "success": True,
             "message": "Document téléchargé avec succès",
@@ -309,10 +324,11 @@ async def upload_document(
             }
         }
         
+    except HTTPException:
+        # Trop volumineux (413) : rien n'a été écrit
+        raise
     except Exception as e:
-        # Nettoyer en cas d'erreur
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Blob sans référence : supprimé par la collecte
         db.rollback()
         
         return {
@@ -321,6 +337,18 @@ async def upload_document(
         }
 
 
+def _preview_fields(document: MedicalDocument) -> dict:
+    """Aperçu de la première page et début du texte (PDF), s'ils sont prêts"""
+    preview = document.preview
+    if preview is None or preview.status != PREVIEW_READY:
+        return {"preview_url": None, "text_snippet": None, "page_count": None}
+    return {
+        "preview_url": f"{router.prefix}/document/preview/{document.user_id}/{quote(document.filename)}",
+        "text_snippet": preview.text_snippet,
+        "page_count": preview.page_count
+    }
+
+
 @router.get("/documents/{user_id}")
 def get_user_documents(user_id: int, db: Session = Depends(get_db)):
     """Récupérer la liste des documents d'un utilisateur"""
@@ -343,10 +371,9 @@ def get_user_documents(user_id: int, db: Session = Depends(get_db)):
     # Vérifier que les fichiers existent physiquement
     document_list = []
     for doc in documents:
-        file_path = os.path.join(UPLOAD_DIR, doc.filename)
-        
-        # Si le fichier n'existe plus physiquement, on peut le signaler
-        if not os.path.exists(file_path):
+        # Contenu dédupliqué : présent tant qu'il est référencé (aucun appel
+        # au stockage, qui peut être distant) ; seuls les anciens fichiers sont vérifiés
+        if not doc.blob_sha256 and not os.path.exists(legacy_document_path(doc)):
             print(f"Warning: Fichier {doc.filename} manquant pour le document ID {doc.id}")
         
         document_list.append({
@@ -356,7 +383,10 @@ def get_user_documents(user_id: int, db: Session = Depends(get_db)):
             "file_type": doc.file_type,
             "file_size": doc.file_size,
             "upload_date": doc.upload_date.isoformat(),
-            "mime_type": doc.mime_type
+            "mime_type": doc.mime_type,
+            # pending : en quarantaine ; rejected / infected : bloqué
+            "scan_status": doc.blob.scan_status if doc.blob is not None else SCAN_CLEAN,
+            **_preview_fields(doc)
         })
     
     return {
@@ -384,11 +414,14 @@ def delete_document(user_id: int, filename: str, db: Session = Depends(get_db)):
             "message": "Document non trouvé ou accès non autorisé"
         }
     
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    file_path = legacy_document_path(document)
     
     try:
-        # Supprimer le fichier physique s'il existe
-        if os.path.exists(file_path):
+        if document.blob_sha256:
+            # Contenu partagé : effacé seulement quand plus rien ne le référence
+            release_blob(db, document.blob_sha256)
+        elif os.path.exists(file_path):
+            # Ancien fichier propre au document
             os.remove(file_path)
         
         # Supprimer l'entrée en base de données
@@ -409,9 +442,8 @@ def delete_document(user_id: int, filename: str, db: Session = Depends(get_db)):
 
 
 @router.get("/document/download/{user_id}/{filename}")
-def download_document(user_id: int, filename: str, db: Session = Depends(get_db)):
-    """Télécharger un document"""
-    from fastapi.responses import FileResponse
+def download_document(user_id: int, filename: str, request: Request, db: Session = Depends(get_db)):
+    """Télécharger un document (ETag, 304, Range / 206 : réouverture d'un PDF sans tout retélécharger)"""
     
     # Vérifier que le document appartient à l'utilisateur
     document = db.query(MedicalDocument)\
@@ -424,15 +456,82 @@ def download_document(user_id: int, filename: str, db: Session = Depends(get_db)
     if not document:
         raise HTTPException(status_code=404, detail="Document non trouvé")
     
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    media_type = document.mime_type or "application/octet-stream"
+    if document.blob_sha256 and document.blob is not None:
+        # Contenu dédupliqué : ETag = hash, jamais modifié pour ce document
+        # (stockage distant : redirection vers une URL pré-signée)
+        return serve_blob(
+            request,
+            document.blob.storage_path,
+            document.blob_sha256,
+            document.blob.scan_status,
+            media_type=media_type,
+            filename=document.original_filename
+        )
+    
+    file_path = legacy_document_path(document)
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Fichier physique non trouvé")
     
-    return FileResponse(
-        path=file_path,
-        filename=document.original_filename,
-        media_type=document.mime_type or "application/octet-stream"
+    return file_response(
+        request,
+        file_path,
+        media_type=media_type,
+        filename=document.original_filename
     )
 
 
+@router.get("/document/preview/{user_id}/{filename}")
+def get_document_preview(user_id: int, filename: str, request: Request, db: Session = Depends(get_db)):
+    """Aperçu de la première page d'un PDF (WebP), seulement pour le propriétaire du document"""
+    
+    # Vérifier que le document appartient à l'utilisateur
+    document = db.query(MedicalDocument)\
+        .filter(
+            MedicalDocument.user_id == user_id,
+            MedicalDocument.filename == filename
+        )\
+        .first()
+    
+    preview = document.preview if document else None
+    if preview is None or preview.status != PREVIEW_READY:
+        raise HTTPException(status_code=404, detail="Aperçu non disponible")
+    
+    # Aperçu produit seulement pour un contenu sain (stockage distant : URL pré-signée)
+    return serve_blob(
+        request,
+        preview.preview_path,
+        None,
+        document.blob.scan_status,
+        media_type=PREVIEW_MIME_TYPE,
+        inline=True
+    )
+
+
+@router.get("/document/text/{user_id}/{filename}")
+def get_document_text(user_id: int, filename: str, db: Session = Depends(get_db)):
+    """Texte extrait d'un document PDF (sans télécharger le fichier)"""
+    
+    # Vérifier que le document appartient à l'utilisateur
+    document = db.query(MedicalDocument)\
+        .filter(
+            MedicalDocument.user_id == user_id,
+            MedicalDocument.filename == filename
+        )\
+        .first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document non trouvé")
+    
+    preview = document.preview
+    if preview is None:
+        # PDF pas encore traité, ou autre type de fichier
+        status = "pending" if document.mime_type == PDF_MIME_TYPE else "unsupported"
+        return {"success": False, "status": status, "text": None}
+    return {
+        "success": preview.status == PREVIEW_READY,
+        "status": preview.status,
+        "page_count": preview.page_count,
+        "text": preview.text_content
+    }
@@ -0,0 +1,129 @@
+# backend/background_worker.py
+"""
+Modèle commun des traitements de fichiers hors requête
+(file_validation, image_variants, document_previews) :
+
+- file asyncio bornée : submit() ne bloque jamais la requête ; file pleine,
+  la tâche est abandonnée (dropped) et reprise par le balayage suivant
+- pool d'exécution borné (processus ou threads, selon create_pool())
+- une tâche consommatrice par travailleur du pool
+- balayage périodique (sweep) : reprend ce que la file a perdu (file
+  pleine, redémarrage)
+
+Les sous-classes fournissent create_pool(), process() et sweep().
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Optional
+
+
+def spawn_process_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn : pas de fork d'un processus qui a déjà des threads (pool DB, boucle)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class QueueWorker:
+    """File bornée consommée par autant de tâches que de travailleurs du pool"""
+
+    # Pour les messages de log : "File validation", "blob"...
+    name = "Worker"
+    item_label = "item"
+
+    def __init__(self, workers: int, queue_size: int, sweep_interval: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sweep_interval = sweep_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool: Optional[Executor] = None
+        self._consumers: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # Métriques
+        self.error_count = 0
+        self.dropped_count = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._consumers)
+
+    def can_start(self) -> bool:
+        """Dépendances optionnelles présentes"""
+        return True
+
+    def create_pool(self) -> Executor:
+        raise NotImplementedError
+
+    async def process(self, *args):
+        raise NotImplementedError
+
+    async def sweep(self) -> int:
+        """Remettre en file ce qui reste à traiter ; retourne le nombre de tâches ajoutées"""
+        raise NotImplementedError
+
+    def start(self):
+        """Lancer le pool et les consommateurs (idempotent ; désactivé si workers <= 0)"""
+        if self.workers <= 0 or self._consumers or not self.can_start():
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._pool = self.create_pool()
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        tasks = self._consumers + ([self._sweeper] if self._sweeper else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._consumers = []
+        self._sweeper = None
+        self._queue = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _describe(self, args: tuple) -> str:
+        return f"{self.item_label} {str(args[0])[:12]}"
+
+    def submit(self, *args) -> bool:
+        """Déposer une tâche (arguments de process()), sans attendre"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(args)
+            return True
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+            print(f"⚠️ {self.name} queue full, {self._describe(args)} left to the next sweep")
+            return False
+
+    async def _consume(self):
+        while True:
+            args = await self._queue.get()
+            try:
+                await self.process(*args)
+            except Exception as e:
+                self.error_count += 1
+                print(f"❌ {self.name} failed for {self._describe(args)}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"❌ {self.name} sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "errors": self.error_count,
+            "dropped": self.dropped_count
+        }
@@ -0,0 +1,192 @@
+# backend/benchmarks/ws_db_latency.py
+"""
+Benchmark : latence de livraison WebSocket selon l'accès base du chemin temps réel.
+
+- blocking : chemin historique de websocket_endpoint, requêtes SQLAlchemy
+             exécutées directement sur la boucle asyncio (INSERT + commit,
+             relecture de la conversation, UPDATE + commit)
+- executor : chemin actuel, participants via conversation_cache et écriture
+             groupée via message_writer, le tout dans le pool DB dédié
+
+Des frames arrivent à débit fixe sur des paires patient/médecin ; chaque frame
+est persistée puis diffusée aux deux sockets.
+La latence est mesurée depuis l'heure d'arrivée PRÉVUE de la frame jusqu'à
+l'envoi effectif sur la socket destinataire (pas d'omission coordonnée).
+
+Usage (depuis backend/backend_2) :
+    DATABASE_URL=sqlite:///bench_ws.db python benchmarks/ws_db_latency.py --sockets 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_ws.db")
+
+from sqlalchemy import insert  # noqa: E402
+
+import conversation_cache  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from message_writer import MessageBatchWriter  # noqa: E402
+from models import Conversation, Message, User  # noqa: E402
+from pubsub import InMemoryPubSub, InProcessHub  # noqa: E402
+from websocket_manager import ConnectionManager  # noqa: E402
+
+
+class FakeWebSocket:
+    """Socket simulée : enregistre la latence des frames reçues"""
+
+    __slots__ = ("latencies",)
+    scope: dict = {}
+
+    def __init__(self, latencies: list):
+        self.latencies = latencies
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        scheduled_at = json.loads(data).get("scheduled_at")
+        if scheduled_at is not None:
+            self.latencies.append(time.perf_counter() - scheduled_at)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def seed(pairs: int) -> list:
+    """Créer les paires patient/médecin manquantes et retourner leurs conversations"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        existing = db.query(Conversation).filter(
+            Conversation.patient_id.in_(db.query(User.id).filter(User.email.like("bench_p_%")))
+        ).count()
+        if existing < pairs:
+            users = []
+            for i in range(existing, pairs):
+                users.append({"name": f"Bench Patient {i}", "email": f"bench_p_{i}@bench.local",
+                              "password": "bench", "role": "patient"})
+                users.append({"name": f"Bench Doctor {i}", "email": f"bench_d_{i}@bench.local",
+                              "password": "bench", "role": "doctor"})
+            ids = [row.id for row in db.execute(
+                insert(User).returning(User.id, sort_by_parameter_order=True), users
+            )]
+            db.execute(insert(Conversation), [
+                {"patient_id": ids[i], "medecin_id": ids[i + 1]} for i in range(0, len(ids), 2)
+            ])
+            db.commit()
+
+        rows = db.query(Conversation.id, Conversation.patient_id, Conversation.medecin_id).join(
+            User, User.id == Conversation.patient_id
+        ).filter(User.email.like("bench_p_%")).order_by(Conversation.id).limit(pairs).all()
+        return [(row.id, row.patient_id, row.medecin_id) for row in rows]
+    finally:
+        db.close()
+
+
+def handle_frame_legacy(db, conversation_id: int, sender_id: int, content: str) -> int:
+    """Travail base historique d'une frame (deux commits + relecture de la conversation)"""
+    message = Message(conversation_id=conversation_id, sender_id=sender_id,
+                      content=content, message_type="text", is_read=False)
+    db.add(message)
+    db.commit()
+    db.refresh(message)
+    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    conversation.last_message_at = message.created_at
+    db.commit()
+    db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    return message.id
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(mode: str, conversations: list, rate: float, duration: float) -> dict:
+    manager = ConnectionManager(InMemoryPubSub(hub=InProcessHub()))
+    writer = MessageBatchWriter()
+    latencies: list = []
+    errors = 0
+
+    for _, patient_id, medecin_id in conversations:
+        await manager.connect(FakeWebSocket(latencies), patient_id)
+        await manager.connect(FakeWebSocket(latencies), medecin_id)
+
+    async def on_frame(index: int, scheduled_at: float):
+        nonlocal errors
+        conversation_id, patient_id, medecin_id = conversations[index % len(conversations)]
+        try:
+            if mode == "blocking":
+                db = SessionLocal()
+                try:
+                    message_id = handle_frame_legacy(db, conversation_id, patient_id, f"bench {index}")
+                finally:
+                    db.close()
+            else:
+                await conversation_cache.fetch_participants(conversation_id)
+                saved = await writer.submit(conversation_id, patient_id, f"bench {index}")
+                message_id = saved["id"]
+        except Exception:
+            errors += 1
+            return
+        await manager.broadcast_to_conversation(
+            {"type": "new_message", "id": message_id, "scheduled_at": scheduled_at},
+            [patient_id, medecin_id]
+        )
+
+    total = int(rate * duration)
+    tasks = []
+    start = time.perf_counter()
+    for index in range(total):
+        scheduled_at = start + index / rate
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(on_frame(index, scheduled_at)))
+    await asyncio.gather(*tasks)
+    # Laisser les tâches d'écriture vider leurs files
+    while manager.get_connection_stats()["queued_frames"]:
+        await asyncio.sleep(0.01)
+
+    await writer.stop()
+    for connection in list(manager.registry.all_connections()):
+        await manager.disconnect(connection.websocket, connection.user_id)
+
+    return {
+        "mode": mode,
+        "frames": total,
+        "deliveries": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=5000, help="nombre de sockets (2 par conversation)")
+    parser.add_argument("--rate", type=float, default=500, help="frames reçues par seconde")
+    parser.add_argument("--duration", type=float, default=10, help="durée de chaque mode en secondes")
+    parser.add_argument("--modes", default="blocking,executor")
+    args = parser.parse_args()
+
+    conversations = seed(args.sockets // 2)
+    print(f"{'mode':<10} {'frames':>7} {'livrées':>8} {'erreurs':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for mode in args.modes.split(","):
+        result = asyncio.run(run(mode, conversations, args.rate, args.duration))
+        print(f"{result['mode']:<10} {result['frames']:>7} {result['deliveries']:>8} {result['errors']:>8} "
+              f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['max_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# backend/benchmarks/ws_framing.py
+"""
+Benchmark : octets sur le fil et CPU par frame selon l'encodage WebSocket.
+
+Pour des frames représentatives du chat (new_message, resume_batch de 50
+messages, presence, typing) et chaque encodage (json, msgpack) :
+
+- octets     : taille de la frame encodée
+- deflate    : taille après permessage-deflate sans contexte partagé
+               (client_no_context_takeover) et avec contexte partagé (défaut :
+               les frames successives d'une socket se compriment entre elles)
+- µs/frame   : coût d'encodage d'une frame
+- diffusion  : coût d'encodage pour N destinataires, frame par frame
+               (un send_json par socket, avant) ou une seule fois (OutboundFrame)
+
+Usage (depuis backend/backend_2) :
+    python benchmarks/ws_framing.py --recipients 50
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ws_codec import AVAILABLE_CODECS, OutboundFrame  # noqa: E402
+
+
+def sample_message(index: int) -> dict:
+    return {
+        "id": 120000 + index,
+        "conversation_id": 4312,
+        "seq": 880 + index,
+        "sender_id": 57,
+        "sender_name": "Dr. Amina Benali",
+        "content": "Bonjour, vos résultats d'analyse sont arrivés, pouvez-vous passer demain ?",
+        "message_type": "text",
+        "file_url": None,
+        "created_at": (datetime(2026, 3, 1, 9, 30) + timedelta(seconds=index * 17)).isoformat(),
+        "is_read": False
+    }
+
+
+def sample_frames() -> dict:
+    return {
+        "new_message": [{"type": "new_message", "message": sample_message(i)} for i in range(100)],
+        "resume_batch": [{"type": "resume_batch", "conversation_id": 4312,
+                          "messages": [sample_message(i * 50 + j) for j in range(50)]} for i in range(4)],
+        "presence": [{"type": "presence", "user_id": 57 + i % 5, "status": "online",
+                      "last_seen": datetime(2026, 3, 1, 9, 30, i % 60).isoformat()} for i in range(100)],
+        "typing": [{"type": "typing", "conversation_id": 4312, "user_id": 57,
+                    "is_typing": i % 2 == 0, "expires_in": 6} for i in range(100)],
+    }
+
+
+def deflate_sizes(payloads: list) -> tuple:
+    """Taille moyenne après deflate : sans contexte partagé, puis avec"""
+    isolated = 0
+    for data in payloads:
+        compressor = zlib.compressobj(wbits=-15)
+        isolated += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    shared = 0
+    compressor = zlib.compressobj(wbits=-15)
+    for data in payloads:
+        shared += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return isolated / len(payloads), shared / len(payloads)
+
+
+def time_per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=50, help="destinataires par diffusion")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'frame':<13} {'encodage':<8} {'octets':>8} {'deflate':>8} {'deflate+ctx':>11} "
+          f"{'µs/frame':>9} {'diff. avant µs':>15} {'diff. 1x µs':>12}")
+    for frame_type, frames in sample_frames().items():
+        for codec in AVAILABLE_CODECS:
+            payloads = []
+            for message in frames:
+                data = codec.encode(message)
+                payloads.append(data.encode("utf-8") if isinstance(data, str) else data)
+            size = sum(len(p) for p in payloads) / len(payloads)
+            isolated, shared = deflate_sizes(payloads)
+
+            message = frames[0]
+            repeat = max(1, args.repeat // (50 if frame_type == "resume_batch" else 1))
+            per_frame = time_per_call(lambda: codec.encode(message), repeat)
+
+            def per_recipient():
+                for _ in range(args.recipients):
+                    codec.encode(message)
+
+            def once():
+                frame = OutboundFrame(message)
+                for _ in range(args.recipients):
+                    frame.encoded(codec)
+
+            fanout_before = time_per_call(per_recipient, max(1, repeat // args.recipients))
+            fanout_once = time_per_call(once, max(1, repeat // args.recipients))
+            print(f"{frame_type:<13} {codec.name:<8} {size:>8.0f} {isolated:>8.0f} {shared:>11.0f} "
+                  f"{per_frame * 1e6:>9.1f} {fanout_before * 1e6:>15.1f} {fanout_once * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
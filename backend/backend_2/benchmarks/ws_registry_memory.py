@@ -0,0 +1,115 @@
+# backend/benchmarks/ws_registry_memory.py
+"""
+Benchmark : mémoire et coût du registre de connexions du ConnectionManager.
+
+Simule N sockets (plusieurs par utilisateur) qui se connectent en même
+temps, reçoivent une diffusion puis se déconnectent toutes :
+
+- mémoire   : octets alloués (tracemalloc) par connexion inscrite, sockets
+              simulées exclues
+- connect   : durée des N connexions concurrentes
+- broadcast : durée de la mise en file d'une frame pour tous les utilisateurs
+- disconnect: durée des N déconnexions concurrentes
+
+Usage (depuis backend/backend_2) :
+    python benchmarks/ws_registry_memory.py --connections 50000 --per-user 2
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pubsub import InMemoryPubSub, InProcessHub  # noqa: E402
+from websocket_manager import ConnectionManager  # noqa: E402
+
+
+class FakeWebSocket:
+    """Socket simulée, sans réseau"""
+
+    __slots__ = ()
+    scope: dict = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def send_bytes(self, data: bytes):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(connections: int, per_user: int) -> dict:
+    manager = ConnectionManager(InMemoryPubSub(hub=InProcessHub()))
+    await manager.start()
+    users = max(1, connections // per_user)
+    sockets = [(FakeWebSocket(), index % users) for index in range(connections)]
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(manager.connect(ws, user_id) for ws, user_id in sockets))
+    connect_time = time.perf_counter() - start
+    # Laisser démarrer les tâches éventuellement créées à la connexion
+    await asyncio.sleep(0)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    registered = manager.get_connection_stats()["connections"]
+
+    start = time.perf_counter()
+    await manager.broadcast_to_conversation({"type": "ping"}, list(range(users)))
+    broadcast_time = time.perf_counter() - start
+    # Vider les files avant la déconnexion
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(manager.disconnect(ws, user_id) for ws, user_id in sockets))
+    disconnect_time = time.perf_counter() - start
+    tracemalloc.stop()
+
+    remaining = manager.get_connection_stats()["connections"]
+    await manager.stop()
+    return {
+        "connections": registered,
+        "remaining": remaining,
+        "bytes_per_connection": memory / max(1, registered),
+        "total_mb": memory / 1024 / 1024,
+        "connect_s": connect_time,
+        "broadcast_ms": broadcast_time * 1000,
+        "disconnect_s": disconnect_time
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--per-user", type=int, default=2, help="sockets par utilisateur")
+    args = parser.parse_args()
+
+    # Le manager journalise chaque connexion : sans intérêt ici
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run(args.connections, args.per_user))
+
+    print(f"connexions inscrites : {result['connections']} (restantes après déconnexion : {result['remaining']})")
+    print(f"mémoire              : {result['total_mb']:.1f} Mo, {result['bytes_per_connection']:.0f} octets/connexion")
+    print(f"connect              : {result['connect_s']:.2f} s")
+    print(f"broadcast            : {result['broadcast_ms']:.1f} ms")
+    print(f"disconnect           : {result['disconnect_s']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+# backend/blob_store.py
+"""
+Stockage des fichiers adressé par contenu (dédupliqué).
+
+La même carte de mutuelle ou le même PDF d'analyse est envoyé plusieurs
+fois : en document médical, puis dans le chat à plusieurs médecins. Chaque
+contenu n'est stocké qu'une fois, sous son SHA-256 :
+
+    storage/blobs/ab/cd/abcd1234...<64 hex>.pdf
+
+(clé ab/cd/<sha256>.<ext> dans le backend de storage.py : disque local par
+défaut, ou bucket S3 / MinIO avec FILE_STORAGE_URL=s3://...).
+L'extension vient du type MIME détecté à partir des octets : le chemin ne
+dépend que du contenu. Une ligne FileBlob par contenu porte le nombre de
+références (MedicalDocument.blob_sha256, ChatAttachment.blob_sha256).
+
+Écriture d'un upload :
+1. copie en flux dans un fichier temporaire, SHA-256 calculé au passage
+2. reserve_blob   : ligne FileBlob créée ou « touchée » (transaction courte)
+3. install_blob   : fichier temporaire déposé dans le backend, ou supprimé si
+                    ce contenu est déjà stocké (aucune seconde copie)
+4. acquire_blob   : ref_count + 1, dans la transaction qui crée le document
+                    ou la pièce jointe
+
+Chaque nouveau contenu est en quarantaine (FileBlob.scan_status "pending")
+jusqu'à son analyse par file_validation : les téléchargements répondent 423
+tant qu'il n'est pas "clean", 403 s'il a été refusé. Le dossier local est
+donc hors de uploads/ (servi tel quel par le montage StaticFiles) : les
+contenus ne sont lus que par serve_blob, après ce contrôle.
+
+Suppression : release_blob (ref_count - 1) dans la transaction qui supprime
+la référence. Le fichier n'est effacé que par BlobCollector, pour les blobs
+à 0 référence et non touchés depuis BLOB_GC_GRACE_SECONDS : un upload entre
+réservation et commit, ou qui échoue avant le commit, ne perd jamais son
+fichier, et ce qu'il laisse derrière lui est ramassé plus tard.
+"""
+
+import asyncio
+import mimetypes
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import RedirectResponse, Response
+from sqlalchemy import case, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import run_db
+from models import DocumentPreview, FileBlob
+from storage import create_storage_from_env
+from utils.file_handler import MAX_FILE_SIZE, spool_upload
+from utils.file_response import file_response
+from utils.image_processing import remove_variants
+from utils.pdf_preview import preview_key
+
+BLOB_DIR = os.getenv("BLOB_STORE_DIR", "storage/blobs")
+# Ancien dossier local et ses URLs (montage StaticFiles /uploads, sans quarantaine) :
+# contenus déplacés par migrate_to_blob_store.py
+LEGACY_BLOB_DIR = "uploads/blobs"
+BLOB_URL_PREFIX = "/uploads/blobs"
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))
+BLOB_GC_INTERVAL = float(os.getenv("BLOB_GC_INTERVAL", "900"))
+BLOB_GC_BATCH = 200
+
+# FileBlob.scan_status
+SCAN_PENDING = "pending"
+SCAN_CLEAN = "clean"
+SCAN_REJECTED = "rejected"
+SCAN_INFECTED = "infected"
+# Délai suggéré au client pendant l'analyse (en-tête Retry-After)
+SCAN_RETRY_AFTER = 5
+
+_BLOB_NAME = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$")
+
+# Fichiers temporaires des uploads en cours, quel que soit le backend
+os.makedirs(BLOB_DIR, exist_ok=True)
+storage = create_storage_from_env(BLOB_DIR)
+
+
+class BlobNotReserved(Exception):
+    """acquire_blob sur un contenu sans ligne FileBlob"""
+
+
+def storage_path_for(sha256: str, mime_type: Optional[str]) -> str:
+    """Chemin relatif d'un contenu : deux niveaux de sous-dossiers, puis le hash"""
+    extension = (mimetypes.guess_extension(mime_type) if mime_type else None) or ""
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}{extension}")
+
+
+def blob_location(storage_path: str) -> str:
+    """Emplacement enregistré en base (chemin local ou s3://bucket/clé)"""
+    return storage.location(storage_path)
+
+
+def blob_url(storage_path: str) -> str:
+    """
+    URL d'un contenu : toujours servie par l'application (/chat/preview), qui
+    vérifie la quarantaine ; hors disque, elle redirige vers une URL pré-signée
+    """
+    return f"/chat/preview/{os.path.basename(storage_path)}"
+
+
+def blob_sha256_from_name(name: str) -> Optional[str]:
+    """SHA-256 contenu dans le dernier segment d'une URL de blob (<sha256>.<ext>)"""
+    match = _BLOB_NAME.match(name)
+    return match.group(1) if match else None
+
+
+def find_blob(name: str) -> Optional[str]:
+    """
+    Clé d'un blob à partir du dernier segment de son URL. Sur disque, None
+    si le fichier n'existe pas ; ailleurs la clé est retournée sans requête
+    au stockage (l'URL pré-signée répond 404 elle-même).
+    """
+    sha256 = blob_sha256_from_name(name)
+    if sha256 is None:
+        return None
+    storage_path = os.path.join(sha256[:2], sha256[2:4], name)
+    local_path = storage.local_path(storage_path)
+    if local_path is not None and not os.path.exists(local_path):
+        return None
+    return storage_path
+
+
+def blob_scan_status(db: Session, sha256: str) -> Optional[str]:
+    """Statut d'analyse d'un contenu (None : pas de ligne FileBlob)"""
+    return db.query(FileBlob.scan_status).filter(FileBlob.sha256 == sha256).scalar()
+
+
+def ensure_cleared(scan_status: Optional[str]):
+    """423 pendant l'analyse, 403 si le contenu a été refusé, 404 s'il est inconnu"""
+    if scan_status is None:
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    if scan_status == SCAN_PENDING:
+        raise HTTPException(
+            status_code=423,
+            detail="Fichier en cours d'analyse",
+            headers={"Retry-After": str(SCAN_RETRY_AFTER)}
+        )
+    if scan_status != SCAN_CLEAN:
+        raise HTTPException(status_code=403, detail="Fichier bloqué par l'analyse de sécurité")
+
+
+def serve_blob(
+    request: Request,
+    storage_path: str,
+    sha256: Optional[str],
+    scan_status: Optional[str],
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    inline: bool = False
+) -> Response:
+    """
+    Réponse de téléchargement d'un blob analysé et sain : fichier local servi
+    par file_response (immuable, ETag = hash), sinon redirection vers le stockage.
+    """
+    ensure_cleared(scan_status)
+    local_path = storage.local_path(storage_path)
+    if local_path is None:
+        url = storage.download_url(storage_path, filename, media_type, inline)
+        return RedirectResponse(url, status_code=307)
+    if not os.path.exists(local_path):
+        raise HTTPException(status_code=404, detail="Fichier non trouvé")
+    return file_response(
+        request,
+        local_path,
+        media_type=media_type,
+        filename=filename,
+        sha256=sha256,
+        immutable=True,
+        inline=inline
+    )
+
+
+# ============================================
+# RÉSERVATION, INSTALLATION, RÉFÉRENCES
+# ============================================
+
+def reserve_blob(db: Session, sha256: str, size: int, mime_type: Optional[str]) -> str:
+    """
+    Créer la ligne FileBlob (ref_count 0) ou repousser son délai de grâce,
+    et valider aussitôt. Retourne le chemin relatif du contenu.
+    Une ligne touchée ne peut pas être collectée avant BLOB_GC_GRACE_SECONDS.
+    """
+    table = FileBlob.__table__
+    for _ in range(3):
+        now = datetime.utcnow()
+        touched = db.execute(
+            update(table).where(table.c.sha256 == sha256).values(touched_at=now)
+        ).rowcount
+        if not touched:
+            try:
+                db.execute(insert(table).values(
+                    sha256=sha256,
+                    size=size,
+                    mime_type=mime_type,
+                    storage_path=storage_path_for(sha256, mime_type),
+                    ref_count=0,
+                    created_at=now,
+                    touched_at=now
+                ))
+            except IntegrityError:
+                # Même contenu réservé au même instant par une autre requête
+                db.rollback()
+                continue
+        storage_path = db.query(FileBlob.storage_path).filter(FileBlob.sha256 == sha256).scalar()
+        db.commit()
+        return storage_path
+    raise BlobNotReserved(sha256)
+
+
+def install_blob(source_path: str, storage_path: str, keep_source: bool = False,
+                 content_type: Optional[str] = None) -> bool:
+    """
+    Mettre le contenu à sa place dans le backend s'il n'y est pas déjà.
+    Retourne True si le contenu a été écrit, False s'il était déjà stocké.
+    keep_source : la source reste en place (lien physique ou copie).
+    """
+    return storage.put_file(source_path, storage_path, content_type, keep_source)
+
+
+def acquire_blob(db: Session, sha256: str):
+    """Une référence de plus (sans commit : dans la transaction de l'appelant)"""
+    table = FileBlob.__table__
+    acquired = db.execute(
+        update(table).where(table.c.sha256 == sha256).values(ref_count=table.c.ref_count + 1)
+    ).rowcount
+    if acquired != 1:
+        raise BlobNotReserved(sha256)
+
+
+def release_blob(db: Session, sha256: Optional[str], count: int = 1):
+    """count références de moins (sans commit) ; le fichier reste jusqu'à la collecte"""
+    if not sha256:
+        return
+    table = FileBlob.__table__
+    db.execute(
+        update(table).where(table.c.sha256 == sha256, table.c.ref_count > 0).values(
+            ref_count=case((table.c.ref_count > count, table.c.ref_count - count), else_=0),
+            touched_at=datetime.utcnow()
+        )
+    )
+
+
+async def store_upload(
+    file: UploadFile,
+    max_size: int = MAX_FILE_SIZE,
+    allowed_types: Optional[Set[str]] = None
+) -> dict:
+    """
+    Enregistrer un upload dans le stockage dédupliqué (étapes 1 à 3).
+    L'appelant référence ensuite le contenu avec acquire_blob(db, sha256)
+    dans la transaction qui crée sa ligne.
+    """
+    spooled = await spool_upload(file, BLOB_DIR, max_size, allowed_types)
+    temp_path = spooled.pop("temp_path")
+    try:
+        storage_path = await run_db(reserve_blob, spooled["sha256"], spooled["size"], spooled["mime_type"])
+        created = await run_in_threadpool(
+            install_blob, temp_path, storage_path, False, spooled["mime_type"]
+        )
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    if not created:
+        print(f"♻️ Blob {spooled['sha256'][:12]} déjà stocké, {spooled['size']} octets non réécrits")
+    return {
+        **spooled,
+        "storage_path": storage_path,
+        "file_path": blob_location(storage_path),
+        "url": blob_url(storage_path),
+        "deduplicated": not created
+    }
+
+
+# ============================================
+# COLLECTE DES BLOBS SANS RÉFÉRENCE
+# ============================================
+
+def _collect_unreferenced(db: Session, limit: int) -> int:
+    cutoff = datetime.utcnow() - timedelta(seconds=BLOB_GC_GRACE_SECONDS)
+    table = FileBlob.__table__
+    rows = db.query(FileBlob.sha256, FileBlob.storage_path).filter(
+        FileBlob.ref_count <= 0,
+        FileBlob.touched_at < cutoff
+    ).limit(limit).all()
+
+    collected = 0
+    for row in rows:
+        # Conditions revérifiées sous verrou : une réservation concurrente gagne
+        deleted = db.execute(delete(table).where(
+            table.c.sha256 == row.sha256,
+            table.c.ref_count <= 0,
+            table.c.touched_at < cutoff
+        )).rowcount
+        if deleted:
+            # Effacé avant le commit : une réservation en attente du verrou
+            # retrouve une ligne absente et réinstalle le fichier
+            storage.delete(row.storage_path)
+            # Variantes d'image et aperçu PDF du même contenu (image_variants, document_previews)
+            remove_variants(row.sha256)
+            db.execute(delete(DocumentPreview.__table__).where(DocumentPreview.sha256 == row.sha256))
+            storage.delete(preview_key(row.sha256))
+            collected += 1
+        db.commit()
+    return collected
+
+
+class BlobCollector:
+    """Suppression périodique des blobs sans référence (et de leurs fichiers)"""
+
+    def __init__(self, interval: float = BLOB_GC_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.collected_count = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._collect_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _collect_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect()
+            except Exception as e:
+                print(f"❌ Blob collection failed: {e}")
+
+    async def collect(self) -> int:
+        collected = 0
+        while True:
+            count = await run_db(_collect_unreferenced, BLOB_GC_BATCH)
+            collected += count
+            if count < BLOB_GC_BATCH:
+                break
+        if collected:
+            self.collected_count += collected
+            print(f"🧹 Blob store: {collected} unreferenced blobs removed")
+        return collected
+
+
+blob_collector = BlobCollector()
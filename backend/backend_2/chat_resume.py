@@ -0,0 +1,122 @@
+# backend/chat_resume.py
+"""
+Reprise après reconnexion (delta sync) pour /chat/ws/{user_id}.
+
+Chaque message porte un numéro de séquence (seq) croissant dans sa
+conversation. Après une coupure, le client envoie :
+
+    {"type": "resume", "conversations": {"12": 340, "15": 0}}
+
+(dernier seq vu par conversation). Le serveur rejoue uniquement les messages
+manquants, par lots bornés, AVANT de laisser passer les frames live :
+
+    {"type": "resume_batch", "conversation_id": 12, "messages": [...]}
+    ...
+    {"type": "resume_complete", "conversations": {"12": 352, "15": 4},
+     "truncated": []}
+
+Une conversation dont l'écart dépasse RESUME_MAX_MESSAGES est listée dans
+"truncated" : le client recharge alors son historique via REST. Une frame
+live peut chevaucher la fin du rattrapage ; le client dédoublonne par seq.
+"""
+
+import os
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from conversation_cache import fetch_participants
+from database import run_db
+from message_archive import load_messages_after_seq
+from models import Message
+from read_receipts import load_watermarks
+from websocket_manager import ClientConnection
+
+RESUME_BATCH_SIZE = int(os.getenv("CHAT_RESUME_BATCH_SIZE", "100"))
+RESUME_MAX_MESSAGES = int(os.getenv("CHAT_RESUME_MAX_MESSAGES", "1000"))
+
+
+def serialize_message(message: Message, sender_name: str = None, is_read: bool = None) -> dict:
+    """Représentation d'un message dans les frames WebSocket"""
+    return {
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "seq": message.seq,
+        "sender_id": message.sender_id,
+        "sender_name": sender_name,
+        "content": message.content,
+        "message_type": message.message_type,
+        "file_url": message.file_url,
+        "created_at": message.created_at.isoformat(),
+        "is_read": message.is_read if is_read is None else is_read
+    }
+
+
+def _load_messages_after(db: Session, conversation_id: int, after_seq: int, limit: int) -> List[dict]:
+    """Messages de seq > after_seq, dans l'ordre (index conversation_id, seq), archive comprise"""
+    rows = load_messages_after_seq(db, conversation_id, after_seq, limit)
+    
+    # Lu = seq <= filigrane du destinataire (l'autre participant)
+    watermarks = load_watermarks(db, conversation_id)
+    
+    def is_read(message: Message) -> bool:
+        recipient_seq = max((seq for uid, seq in watermarks.items() if uid != message.sender_id), default=0)
+        return message.is_read or message.seq <= recipient_seq
+    
+    return [serialize_message(message, sender_name, is_read(message)) for message, sender_name in rows]
+
+
+def parse_resume_request(data: dict) -> Dict[int, int]:
+    """{"conversations": {"12": 340}} -> {12: 340} (entrées invalides ignorées)"""
+    conversations = data.get("conversations")
+    if not isinstance(conversations, dict):
+        return {}
+    last_seen = {}
+    for conversation_id, last_seq in conversations.items():
+        try:
+            last_seen[int(conversation_id)] = max(0, int(last_seq or 0))
+        except (TypeError, ValueError):
+            continue
+    return last_seen
+
+
+async def replay_missed_messages(connection: ClientConnection, user_id: int, last_seen: Dict[int, int]):
+    """Rejouer les messages manquants puis relâcher les frames live"""
+    connection.pause()
+    positions: Dict[str, int] = {}
+    truncated: List[int] = []
+    try:
+        for conversation_id, last_seq in last_seen.items():
+            participants = await fetch_participants(conversation_id)
+            if participants is None or user_id not in participants:
+                continue
+
+            replayed = 0
+            while True:
+                batch_size = min(RESUME_BATCH_SIZE, RESUME_MAX_MESSAGES - replayed)
+                if batch_size <= 0:
+                    if await run_db(_load_messages_after, conversation_id, last_seq, 1):
+                        truncated.append(conversation_id)
+                    break
+                messages = await run_db(_load_messages_after, conversation_id, last_seq, batch_size)
+                if not messages:
+                    break
+                await connection.send_direct({
+                    "type": "resume_batch",
+                    "conversation_id": conversation_id,
+                    "messages": messages
+                })
+                last_seq = messages[-1]["seq"]
+                replayed += len(messages)
+                if len(messages) < batch_size:
+                    break
+
+            positions[str(conversation_id)] = last_seq
+
+        await connection.send_direct({
+            "type": "resume_complete",
+            "conversations": positions,
+            "truncated": truncated
+        })
+    finally:
+        connection.resume()
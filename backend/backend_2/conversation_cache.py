@@ -0,0 +1,74 @@
+# backend/conversation_cache.py
+"""
+Cache LRU des participants d'une conversation.
+
+Les participants d'une conversation (patient, médecin) ne changent jamais :
+le chemin temps réel n'a donc pas besoin de relire la table conversations
+pour chaque frame reçue.
+"""
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+import os
+
+from sqlalchemy.orm import Session
+
+from database import run_db
+from models import Conversation
+
+CACHE_SIZE = int(os.getenv("CHAT_CONVERSATION_CACHE_SIZE", "10000"))
+
+# conversation_id -> (patient_id, medecin_id)
+_participants: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()
+
+
+def get_cached_participants(conversation_id: int) -> Optional[Tuple[int, int]]:
+    """Participants en cache, sans accès base"""
+    participants = _participants.get(conversation_id)
+    if participants is not None:
+        _participants.move_to_end(conversation_id)
+    return participants
+
+
+def remember_participants(conversation_id: int, patient_id: int, medecin_id: int):
+    """Ajouter une conversation au cache (éviction LRU)"""
+    _participants[conversation_id] = (patient_id, medecin_id)
+    _participants.move_to_end(conversation_id)
+    while len(_participants) > CACHE_SIZE:
+        _participants.popitem(last=False)
+
+
+def forget_conversation(conversation_id: int):
+    """Retirer une conversation supprimée du cache"""
+    _participants.pop(conversation_id, None)
+
+
+def _load_participants(db: Session, conversation_id: int) -> Optional[Tuple[int, int]]:
+    row = db.query(Conversation.patient_id, Conversation.medecin_id).filter(
+        Conversation.id == conversation_id
+    ).first()
+    return (row.patient_id, row.medecin_id) if row is not None else None
+
+
+def get_participants(conversation_id: int, db: Session) -> Optional[Tuple[int, int]]:
+    """Participants (patient_id, medecin_id) d'une conversation, ou None si elle n'existe pas"""
+    participants = get_cached_participants(conversation_id)
+    if participants is not None:
+        return participants
+
+    participants = _load_participants(db, conversation_id)
+    if participants is not None:
+        remember_participants(conversation_id, *participants)
+    return participants
+
+
+async def fetch_participants(conversation_id: int) -> Optional[Tuple[int, int]]:
+    """Comme get_participants, mais sans bloquer la boucle asyncio (pool DB dédié)"""
+    participants = get_cached_participants(conversation_id)
+    if participants is not None:
+        return participants
+
+    participants = await run_db(_load_participants, conversation_id)
+    if participants is not None:
+        remember_participants(conversation_id, *participants)
+    return participants
@@ -3,8 +3,10 @@
 Opérations CRUD (Create, Read, Update, Delete) pour tous les modèles
 """
 
+from sqlalchemy import func, or_, select
 from sqlalchemy.orm import Session
-from models import User, Appointment, MedicalDocument
+from models import User, Appointment, MedicalDocument, Conversation, Message, ChatAttachment
+from blob_store import release_blob
 from datetime import datetime
 from typing import List, Optional
 
@@ -63,6 +65,21 @@ def delete_user(db: Session, user_id: int) -> bool:
     if not user:
         return False
     
+    # Documents supprimés en cascade : libérer leurs contenus
+    for document in user.documents:
+        release_blob(db, document.blob_sha256)
+    # Pièces jointes supprimées en cascade (conversations -> messages -> pièces jointes)
+    conversation_ids = select(Conversation.id).where(
+        or_(Conversation.patient_id == user_id, Conversation.medecin_id == user_id)
+    )
+    attachment_blobs = db.query(ChatAttachment.blob_sha256, func.count()).join(
+        Message, Message.id == ChatAttachment.message_id
+    ).filter(
+        ChatAttachment.blob_sha256.isnot(None),
+        or_(Message.conversation_id.in_(conversation_ids), Message.sender_id == user_id)
+    ).group_by(ChatAttachment.blob_sha256).all()
+    for sha256, count in attachment_blobs:
+        release_blob(db, sha256, count)
     db.delete(user)
     db.commit()
     return True
@@ -256,6 +273,7 @@ def delete_document(db: Session, document_id: int) -> bool:
     if not document:
         return False
     
+    release_blob(db, document.blob_sha256)
     db.delete(document)
     db.commit()
     return True
@@ -1,4 +1,6 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -19,3 +21,34 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# ============================================
+# ACCÈS BASE DEPUIS LA BOUCLE ASYNCIO
+# ============================================
+
+# Pool de threads dédié aux requêtes du chemin temps réel (WebSocket).
+# Borné pour ne jamais ouvrir plus de connexions que le pool SQLAlchemy.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_in_db_executor(fn, *args):
+    """Exécuter une fonction bloquante dans le pool dédié sans bloquer la boucle"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, fn, *args)
+
+
+def _call_with_session(fn, args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def run_db(fn, *args):
+    """
+    Exécuter fn(db, *args) avec une session dédiée, dans le pool de threads.
+    fn doit être synchrone et ne pas retourner d'objets ORM attachés à la session.
+    """
+    return await run_in_db_executor(_call_with_session, fn, args)
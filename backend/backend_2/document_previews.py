@@ -0,0 +1,182 @@
+# backend/document_previews.py
+"""
+Aperçus et texte des PDF, produits hors requête.
+
+Un médecin ouvrait une ordonnance ou une analyse pour savoir ce que c'est :
+le PDF entier était téléchargé sur le téléphone. La liste des documents
+renvoie maintenant un aperçu de la première page et le début du texte,
+produits une fois par contenu (SHA-256) :
+
+1. file_validation déclare un PDF sain -> sha256 déposé dans une file bornée
+2. copie locale du contenu si le stockage est distant (S3)
+3. rendu de la première page (WebP) et extraction du texte
+   (utils/pdf_preview.py, pypdfium2) dans un pool de processus borné
+   (DOCUMENT_PREVIEW_WORKERS)
+4. aperçu déposé dans le backend de stockage (disque local ou S3, comme
+   les contenus), servi seulement au propriétaire du document
+   (GET /users/document/preview/...)
+5. ligne DocumentPreview : clé de l'aperçu, extrait, texte complet
+
+Le même PDF envoyé par plusieurs patients n'est rendu qu'une fois. File
+pleine ou redémarrage : le balayage reprend les PDF sains sans aperçu.
+PDF illisible ou protégé : status "failed", pas de nouvel essai.
+Sans pypdfium2, le worker ne démarre pas (pas d'aperçu, rien d'autre ne change).
+"""
+
+import asyncio
+import importlib.util
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from background_worker import QueueWorker, spawn_process_pool
+from blob_store import SCAN_CLEAN, storage
+from database import run_db
+from models import DocumentPreview, FileBlob
+from utils.pdf_preview import make_snippet, preview_key, render_pdf_preview
+
+DOCUMENT_PREVIEW_WORKERS = int(os.getenv("DOCUMENT_PREVIEW_WORKERS", "1"))
+DOCUMENT_PREVIEW_QUEUE_SIZE = int(os.getenv("DOCUMENT_PREVIEW_QUEUE_SIZE", "1000"))
+DOCUMENT_PREVIEW_SWEEP_INTERVAL = float(os.getenv("DOCUMENT_PREVIEW_SWEEP_INTERVAL", "300"))
+DOCUMENT_PREVIEW_SWEEP_BATCH = 200
+
+PDF_MIME_TYPE = "application/pdf"
+PREVIEW_MIME_TYPE = "image/webp"
+PREVIEW_READY = "ready"
+PREVIEW_FAILED = "failed"
+
+
+# ============================================
+# ACCÈS BASE (POOL DB)
+# ============================================
+
+def _preview_source(db: Session, sha256: str) -> Optional[str]:
+    """storage_path d'un PDF sain encore sans aperçu, sinon None"""
+    return db.query(FileBlob.storage_path).outerjoin(
+        DocumentPreview, DocumentPreview.sha256 == FileBlob.sha256
+    ).filter(
+        FileBlob.sha256 == sha256,
+        FileBlob.mime_type == PDF_MIME_TYPE,
+        FileBlob.scan_status == SCAN_CLEAN,
+        DocumentPreview.sha256.is_(None)
+    ).scalar()
+
+
+def _record_preview(db: Session, values: dict) -> bool:
+    try:
+        db.execute(insert(DocumentPreview.__table__).values(**values))
+        db.commit()
+        return True
+    except IntegrityError:
+        # Déjà enregistré (deux tâches pour le même contenu), ou blob collecté entre-temps
+        db.rollback()
+        return False
+
+
+def _pdfs_missing_preview(db: Session, limit: int) -> List[str]:
+    rows = db.query(FileBlob.sha256).outerjoin(
+        DocumentPreview, DocumentPreview.sha256 == FileBlob.sha256
+    ).filter(
+        FileBlob.mime_type == PDF_MIME_TYPE,
+        FileBlob.scan_status == SCAN_CLEAN,
+        FileBlob.ref_count > 0,
+        DocumentPreview.sha256.is_(None)
+    ).order_by(FileBlob.created_at.desc()).limit(limit).all()
+    return [row.sha256 for row in rows]
+
+
+# ============================================
+# FILE + POOL DE PROCESSUS
+# ============================================
+
+class DocumentPreviewWorker(QueueWorker):
+    """File bornée de sha256 (PDF sains), rendus dans un pool de processus"""
+
+    name = "Document preview"
+    item_label = "blob"
+
+    def __init__(self, workers: int = DOCUMENT_PREVIEW_WORKERS, queue_size: int = DOCUMENT_PREVIEW_QUEUE_SIZE):
+        super().__init__(workers, queue_size, DOCUMENT_PREVIEW_SWEEP_INTERVAL)
+        # Métriques
+        self.rendered_count = 0
+        self.failed_count = 0
+        self.render_ms_total = 0
+
+    def can_start(self) -> bool:
+        if importlib.util.find_spec("pypdfium2") is None:
+            print("⚠️ pypdfium2 non installé : aperçus PDF désactivés")
+            return False
+        return True
+
+    def create_pool(self) -> ProcessPoolExecutor:
+        return spawn_process_pool(self.workers)
+
+    async def process(self, sha256: str):
+        storage_path = await run_db(_preview_source, sha256)
+        if storage_path is None:
+            return
+
+        # Stockage indisponible : exception propagée, le balayage réessaiera
+        source, temporary = await run_in_threadpool(storage.fetch, storage_path)
+        fd, output_path = tempfile.mkstemp(prefix="preview-", suffix=".webp")
+        os.close(fd)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._pool, render_pdf_preview, source, output_path)
+        except Exception as e:
+            # PDF illisible ou protégé : enregistré, pas de nouvel essai
+            os.unlink(output_path)
+            self.failed_count += 1
+            print(f"❌ Document preview failed for blob {sha256[:12]}: {e}")
+            await run_db(_record_preview, {
+                "sha256": sha256,
+                "status": PREVIEW_FAILED,
+                "error": str(e)[:255]
+            })
+            return
+        finally:
+            if temporary:
+                os.unlink(source)
+
+        render_ms = int((time.perf_counter() - started) * 1000)
+        key = preview_key(sha256)
+        # Fichier temporaire consommé ; stockage indisponible : le balayage réessaiera
+        await run_in_threadpool(storage.put_file, output_path, key, PREVIEW_MIME_TYPE)
+        if await run_db(_record_preview, {
+            "sha256": sha256,
+            "status": PREVIEW_READY,
+            "page_count": result["page_count"],
+            "preview_path": key,
+            "text_snippet": make_snippet(result["text"]),
+            "text_content": result["text"],
+            "render_ms": render_ms
+        }):
+            self.rendered_count += 1
+            self.render_ms_total += render_ms
+
+    async def sweep(self) -> int:
+        """Remettre en file les PDF sains sans aperçu"""
+        pending = await run_db(_pdfs_missing_preview, DOCUMENT_PREVIEW_SWEEP_BATCH)
+        queued = sum(1 for sha256 in pending if self.submit(sha256))
+        if queued:
+            print(f"📄 Document previews: {queued} PDFs queued by the sweep")
+        return queued
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "rendered": self.rendered_count,
+            "failed": self.failed_count,
+            "avg_render_ms": round(self.render_ms_total / self.rendered_count) if self.rendered_count else None
+        }
+
+
+document_preview_worker = DocumentPreviewWorker()
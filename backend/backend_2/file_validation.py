@@ -0,0 +1,281 @@
+# backend/file_validation.py
+"""
+Validation des fichiers uploadés hors requête (quarantaine).
+
+Un contenu nouvellement stocké (FileBlob, dédupliqué par SHA-256) est en
+quarantaine : scan_status "pending", téléchargements refusés (423). Après
+le commit de sa ligne, l'upload dépose (sha256, message_id) dans une file
+bornée ; FileValidationWorker enchaîne dans un pool de threads borné
+(FILE_VALIDATION_WORKERS) les étapes de utils/file_validator.py :
+
+1. fetch : copie locale du contenu (stockage S3), sinon chemin sur disque
+2. sniff : type réel comparé au type enregistré, types interdits
+3. image : décodage de contrôle des images
+4. scan  : antivirus (clamd via FILE_SCANNER_URL)
+
+Résultat enregistré une seule fois par contenu : scan_status "clean",
+"rejected" ou "infected", scan_detail, scan_timings (ms par étape).
+Un contenu déjà analysé (même SHA-256) n'est jamais réanalysé.
+
+À la sortie de quarantaine, frame aux participants de chaque conversation
+où le contenu est joint :
+
+    {"type": "attachment_status", "conversation_id": 12, "message_id": 345,
+     "attachment_id": 67, "status": "clean"}
+
+et, si le contenu est sain, les images partent vers image_variants et les
+PDF vers document_previews.
+
+Antivirus injoignable : le contenu reste en quarantaine ; le balayage
+(FILE_VALIDATION_SWEEP_INTERVAL) reprend les contenus référencés encore
+"pending", comme après un redémarrage ou une file pleine.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from background_worker import QueueWorker
+from blob_store import SCAN_CLEAN, SCAN_INFECTED, SCAN_PENDING, SCAN_REJECTED, storage
+from conversation_cache import fetch_participants
+from database import run_db
+from document_previews import PDF_MIME_TYPE, document_preview_worker
+from image_variants import image_variant_worker
+from models import ChatAttachment, FileBlob, Message
+from utils.file_validator import MalwareScanner, check_mime_type, create_scanner_from_env, validate_image_content
+from websocket_manager import manager
+
+FILE_VALIDATION_WORKERS = int(os.getenv("FILE_VALIDATION_WORKERS", "2"))
+FILE_VALIDATION_QUEUE_SIZE = int(os.getenv("FILE_VALIDATION_QUEUE_SIZE", "1000"))
+FILE_VALIDATION_SWEEP_INTERVAL = float(os.getenv("FILE_VALIDATION_SWEEP_INTERVAL", "60"))
+FILE_VALIDATION_SWEEP_BATCH = 200
+
+STAGES = ("fetch", "sniff", "image", "scan")
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def run_pipeline(file_path: str, expected_mime_type: Optional[str],
+                 scanner: MalwareScanner) -> Tuple[str, Optional[str], Dict[str, float]]:
+    """
+    Étapes sniff, image, scan sur un fichier local. Retourne
+    (statut, détail, durées en ms). ScannerError si l'antivirus ne répond pas.
+    """
+    timings: Dict[str, float] = {}
+
+    started = time.perf_counter()
+    real_mime_type, reason = check_mime_type(file_path, expected_mime_type)
+    timings["sniff"] = _elapsed_ms(started)
+    if reason:
+        return SCAN_REJECTED, reason, timings
+
+    if real_mime_type.startswith("image/"):
+        started = time.perf_counter()
+        try:
+            valid = validate_image_content(file_path)
+        except ImportError:
+            # Pillow absent : étape sautée
+            valid = True
+        else:
+            timings["image"] = _elapsed_ms(started)
+        if not valid:
+            return SCAN_REJECTED, f"image illisible ({real_mime_type})", timings
+
+    started = time.perf_counter()
+    signature = scanner.scan(file_path)
+    timings["scan"] = _elapsed_ms(started)
+    if signature:
+        return SCAN_INFECTED, signature, timings
+    return SCAN_CLEAN, None, timings
+
+
+# ============================================
+# ACCÈS BASE (POOL DB)
+# ============================================
+
+def _blob_to_validate(db: Session, sha256: str) -> Optional[dict]:
+    blob = db.query(FileBlob.storage_path, FileBlob.mime_type, FileBlob.scan_status).filter(
+        FileBlob.sha256 == sha256
+    ).first()
+    if blob is None:
+        return None
+    return {"storage_path": blob.storage_path, "mime_type": blob.mime_type, "scan_status": blob.scan_status}
+
+
+def _record_result(db: Session, sha256: str, status: str, detail: Optional[str],
+                   timings: Dict[str, float]) -> bool:
+    """Sortie de quarantaine, une seule fois par contenu"""
+    table = FileBlob.__table__
+    recorded = db.execute(
+        update(table).where(
+            table.c.sha256 == sha256, table.c.scan_status == SCAN_PENDING
+        ).values(
+            scan_status=status,
+            scan_detail=detail[:255] if detail else None,
+            scan_timings=json.dumps(timings),
+            scanned_at=datetime.utcnow()
+        )
+    ).rowcount
+    db.commit()
+    return bool(recorded)
+
+
+def _attachments_of_blob(db: Session, sha256: str, message_id: Optional[int]) -> List[dict]:
+    query = db.query(
+        ChatAttachment.id, ChatAttachment.message_id, ChatAttachment.file_type, Message.conversation_id
+    ).join(Message, Message.id == ChatAttachment.message_id).filter(ChatAttachment.blob_sha256 == sha256)
+    if message_id is not None:
+        query = query.filter(ChatAttachment.message_id == message_id)
+    return [
+        {
+            "id": row.id,
+            "message_id": row.message_id,
+            "file_type": row.file_type,
+            "conversation_id": row.conversation_id
+        }
+        for row in query.all()
+    ]
+
+
+def _pending_blobs(db: Session, limit: int) -> List[str]:
+    # Référencés uniquement : un contenu réservé mais pas encore commité n'a pas de fichier garanti
+    rows = db.query(FileBlob.sha256).filter(
+        FileBlob.scan_status == SCAN_PENDING,
+        FileBlob.ref_count > 0
+    ).order_by(FileBlob.created_at).limit(limit).all()
+    return [row.sha256 for row in rows]
+
+
+# ============================================
+# FILE + POOL DE THREADS
+# ============================================
+
+class FileValidationWorker(QueueWorker):
+    """File bornée de (sha256, message_id), analyses dans un pool de threads"""
+
+    name = "File validation"
+    item_label = "blob"
+
+    def __init__(self, workers: int = FILE_VALIDATION_WORKERS, queue_size: int = FILE_VALIDATION_QUEUE_SIZE):
+        super().__init__(workers, queue_size, FILE_VALIDATION_SWEEP_INTERVAL)
+        self.scanner: Optional[MalwareScanner] = None
+        # Contenus en cours d'analyse (un même SHA-256 peut être soumis plusieurs fois)
+        self._in_progress: Set[str] = set()
+
+        # Métriques
+        self.results: Dict[str, int] = {SCAN_CLEAN: 0, SCAN_REJECTED: 0, SCAN_INFECTED: 0}
+        self.stage_totals: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.stage_counts: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.stage_max: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+
+    def create_pool(self) -> ThreadPoolExecutor:
+        self.scanner = create_scanner_from_env()
+        print(f"🛡️ File validation started ({self.workers} workers, scanner: {self.scanner.name})")
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="file-validation")
+
+    def _validate(self, blob: dict) -> Tuple[str, Optional[str], Dict[str, float]]:
+        """Exécuté dans le pool : copie locale, étapes, nettoyage"""
+        started = time.perf_counter()
+        file_path, temporary = storage.fetch(blob["storage_path"])
+        fetch_ms = _elapsed_ms(started)
+        try:
+            status, detail, timings = run_pipeline(file_path, blob["mime_type"], self.scanner)
+        finally:
+            if temporary:
+                os.unlink(file_path)
+        return status, detail, {"fetch": fetch_ms, **timings}
+
+    async def process(self, sha256: str, message_id: Optional[int] = None):
+        blob = await run_db(_blob_to_validate, sha256)
+        if blob is None:
+            return
+        if blob["scan_status"] != SCAN_PENDING:
+            # Contenu déjà analysé (renvoyé à l'identique) : seul ce message est concerné
+            if message_id is not None:
+                await self._release(sha256, blob["scan_status"], message_id)
+            return
+        if sha256 in self._in_progress:
+            # L'analyse en cours libérera toutes les pièces jointes de ce contenu
+            return
+
+        self._in_progress.add(sha256)
+        try:
+            loop = asyncio.get_running_loop()
+            status, detail, timings = await loop.run_in_executor(self._pool, self._validate, blob)
+        finally:
+            self._in_progress.discard(sha256)
+
+        if not await run_db(_record_result, sha256, status, detail, timings):
+            return
+        self._record_metrics(status, timings)
+        if status != SCAN_CLEAN:
+            print(f"🚫 Blob {sha256[:12]} {status}: {detail}")
+        elif blob["mime_type"] == PDF_MIME_TYPE:
+            document_preview_worker.submit(sha256)
+        await self._release(sha256, status, None)
+
+    def _record_metrics(self, status: str, timings: Dict[str, float]):
+        self.results[status] = self.results.get(status, 0) + 1
+        for stage, elapsed in timings.items():
+            self.stage_totals[stage] += elapsed
+            self.stage_counts[stage] += 1
+            self.stage_max[stage] = max(self.stage_max[stage], elapsed)
+
+    async def _release(self, sha256: str, status: str, message_id: Optional[int]):
+        """
+        Suite de l'analyse : frame attachment_status (sortie de quarantaine,
+        message_id None) et variantes des images saines
+        """
+        attachments = await run_db(_attachments_of_blob, sha256, message_id)
+        if status == SCAN_CLEAN:
+            for image_message_id in {a["message_id"] for a in attachments if a["file_type"].startswith("image/")}:
+                image_variant_worker.submit(image_message_id)
+        if message_id is not None:
+            return
+        for attachment in attachments:
+            participants = await fetch_participants(attachment["conversation_id"])
+            if not participants:
+                continue
+            await manager.broadcast_to_conversation({
+                "type": "attachment_status",
+                "conversation_id": attachment["conversation_id"],
+                "message_id": attachment["message_id"],
+                "attachment_id": attachment["id"],
+                "status": status
+            }, list(participants))
+
+    async def sweep(self) -> int:
+        """Remettre en file les contenus référencés encore en quarantaine"""
+        pending = await run_db(_pending_blobs, FILE_VALIDATION_SWEEP_BATCH)
+        queued = sum(1 for sha256 in pending if sha256 not in self._in_progress and self.submit(sha256))
+        if queued:
+            print(f"🛡️ File validation: {queued} blobs queued by the sweep")
+        return queued
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "in_progress": len(self._in_progress),
+            "results": dict(self.results),
+            "stages": {
+                stage: {
+                    "count": self.stage_counts[stage],
+                    "avg_ms": round(self.stage_totals[stage] / self.stage_counts[stage], 2)
+                    if self.stage_counts[stage] else None,
+                    "max_ms": self.stage_max[stage]
+                }
+                for stage in STAGES
+            }
+        }
+
+
+file_validation_worker = FileValidationWorker()
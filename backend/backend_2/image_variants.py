@@ -0,0 +1,211 @@
+# backend/image_variants.py
+"""
+Génération des variantes d'images hors requête.
+
+Décoder une photo de 12 MP avec PIL bloque la boucle asyncio plusieurs
+centaines de millisecondes : l'upload ne fait plus que déposer une tâche
+(message_id) dans une file bornée, et ImageVariantWorker la traite dans un
+pool de processus borné (IMAGE_VARIANT_WORKERS) :
+
+1. pièces jointes image du message sans thumbnail_path, dont le contenu a
+   été analysé et déclaré sain (file_validation soumet le message ensuite)
+2. variantes WebP (utils/image_processing.py) ; déjà sur disque pour ce
+   contenu (même SHA-256) : rien n'est décodé. Contenu hors disque (S3) :
+   copié dans un fichier temporaire le temps du rendu
+3. ChatAttachment.thumbnail_path = chemin de la miniature
+4. frame aux participants de la conversation :
+
+    {"type": "attachment_variants", "conversation_id": 12, "message_id": 345,
+     "attachment_id": 67, "variants": {"thumb": "/uploads/variants/...",
+     "bubble": "...", "full": "..."}}
+
+File pleine : la tâche est abandonnée, et reprise par le balayage suivant
+(pièces jointes récentes sans variantes), comme après un redémarrage.
+Image illisible : thumbnail_path = "" (pas de variantes, pas de nouvel essai).
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from background_worker import QueueWorker, spawn_process_pool
+from blob_store import SCAN_CLEAN, storage
+from conversation_cache import fetch_participants
+from database import run_db
+from models import ChatAttachment, FileBlob, Message
+from utils.image_processing import (
+    THUMBNAIL_VARIANT, VARIANT_DIR, VARIANTS, render_variants, variant_files, variant_path, variant_paths
+)
+from websocket_manager import manager
+
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", "2"))
+IMAGE_VARIANT_QUEUE_SIZE = int(os.getenv("IMAGE_VARIANT_QUEUE_SIZE", "1000"))
+# Balayage des pièces jointes restées sans variantes (file pleine, redémarrage)
+IMAGE_VARIANT_SWEEP_INTERVAL = float(os.getenv("IMAGE_VARIANT_SWEEP_INTERVAL", "300"))
+IMAGE_VARIANT_SWEEP_HOURS = float(os.getenv("IMAGE_VARIANT_SWEEP_HOURS", "24"))
+IMAGE_VARIANT_SWEEP_BATCH = 500
+
+VARIANT_URL_PREFIX = "/uploads/variants"
+_THUMBNAIL_SUFFIX = f"_{THUMBNAIL_VARIANT}.webp"
+
+
+def variant_key(attachment_id: int, blob_sha256: Optional[str]) -> str:
+    """Contenu dédupliqué : clé = hash (variantes partagées) ; sinon propre à la pièce jointe"""
+    return blob_sha256 or f"attachment-{attachment_id}"
+
+
+def variant_url(path: str) -> str:
+    return f"{VARIANT_URL_PREFIX}/{os.path.relpath(path, VARIANT_DIR).replace(os.sep, '/')}"
+
+
+def variant_urls(thumbnail_path: Optional[str]) -> Optional[Dict[str, str]]:
+    """URLs de toutes les variantes, à partir du thumbnail_path enregistré"""
+    if not thumbnail_path or not thumbnail_path.endswith(_THUMBNAIL_SUFFIX):
+        return None
+    key = os.path.basename(thumbnail_path)[:-len(_THUMBNAIL_SUFFIX)]
+    return {name: variant_url(variant_path(key, name)) for name in VARIANTS}
+
+
+# ============================================
+# ACCÈS BASE (POOL DB)
+# ============================================
+
+def _cleared():
+    """Contenu analysé et sain (ou ancien fichier hors stockage dédupliqué) ; FileBlob joint"""
+    return or_(ChatAttachment.blob_sha256.is_(None), FileBlob.scan_status == SCAN_CLEAN)
+
+
+def _pending_images(db: Session, message_id: int) -> List[dict]:
+    rows = db.query(ChatAttachment, Message.conversation_id, FileBlob.storage_path).join(
+        Message, Message.id == ChatAttachment.message_id
+    ).outerjoin(
+        FileBlob, FileBlob.sha256 == ChatAttachment.blob_sha256
+    ).filter(
+        ChatAttachment.message_id == message_id,
+        ChatAttachment.file_type.like("image/%"),
+        ChatAttachment.thumbnail_path.is_(None),
+        _cleared()
+    ).all()
+    return [
+        {
+            "id": attachment.id,
+            "message_id": attachment.message_id,
+            "conversation_id": conversation_id,
+            "file_path": attachment.file_path,
+            "storage_path": storage_path,
+            "key": variant_key(attachment.id, attachment.blob_sha256)
+        }
+        for attachment, conversation_id, storage_path in rows
+    ]
+
+
+def _record_variants(db: Session, attachment_id: int, thumbnail_path: str) -> bool:
+    table = ChatAttachment.__table__
+    recorded = db.execute(
+        update(table).where(
+            table.c.id == attachment_id, table.c.thumbnail_path.is_(None)
+        ).values(thumbnail_path=thumbnail_path)
+    ).rowcount
+    db.commit()
+    return bool(recorded)
+
+
+def _messages_missing_variants(db: Session, since: datetime, limit: int) -> List[int]:
+    rows = db.query(ChatAttachment.message_id).outerjoin(
+        FileBlob, FileBlob.sha256 == ChatAttachment.blob_sha256
+    ).filter(
+        ChatAttachment.created_at >= since,
+        ChatAttachment.file_type.like("image/%"),
+        ChatAttachment.thumbnail_path.is_(None),
+        _cleared()
+    ).distinct().limit(limit).all()
+    return [row.message_id for row in rows]
+
+
+# ============================================
+# FILE + POOL DE PROCESSUS
+# ============================================
+
+class ImageVariantWorker(QueueWorker):
+    """File bornée de message_id, rendus dans un pool de processus"""
+
+    name = "Image variants"
+    item_label = "message"
+
+    def __init__(self, workers: int = IMAGE_VARIANT_WORKERS, queue_size: int = IMAGE_VARIANT_QUEUE_SIZE):
+        super().__init__(workers, queue_size, IMAGE_VARIANT_SWEEP_INTERVAL)
+        # Métriques
+        self.rendered_count = 0
+        self.cached_count = 0
+        self.failed_count = 0
+
+    def create_pool(self) -> ProcessPoolExecutor:
+        return spawn_process_pool(self.workers)
+
+    async def process(self, message_id: int):
+        loop = asyncio.get_running_loop()
+        for image in await run_db(_pending_images, message_id):
+            if len(variant_files(image["key"])) == len(VARIANTS):
+                paths = variant_paths(image["key"])
+                self.cached_count += 1
+            else:
+                # Stockage indisponible : exception propagée, le balayage réessaiera
+                if image["storage_path"]:
+                    source, temporary = await run_in_threadpool(storage.fetch, image["storage_path"])
+                else:
+                    source, temporary = image["file_path"], False
+                try:
+                    paths = await loop.run_in_executor(
+                        self._pool, render_variants, source, image["key"]
+                    )
+                except Exception as e:
+                    # Image illisible : chaîne vide, le balayage ne la reprend pas
+                    self.failed_count += 1
+                    print(f"❌ Image variants failed for attachment {image['id']}: {e}")
+                    await run_db(_record_variants, image["id"], "")
+                    continue
+                finally:
+                    if temporary:
+                        os.unlink(source)
+                self.rendered_count += 1
+
+            if await run_db(_record_variants, image["id"], paths[THUMBNAIL_VARIANT]):
+                await self._announce(image, paths[THUMBNAIL_VARIANT])
+
+    async def _announce(self, image: dict, thumbnail_path: str):
+        participants = await fetch_participants(image["conversation_id"])
+        if not participants:
+            return
+        await manager.broadcast_to_conversation({
+            "type": "attachment_variants",
+            "conversation_id": image["conversation_id"],
+            "message_id": image["message_id"],
+            "attachment_id": image["id"],
+            "variants": variant_urls(thumbnail_path)
+        }, list(participants))
+
+    async def sweep(self) -> int:
+        """Remettre en file les messages récents dont des images n'ont pas de variantes"""
+        since = datetime.utcnow() - timedelta(hours=IMAGE_VARIANT_SWEEP_HOURS)
+        message_ids = await run_db(_messages_missing_variants, since, IMAGE_VARIANT_SWEEP_BATCH)
+        queued = sum(1 for message_id in message_ids if self.submit(message_id))
+        if queued:
+            print(f"🖼️ Image variants: {queued} messages queued by the sweep")
+        return queued
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "rendered": self.rendered_count,
+            "cached": self.cached_count,
+            "failed": self.failed_count
+        }
+
+
+image_variant_worker = ImageVariantWorker()
@@ -3,8 +3,12 @@ import os
 from database import engine, Base
 from routers import doctors, appointments, documents
 import auth
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from blob_store import BLOB_DIR, LEGACY_BLOB_DIR
+from resumable_uploads import PARTIAL_DIR
+from utils.file_handler import MAX_FILE_SIZE
+from utils.file_response import PublicStaticFiles
+from utils.upload_limit import UploadSizeLimitMiddleware
 # Create tables
 Base.metadata.create_all(bind=engine)
 
@@ -18,24 +22,91 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Uploads trop volumineux refusés avant la lecture du corps
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        "/chat/upload": MAX_FILE_SIZE,
+        "/users/upload-document/": auth.MAX_DOCUMENT_SIZE,
+        # PATCH des uploads reprenables : jamais plus que le fichier entier
+        "/upload-sessions/": max(MAX_FILE_SIZE, auth.MAX_DOCUMENT_SIZE),
+    },
+)
 # Créer le dossier uploads
 os.makedirs("uploads/chat", exist_ok=True)
 
-# Servir les fichiers uploadés
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-# Servir les fichiers uploadés
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Servir les fichiers uploadés (jamais les contenus en quarantaine ni les uploads partiels,
+# même si BLOB_STORE_DIR ou UPLOAD_PARTIAL_DIR pointent sous uploads/)
+app.mount(
+    "/uploads",
+    PublicStaticFiles(directory="uploads", private_dirs=[LEGACY_BLOB_DIR, BLOB_DIR, PARTIAL_DIR]),
+    name="uploads"
+)
 
 # Importer les routers
-from routers import chat, chat_files
+from routers import chat, chat_files, upload_sessions
 app.include_router(chat.router)
 app.include_router(chat_files.router)
+app.include_router(upload_sessions.router)
 
 app.include_router(auth.router)
 app.include_router(doctors.router)
 app.include_router(appointments.router)
 app.include_router(documents.router)
 
+# Pub/sub WebSocket (registre des sockets entre workers)
+from websocket_manager import manager
+# Écriture groupée des messages du chat
+from message_writer import message_writer
+from offline_outbox import offline_outbox
+from presence import presence
+from read_receipts import read_receipts
+# Déplacement des messages froids vers messages_archive
+from message_archive import message_archiver
+# Purge des uploads reprenables abandonnés
+from resumable_uploads import upload_janitor
+# Suppression des fichiers dédupliqués qui ne sont plus référencés
+from blob_store import blob_collector
+# Miniatures et variantes d'images (pool de processus)
+from image_variants import image_variant_worker
+# Quarantaine des fichiers : type réel, images, antivirus (pool de threads)
+from file_validation import file_validation_worker
+# Aperçu de la première page et texte des PDF (pool de processus)
+from document_previews import document_preview_worker
+
+@app.on_event("startup")
+async def start_connection_manager():
+    await manager.start()
+    message_writer.start()
+    # Événements sans destinataire connecté -> file hors-ligne
+    manager.offline_sink = offline_outbox.enqueue
+    offline_outbox.start()
+    # Présence : mise à jour à la première / dernière socket de chaque utilisateur
+    manager.presence_hook = presence.on_connection_change
+    presence.start()
+    read_receipts.start()
+    message_archiver.start()
+    upload_janitor.start()
+    blob_collector.start()
+    image_variant_worker.start()
+    file_validation_worker.start()
+    document_preview_worker.start()
+
+@app.on_event("shutdown")
+async def stop_connection_manager():
+    await manager.stop()
+    await presence.stop()
+    # Écrire les messages encore en attente avant de quitter
+    await message_writer.stop()
+    await read_receipts.stop()
+    await offline_outbox.stop()
+    await message_archiver.stop()
+    await upload_janitor.stop()
+    await blob_collector.stop()
+    await image_variant_worker.stop()
+    await file_validation_worker.stop()
+    await document_preview_worker.stop()
+
 # endpoint racine
 @app.get("/")
 def root():
@@ -0,0 +1,245 @@
+# backend/message_archive.py
+"""
+Tier chaud / tier froid des messages.
+
+La table messages ne garde que l'historique vivant ; un déplaceur
+(MessageArchiver) transfère par lots vers messages_archive, en conservant
+les id, les messages :
+
+- plus anciens que CHAT_ARCHIVE_AFTER_DAYS jours
+- déjà lus par leur destinataire (seq <= son filigrane) : les compteurs de
+  non-lus et le filigrane ne regardent donc que le tier chaud
+- sans pièce jointe ni notification (clés étrangères vers messages.id)
+
+Chaque lot est une transaction INSERT ... SELECT puis DELETE ; sur
+PostgreSQL les lignes sont verrouillées (SKIP LOCKED) pour que plusieurs
+workers puissent tourner en même temps.
+
+Les lectures (historique, reprise, recherche) passent par les fonctions
+load_* ci-dessous, qui interrogent les deux tiers et fusionnent. Quand la
+page est déjà complète dans le tier chaud, la requête sur l'archive est
+bornée à la page elle-même : une sonde d'index vide pour les messages récents.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from database import run_db
+from models import ChatAttachment, ChatNotification, Message, MessageArchive, MessageReadStatus, User
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH = int(os.getenv("CHAT_ARCHIVE_BATCH", "2000"))
+ARCHIVE_INTERVAL = float(os.getenv("CHAT_ARCHIVE_INTERVAL", "3600"))
+# Pause entre deux lots pour laisser passer le trafic normal
+ARCHIVE_PAUSE_MS = float(os.getenv("CHAT_ARCHIVE_PAUSE_MS", "200"))
+
+# Tier chaud d'abord : c'est lui qui complète les pages récentes
+MESSAGE_TIERS = (Message, MessageArchive)
+
+_ARCHIVED_COLUMNS = [column.name for column in MessageArchive.__table__.columns]
+
+# (message ORM du tier chaud ou froid, nom de l'expéditeur)
+MessageRow = Tuple[object, Optional[str]]
+
+
+# ============================================
+# DÉPLACEMENT VERS L'ARCHIVE
+# ============================================
+
+def archivable_messages(cutoff: datetime, limit: int):
+    """Ids des prochains messages à archiver (verrouillés sur PostgreSQL)"""
+    read_by_recipient = exists().where(
+        MessageReadStatus.conversation_id == Message.conversation_id,
+        MessageReadStatus.user_id != Message.sender_id,
+        MessageReadStatus.last_read_seq >= Message.seq
+    )
+    return select(Message.id).where(
+        Message.created_at < cutoff,
+        Message.seq.isnot(None),
+        read_by_recipient,
+        ~exists().where(ChatAttachment.message_id == Message.id),
+        ~exists().where(ChatNotification.message_id == Message.id)
+    ).order_by(Message.id).limit(limit).with_for_update(skip_locked=True, of=Message)
+
+
+def _archive_batch(db: Session, cutoff: datetime, limit: int) -> int:
+    hot = Message.__table__
+    try:
+        ids = db.execute(archivable_messages(cutoff, limit)).scalars().all()
+        if not ids:
+            db.rollback()
+            return 0
+        db.execute(insert(MessageArchive.__table__).from_select(
+            _ARCHIVED_COLUMNS,
+            select(*[hot.c[name] for name in _ARCHIVED_COLUMNS]).where(hot.c.id.in_(ids))
+        ))
+        db.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ids)
+
+
+class MessageArchiver:
+    """Tâche de fond qui déplace les messages froids, lot par lot"""
+
+    def __init__(
+        self,
+        archive_after_days: float = ARCHIVE_AFTER_DAYS,
+        batch_size: int = ARCHIVE_BATCH,
+        interval: float = ARCHIVE_INTERVAL
+    ):
+        self.archive_after = timedelta(days=archive_after_days)
+        self.batch_size = batch_size
+        self.interval = interval
+        self._mover: Optional[asyncio.Task] = None
+
+        # Métriques
+        self.archived_count = 0
+        self.runs_count = 0
+        self.last_run_at: Optional[datetime] = None
+
+    def start(self):
+        """Lancer le déplaceur (idempotent ; désactivé si CHAT_ARCHIVE_AFTER_DAYS <= 0)"""
+        if self.archive_after <= timedelta(0):
+            return
+        if self._mover is None or self._mover.done():
+            self._mover = asyncio.create_task(self._move_loop())
+
+    async def stop(self):
+        if self._mover is not None:
+            self._mover.cancel()
+            try:
+                await self._mover
+            except asyncio.CancelledError:
+                pass
+            self._mover = None
+
+    async def _move_loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"❌ Message archiver failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Archiver tout ce qui est éligible, par lots ; retourne le nombre déplacé"""
+        cutoff = datetime.utcnow() - self.archive_after
+        moved = 0
+        while True:
+            count = await run_db(_archive_batch, cutoff, self.batch_size)
+            moved += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(ARCHIVE_PAUSE_MS / 1000)
+
+        self.runs_count += 1
+        self.last_run_at = datetime.utcnow()
+        if moved:
+            self.archived_count += moved
+            print(f"🗄️ Message archiver: {moved} messages moved to messages_archive")
+        return moved
+
+    def stats(self) -> dict:
+        return {
+            "archived_messages": self.archived_count,
+            "runs": self.runs_count,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None
+        }
+
+
+message_archiver = MessageArchiver()
+
+
+# ============================================
+# LECTURES SUR LES DEUX TIERS
+# ============================================
+
+def _with_sender(db: Session, model):
+    return db.query(model, User.name).outerjoin(User, User.id == model.sender_id)
+
+
+def find_message_position(db: Session, conversation_id: int, message_id: int) -> Optional[Tuple[datetime, int]]:
+    """(created_at, id) d'un message de la conversation, quel que soit son tier"""
+    for model in MESSAGE_TIERS:
+        row = db.query(model.created_at).filter(
+            model.id == message_id,
+            model.conversation_id == conversation_id
+        ).first()
+        if row is not None:
+            return row.created_at, message_id
+    return None
+
+
+def load_history_page(
+    db: Session,
+    conversation_id: int,
+    limit: int,
+    before: Optional[Tuple[datetime, int]] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    offset: int = 0
+) -> List[MessageRow]:
+    """
+    Page d'historique en ordre chronologique, positions (created_at, id) :
+    avant `before`, après `after`, ou depuis le début avec offset.
+    """
+    descending = before is not None
+    wanted = limit + offset
+    rows: List[MessageRow] = []
+    for model in MESSAGE_TIERS:
+        position = tuple_(model.created_at, model.id)
+        query = _with_sender(db, model).filter(model.conversation_id == conversation_id)
+        if before is not None:
+            query = query.filter(position < tuple_(*before))
+        if after is not None:
+            query = query.filter(position > tuple_(*after))
+        if len(rows) >= wanted:
+            # Page complète : seuls comptent les messages qui s'y intercalent
+            edge = rows[wanted - 1][0]
+            edge_position = tuple_(edge.created_at, edge.id)
+            query = query.filter(position > edge_position if descending else position < edge_position)
+        if descending:
+            query = query.order_by(model.created_at.desc(), model.id.desc())
+        else:
+            query = query.order_by(model.created_at.asc(), model.id.asc())
+        rows.extend(query.limit(wanted).all())
+
+    rows.sort(key=lambda row: (row[0].created_at, row[0].id), reverse=descending)
+    rows = rows[offset:wanted]
+    if descending:
+        rows.reverse()
+    return rows
+
+
+def load_messages_after_seq(db: Session, conversation_id: int, after_seq: int, limit: int) -> List[MessageRow]:
+    """Messages de seq > after_seq, dans l'ordre (index conversation_id, seq des deux tiers)"""
+    rows: List[MessageRow] = []
+    for model in MESSAGE_TIERS:
+        query = _with_sender(db, model).filter(
+            model.conversation_id == conversation_id,
+            model.seq > after_seq
+        )
+        if len(rows) >= limit:
+            query = query.filter(model.seq < rows[limit - 1][0].seq)
+        rows.extend(query.order_by(model.seq.asc()).limit(limit).all())
+    rows.sort(key=lambda row: row[0].seq)
+    return rows[:limit]
+
+
+def load_messages_by_ids(db: Session, message_ids: List[int]) -> Dict[int, MessageRow]:
+    """message_id -> (message, nom de l'expéditeur), dans les deux tiers"""
+    found: Dict[int, MessageRow] = {}
+    for model in MESSAGE_TIERS:
+        missing = [message_id for message_id in message_ids if message_id not in found]
+        if not missing:
+            break
+        for message, sender_name in _with_sender(db, model).filter(model.id.in_(missing)).all():
+            found[message.id] = (message, sender_name)
+    return found
@@ -0,0 +1,332 @@
+# backend/message_search.py
+"""
+Recherche plein texte dans les messages des conversations d'un utilisateur.
+
+Deux moteurs, choisis selon la base (ou CHAT_SEARCH_BACKEND=postgres|memory) :
+
+- PostgresSearch : index GIN sur to_tsvector('french', content)
+  (ix_messages_content_fts, voir models.py). Requête websearch_to_tsquery
+  (guillemets, OR, -exclusion), tri par ts_rank_cd, extraits ts_headline
+  calculés uniquement pour la page retournée.
+- InMemorySearch : index inversé en mémoire pour les déploiements SQLite.
+  Alimenté à la demande par les messages d'id supérieur au dernier indexé
+  (chaque worker rattrape aussi les écritures des autres), tri BM25.
+
+Les extraits sont du HTML : texte du message échappé, seule balise <mark>
+autour des termes trouvés (un message "<img onerror=...>" reste du texte).
+
+Dans les deux cas la recherche couvre les deux tiers (messages et
+messages_archive) et reste restreinte aux conversations de l'appelant,
+filtrées AVANT le classement.
+"""
+
+import html
+import math
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func, literal_column, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from message_archive import MESSAGE_TIERS, load_messages_by_ids
+from models import MESSAGE_SEARCH_CONFIG, Conversation, message_search_vector
+
+SEARCH_BACKEND = os.getenv("CHAT_SEARCH_BACKEND", "auto")
+SEARCH_MAX_OFFSET = 1000
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+# Délimiteurs de ts_headline : caractères de contrôle retirés du contenu avant
+# l'appel, remplacés par les balises après échappement du résultat
+_PG_START_SEL = "\x02"
+_PG_STOP_SEL = "\x03"
+SNIPPET_WORDS = 24
+
+# (message_id, score, extrait ou None)
+SearchHit = Tuple[int, float, Optional[str]]
+
+
+def user_conversation_ids(db: Session, user_id: int, conversation_id: Optional[int] = None) -> List[int]:
+    """Conversations dont l'utilisateur est participant (éventuellement une seule)"""
+    query = db.query(Conversation.id).filter(
+        or_(Conversation.patient_id == user_id, Conversation.medecin_id == user_id)
+    )
+    if conversation_id is not None:
+        query = query.filter(Conversation.id == conversation_id)
+    return [row.id for row in query.all()]
+
+
+class SearchBackend:
+    """Interface commune aux moteurs de recherche"""
+
+    name = "base"
+
+    def search(self, db: Session, conversation_ids: Sequence[int], query: str,
+               limit: int, offset: int) -> List[SearchHit]:
+        raise NotImplementedError
+
+
+# ============================================
+# POSTGRESQL : tsvector + GIN
+# ============================================
+
+class PostgresSearch(SearchBackend):
+    name = "postgres"
+
+    def search(self, db: Session, conversation_ids: Sequence[int], query: str,
+               limit: int, offset: int) -> List[SearchHit]:
+        config = literal_column(f"'{MESSAGE_SEARCH_CONFIG}'")
+        tsquery = func.websearch_to_tsquery(config, query)
+
+        # Correspondances des deux tiers (index GIN + filtre conversation chacun)
+        tiers = []
+        for model in MESSAGE_TIERS:
+            vector = message_search_vector(model.content)
+            tiers.append(select(
+                model.id, model.content, model.created_at,
+                func.ts_rank_cd(vector, tsquery).label("rank")
+            ).where(
+                model.conversation_id.in_(conversation_ids),
+                vector.op("@@")(tsquery)
+            ))
+        matches = union_all(*tiers).subquery()
+
+        # Page classée d'abord, extraits ensuite
+        page = select(matches).order_by(
+            matches.c.rank.desc(), matches.c.created_at.desc(), matches.c.id.desc()
+        ).limit(limit).offset(offset).subquery()
+
+        headline = func.ts_headline(
+            config, func.translate(page.c.content, _PG_START_SEL + _PG_STOP_SEL, ""), tsquery,
+            f"StartSel={_PG_START_SEL}, StopSel={_PG_STOP_SEL}, "
+            f"MaxWords={SNIPPET_WORDS}, MinWords=8, MaxFragments=2, FragmentDelimiter=\" … \""
+        )
+        rows = db.execute(
+            select(page.c.id, page.c.rank, headline).order_by(
+                page.c.rank.desc(), page.c.created_at.desc(), page.c.id.desc()
+            )
+        ).all()
+        return [(row[0], float(row[1]), _escape_headline(row[2])) for row in rows]
+
+
+def _escape_headline(headline: Optional[str]) -> Optional[str]:
+    """Extrait ts_headline échappé, délimiteurs remplacés par <mark></mark>"""
+    if headline is None:
+        return None
+    return html.escape(headline).replace(_PG_START_SEL, HIGHLIGHT_START).replace(_PG_STOP_SEL, HIGHLIGHT_STOP)
+
+
+# ============================================
+# INDEX INVERSÉ EN MÉMOIRE (SQLITE)
+# ============================================
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_QUERY_RE = re.compile(r'(-?)"([^"]+)"|(-?)(\S+)')
+
+FRENCH_STOPWORDS = {
+    "au", "aux", "avec", "ce", "ces", "dans", "de", "des", "du", "elle", "en", "et", "eux",
+    "il", "je", "la", "le", "les", "leur", "lui", "ma", "mais", "me", "mes", "moi", "mon",
+    "ne", "nos", "notre", "nous", "on", "ou", "par", "pas", "pour", "qu", "que", "qui", "sa",
+    "se", "ses", "son", "sur", "ta", "te", "tes", "toi", "ton", "tu", "un", "une", "vos",
+    "votre", "vous", "est", "sont", "a", "y", "d", "l", "c", "j", "m", "n", "s", "t",
+}
+
+
+def normalize_word(word: str) -> Optional[str]:
+    """Minuscules, sans accents, pluriel simple retiré ; None pour un mot vide"""
+    word = unicodedata.normalize("NFKD", word.lower())
+    word = "".join(char for char in word if not unicodedata.combining(char))
+    if word in FRENCH_STOPWORDS or len(word) < 2:
+        return None
+    if len(word) > 3 and word[-1] in "sx":
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in (normalize_word(w) for w in _WORD_RE.findall(text or "")) if token]
+
+
+def parse_query(query: str) -> Tuple[List[str], Set[str]]:
+    """Termes requis et termes exclus (-mot) ; une phrase entre guillemets = ses mots"""
+    required: List[str] = []
+    excluded: Set[str] = set()
+    for match in _QUERY_RE.finditer(query):
+        negate = (match.group(1) or match.group(3)) == "-"
+        terms = tokenize(match.group(2) or match.group(4))
+        if negate:
+            excluded.update(terms)
+        else:
+            required.extend(term for term in terms if term not in required)
+    return required, excluded
+
+
+def make_snippet(content: str, terms: Set[str]) -> str:
+    """Extrait (HTML échappé) autour du premier terme trouvé, termes entourés de HIGHLIGHT_START/STOP"""
+    words = list(_WORD_RE.finditer(content))
+    if not words:
+        return html.escape(content[:200])
+    first = next((i for i, w in enumerate(words) if normalize_word(w.group()) in terms), 0)
+    start = max(0, first - SNIPPET_WORDS // 3)
+    end = min(len(words), start + SNIPPET_WORDS)
+
+    parts = []
+    cursor = words[start].start()
+    for word in words[start:end]:
+        parts.append(html.escape(content[cursor:word.start()]))
+        if normalize_word(word.group()) in terms:
+            parts.append(f"{HIGHLIGHT_START}{html.escape(word.group())}{HIGHLIGHT_STOP}")
+        else:
+            parts.append(html.escape(word.group()))
+        cursor = word.end()
+    snippet = "".join(parts)
+    if start > 0:
+        snippet = "… " + snippet
+    if end < len(words):
+        snippet += " …"
+    return snippet
+
+
+class InMemorySearch(SearchBackend):
+    """Index inversé terme -> {message_id: fréquence}, classement BM25"""
+
+    name = "memory"
+    K1 = 1.2
+    B = 0.75
+    REFRESH_BATCH = 5000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._conversation_of: Dict[int, int] = {}
+        self._length: Dict[int, int] = {}
+        self._total_length = 0
+        # Dernier id indexé par tier
+        self._last_ids = {model: 0 for model in MESSAGE_TIERS}
+
+    def add(self, message_id: int, conversation_id: int, content: str):
+        if message_id in self._conversation_of:
+            # Déjà indexé avant son déplacement vers l'archive (id conservé)
+            return
+        terms = tokenize(content)
+        self._conversation_of[message_id] = conversation_id
+        self._length[message_id] = len(terms)
+        self._total_length += len(terms)
+        for term in terms:
+            postings = self._postings.setdefault(term, {})
+            postings[message_id] = postings.get(message_id, 0) + 1
+
+    def refresh(self, db: Session):
+        """Indexer les messages écrits (ou archivés) depuis le dernier passage, par id croissant"""
+        for model in MESSAGE_TIERS:
+            while True:
+                rows = db.query(model.id, model.conversation_id, model.content).filter(
+                    model.id > self._last_ids[model]
+                ).order_by(model.id.asc()).limit(self.REFRESH_BATCH).all()
+                for row in rows:
+                    self.add(row.id, row.conversation_id, row.content)
+                if rows:
+                    self._last_ids[model] = rows[-1].id
+                if len(rows) < self.REFRESH_BATCH:
+                    break
+
+    def search(self, db: Session, conversation_ids: Sequence[int], query: str,
+               limit: int, offset: int) -> List[SearchHit]:
+        required, excluded = parse_query(query)
+        if not required:
+            return []
+        allowed = set(conversation_ids)
+
+        with self._lock:
+            self.refresh(db)
+            # Partir du terme le plus rare
+            postings = sorted((self._postings.get(term, {}) for term in required), key=len)
+            candidates = [
+                message_id for message_id in postings[0]
+                if self._conversation_of.get(message_id) in allowed
+                and all(message_id in other for other in postings[1:])
+            ]
+            for term in excluded:
+                excluded_ids = self._postings.get(term, {})
+                candidates = [message_id for message_id in candidates if message_id not in excluded_ids]
+
+            documents = max(1, len(self._length))
+            average_length = max(1.0, self._total_length / documents)
+            idf = {
+                term: math.log(1 + (documents - len(postings_) + 0.5) / (len(postings_) + 0.5))
+                for term, postings_ in ((t, self._postings.get(t, {})) for t in required)
+            }
+            scored = []
+            for message_id in candidates:
+                length_norm = 1 - self.B + self.B * self._length[message_id] / average_length
+                score = 0.0
+                for term in required:
+                    frequency = self._postings[term][message_id]
+                    score += idf[term] * frequency * (self.K1 + 1) / (frequency + self.K1 * length_norm)
+                scored.append((score, message_id))
+
+        # Ids croissants = ordre chronologique : à score égal, le plus récent d'abord
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        return [(message_id, score, None) for score, message_id in scored[offset:offset + limit]]
+
+
+_backend: Optional[SearchBackend] = None
+
+
+def get_search_backend(db: Session) -> SearchBackend:
+    global _backend
+    if _backend is None:
+        choice = SEARCH_BACKEND
+        if choice == "auto":
+            choice = "postgres" if db.get_bind().dialect.name == "postgresql" else "memory"
+        _backend = PostgresSearch() if choice == "postgres" else InMemorySearch()
+    return _backend
+
+
+def search_messages(db: Session, user_id: int, query: str, conversation_id: Optional[int] = None,
+                    limit: int = 20, offset: int = 0) -> Tuple[List[dict], Optional[int]]:
+    """
+    Résultats classés pour une page, plus l'offset de la page suivante (None
+    s'il n'y en a pas). Chaque résultat : message_id, conversation_id,
+    sender_id, sender_name, message_type, created_at, seq, rank, snippet.
+
+    Les résultats dont le message n'existe plus (index en retard sur une
+    suppression) sont sautés et la page est complétée avec les suivants :
+    l'offset suivant compte les positions de l'index, sautées comprises.
+    """
+    conversation_ids = user_conversation_ids(db, user_id, conversation_id)
+    if not conversation_ids:
+        return [], None
+
+    backend = get_search_backend(db)
+    terms = set(parse_query(query)[0])
+    results = []
+    position = offset
+    while len(results) < limit and position <= SEARCH_MAX_OFFSET:
+        needed = limit - len(results)
+        # Un résultat de plus pour savoir s'il existe une suite
+        hits = backend.search(db, conversation_ids, query, needed + 1, position)
+        page = hits[:needed]
+        position += len(page)
+        rows = load_messages_by_ids(db, [message_id for message_id, _, _ in page]) if page else {}
+        for message_id, rank, snippet in page:
+            if message_id not in rows:
+                continue
+            message, sender_name = rows[message_id]
+            results.append({
+                "message_id": message.id,
+                "conversation_id": message.conversation_id,
+                "sender_id": message.sender_id,
+                "sender_name": sender_name,
+                "message_type": message.message_type,
+                "created_at": message.created_at,
+                "seq": message.seq,
+                "rank": rank,
+                "snippet": snippet if snippet is not None else make_snippet(message.content, terms)
+            })
+        if len(hits) <= needed:
+            # Index épuisé
+            return results, None
+    return results, position if position <= SEARCH_MAX_OFFSET else None
@@ -0,0 +1,285 @@
+# backend/message_writer.py
+"""
+Persistance "write-behind" des messages reçus par WebSocket.
+
+Au lieu de deux commits par frame (INSERT du message puis UPDATE de la
+conversation), les messages de toutes les sockets du worker sont regroupés
+dans une fenêtre de flush :
+
+- un INSERT multi-lignes dans messages
+- un UPDATE du résumé (last_message_at, aperçu, compteurs de non-lus) par
+  conversation touchée
+- un seul commit
+
+Un flush part dès que CHAT_FLUSH_MAX_BATCH messages sont en attente, ou au
+plus tard CHAT_FLUSH_INTERVAL_MS après le premier. L'expéditeur attend la fin
+du flush et reçoit l'id durable du message.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm import Session
+
+from conversation_cache import get_cached_participants
+from database import SessionLocal, run_in_db_executor
+from models import Conversation, Message
+
+FLUSH_MAX_BATCH = int(os.getenv("CHAT_FLUSH_MAX_BATCH", "200"))
+FLUSH_INTERVAL_MS = float(os.getenv("CHAT_FLUSH_INTERVAL_MS", "20"))
+PREVIEW_LENGTH = 200
+
+# ============================================
+# RÉSUMÉ DÉNORMALISÉ DES CONVERSATIONS
+# ============================================
+
+_conversations = Conversation.__table__
+
+# Un UPDATE par conversation : résumé + réservation des numéros de séquence.
+# Le verrou de ligne pris par l'UPDATE garantit des seq croissants même
+# quand plusieurs workers écrivent dans la même conversation.
+_summary_update = (
+    update(_conversations)
+    .where(_conversations.c.id == bindparam("conv_id"))
+    .values(
+        last_message_at=bindparam("last_at"),
+        last_message_preview=bindparam("preview"),
+        last_message_type=bindparam("last_type"),
+        patient_unread_count=_conversations.c.patient_unread_count + bindparam("to_patient"),
+        medecin_unread_count=_conversations.c.medecin_unread_count + bindparam("to_medecin"),
+        last_seq=_conversations.c.last_seq + bindparam("count")
+    )
+    .returning(_conversations.c.last_seq)
+)
+
+
+def _load_participants_bulk(db: Session, conversation_ids: List[int]) -> Dict[int, Tuple[int, int]]:
+    participants = {}
+    missing = []
+    for conversation_id in conversation_ids:
+        cached = get_cached_participants(conversation_id)
+        if cached is not None:
+            participants[conversation_id] = cached
+        else:
+            missing.append(conversation_id)
+    if missing:
+        rows = db.query(Conversation.id, Conversation.patient_id, Conversation.medecin_id).filter(
+            Conversation.id.in_(missing)
+        ).all()
+        for row in rows:
+            participants[row.id] = (row.patient_id, row.medecin_id)
+    return participants
+
+
+def update_conversation_summaries(db: Session, messages: List[dict]):
+    """
+    Mettre à jour le résumé des conversations touchées par des messages
+    (dicts avec conversation_id, sender_id, content, message_type, created_at)
+    et attribuer à chaque message son numéro de séquence (clé "seq").
+    
+    À appeler AVANT l'INSERT des messages, dans la même transaction, avec les
+    messages dans leur ordre d'arrivée. Ne commit pas.
+    """
+    summaries: Dict[int, dict] = {}
+    for message in messages:
+        message.setdefault("seq", None)
+        conversation_id = message["conversation_id"]
+        summary = summaries.setdefault(conversation_id, {
+            "conv_id": conversation_id,
+            "last_at": None,
+            "preview": None,
+            "last_type": None,
+            "messages": []
+        })
+        if summary["last_at"] is None or message["created_at"] >= summary["last_at"]:
+            summary["last_at"] = message["created_at"]
+            summary["preview"] = (message["content"] or "")[:PREVIEW_LENGTH]
+            summary["last_type"] = message["message_type"]
+        summary["messages"].append(message)
+
+    if not summaries:
+        return
+
+    participants = _load_participants_bulk(db, list(summaries))
+    # Verrous de ligne toujours pris dans le même ordre (id croissant) :
+    # deux lots concurrents ne peuvent pas s'attendre mutuellement
+    for conversation_id in sorted(summaries):
+        if conversation_id not in participants:
+            continue
+        summary = summaries[conversation_id]
+        patient_id, medecin_id = participants[conversation_id]
+        conversation_messages = summary.pop("messages")
+        # Un message est non lu pour le participant qui ne l'a pas envoyé
+        summary["to_patient"] = sum(1 for m in conversation_messages if m["sender_id"] != patient_id)
+        summary["to_medecin"] = sum(1 for m in conversation_messages if m["sender_id"] != medecin_id)
+        summary["count"] = len(conversation_messages)
+
+        last_seq = db.execute(_summary_update, summary).scalar_one()
+        first_seq = last_seq - len(conversation_messages) + 1
+        for offset, message in enumerate(conversation_messages):
+            message["seq"] = first_seq + offset
+
+
+class PendingMessage:
+    """Message en attente d'écriture"""
+
+    __slots__ = ("conversation_id", "sender_id", "content", "message_type",
+                 "file_url", "created_at", "future")
+
+    def __init__(self, conversation_id: int, sender_id: int, content: str,
+                 message_type: str, file_url: Optional[str], future: asyncio.Future):
+        self.conversation_id = conversation_id
+        self.sender_id = sender_id
+        self.content = content
+        self.message_type = message_type
+        self.file_url = file_url
+        # Heure de réception : conserve l'ordre réel des messages dans le lot
+        self.created_at = datetime.utcnow()
+        self.future = future
+
+    def as_row(self) -> dict:
+        return {
+            "conversation_id": self.conversation_id,
+            "sender_id": self.sender_id,
+            "content": self.content,
+            "message_type": self.message_type,
+            "file_url": self.file_url,
+            "is_read": False,
+            "created_at": self.created_at,
+            "seq": None
+        }
+
+
+class MessageBatchWriter:
+    """Regroupe les messages de toutes les sockets et les écrit par lots"""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_batch: int = FLUSH_MAX_BATCH,
+        flush_interval: float = FLUSH_INTERVAL_MS / 1000
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending: List[PendingMessage] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+        # Métriques
+        self.flush_count = 0
+        self.written_count = 0
+
+    def start(self):
+        """Lancer la tâche de flush (idempotent)"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Écrire ce qui reste en attente puis arrêter la tâche de flush"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        while self._pending:
+            await self._flush_once()
+
+    async def submit(
+        self,
+        conversation_id: int,
+        sender_id: int,
+        content: str,
+        message_type: str = "text",
+        file_url: Optional[str] = None
+    ) -> dict:
+        """
+        Mettre un message en file d'écriture et attendre son flush.
+        Retourne {"id": ..., "created_at": ..., "seq": ...} une fois le message durable.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(PendingMessage(
+            conversation_id, sender_id, content, message_type, file_url, future
+        ))
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+        return await future
+
+    async def _flush_loop(self):
+        while True:
+            await self._has_pending.wait()
+            # Laisser la fenêtre se remplir, sauf si le lot est déjà plein
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_once()
+
+    async def _flush_once(self):
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        if len(self._pending) < self.max_batch:
+            self._batch_full.clear()
+        if not self._pending:
+            self._has_pending.clear()
+        if not batch:
+            return
+
+        try:
+            rows = await run_in_db_executor(self._write_batch, batch)
+        except Exception as e:
+            print(f"❌ Batch write failed ({len(batch)} messages), retrying one by one: {e}")
+            await self._write_individually(batch)
+            return
+
+        for pending, row in zip(batch, rows):
+            if not pending.future.done():
+                pending.future.set_result(row)
+
+    async def _write_individually(self, batch: List[PendingMessage]):
+        """Repli : un message invalide ne doit pas faire échouer tout le lot"""
+        for pending in batch:
+            try:
+                rows = await run_in_db_executor(self._write_batch, [pending])
+            except Exception as e:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            else:
+                if not pending.future.done():
+                    pending.future.set_result(rows[0])
+
+    def _write_batch(self, batch: List[PendingMessage]) -> List[dict]:
+        """Un UPDATE de résumé par conversation + INSERT multi-lignes, un seul commit (thread)"""
+        db = self.session_factory()
+        try:
+            values = [pending.as_row() for pending in batch]
+            update_conversation_summaries(db, values)
+            result = db.execute(
+                insert(Message).returning(
+                    Message.id, Message.created_at, Message.seq, sort_by_parameter_order=True
+                ),
+                values
+            )
+            rows = [{"id": row.id, "created_at": row.created_at, "seq": row.seq} for row in result]
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        self.flush_count += 1
+        self.written_count += len(rows)
+        return rows
+
+
+message_writer = MessageBatchWriter()
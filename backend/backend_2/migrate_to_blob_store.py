@@ -0,0 +1,280 @@
+# backend/migrate_to_blob_store.py
+"""
+Migration des fichiers existants vers le stockage dédupliqué (blob_store).
+
+1. messages avec un fichier dans uploads/chat mais sans pièce jointe
+   (anciens /chat/upload) : ChatAttachment créée
+2. pièces jointes sans blob_sha256 : fichier haché, déposé une seule fois,
+   file_path et file_url du message pointent vers le blob
+3. documents médicaux sans blob_sha256 (uploads/medical_documents)
+4. ref_count recalculé à partir des références (corrige les écarts, ex:
+   documents supprimés en cascade avec leur utilisateur)
+5. contenus encore dans l'ancien dossier public uploads/blobs (servi sans
+   quarantaine), ou dans le dossier local (BLOB_STORE_DIR) avec
+   FILE_STORAGE_URL=s3://..., copiés vers le backend configuré par lots de
+   BATCH_SIZE ; file_path et file_url (/uploads/blobs/...) mis à jour (les
+   étapes 2 et 3 écrivent déjà directement dans le backend configuré)
+
+Chaque ancien fichier n'est supprimé qu'après le commit de sa ligne.
+Idempotent : on peut le relancer sans risque (ex: après une interruption).
+
+Usage (depuis backend/backend_2, après upgrade_chat_schema.py qui ajoute
+les colonnes blob_sha256 sur une base existante) :
+    python migrate_to_blob_store.py
+    FILE_STORAGE_URL=s3://bucket/prefixe python migrate_to_blob_store.py
+"""
+
+import hashlib
+import os
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select, union_all, update
+
+import auth
+from blob_store import (
+    BLOB_DIR, BLOB_URL_PREFIX, LEGACY_BLOB_DIR, acquire_blob, blob_location, blob_url, install_blob, reserve_blob, storage
+)
+from database import SessionLocal, engine, Base
+from models import ChatAttachment, FileBlob, MedicalDocument, Message
+from storage import LocalStorage
+from utils.file_handler import SNIFF_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_DIR as CHAT_UPLOAD_DIR, sniff_mime_type
+
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "200"))
+
+
+def _hash_path(path: str) -> Tuple[str, int, bytes]:
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if len(head) < SNIFF_BYTES:
+                head += chunk[:SNIFF_BYTES - len(head)]
+            digest.update(chunk)
+    return digest.hexdigest(), size, head
+
+
+def _adopt_file(db, path: str, declared_mime_type: Optional[str]) -> Optional[Tuple[str, str, str]]:
+    """Déposer un ancien fichier dans le stockage ; retourne (sha256, chemin relatif, type MIME)"""
+    if not os.path.exists(path):
+        print(f"  ⚠️  fichier manquant: {path}")
+        return None
+    sha256, size, head = _hash_path(path)
+    mime_type = sniff_mime_type(head, declared_mime_type)
+    storage_path = reserve_blob(db, sha256, size, mime_type)
+    # L'original reste en place jusqu'au commit de la ligne
+    install_blob(path, storage_path, keep_source=True, content_type=mime_type)
+    return sha256, storage_path, mime_type
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+# ============================================
+# ÉTAPES
+# ============================================
+
+def attach_legacy_chat_files():
+    """Messages avec fichier dans uploads/chat et sans ChatAttachment"""
+    db = SessionLocal()
+    created = 0
+    try:
+        while True:
+            messages = db.query(Message).filter(
+                Message.file_url.like("/uploads/chat/%"),
+                ~Message.attachments.any()
+            ).order_by(Message.id).limit(BATCH_SIZE).all()
+            if not messages:
+                break
+            for message in messages:
+                file_path = os.path.join(CHAT_UPLOAD_DIR, message.file_url.split("/")[-1])
+                size = os.path.getsize(file_path) if os.path.exists(file_path) else None
+                message.attachments.append(ChatAttachment(
+                    file_name=message.content[:255],
+                    file_type="application/octet-stream",
+                    file_size=size,
+                    file_path=file_path
+                ))
+            db.commit()
+            created += len(messages)
+    finally:
+        db.close()
+    print(f"  ✓ {created} pièces jointes créées pour d'anciens messages")
+
+
+def migrate_chat_attachments():
+    db = SessionLocal()
+    migrated = 0
+    try:
+        last_id = 0
+        while True:
+            attachments = db.query(ChatAttachment).filter(
+                ChatAttachment.blob_sha256.is_(None),
+                ChatAttachment.id > last_id
+            ).order_by(ChatAttachment.id).limit(BATCH_SIZE).all()
+            if not attachments:
+                break
+            for attachment in attachments:
+                last_id = attachment.id
+                old_path = attachment.file_path
+                adopted = _adopt_file(db, old_path, attachment.file_type)
+                if adopted is None:
+                    continue
+                sha256, storage_path, mime_type = adopted
+                attachment = db.query(ChatAttachment).filter(ChatAttachment.id == last_id).first()
+                old_url = f"/uploads/chat/{os.path.basename(old_path)}"
+                db.execute(
+                    update(Message.__table__).where(
+                        Message.id == attachment.message_id,
+                        Message.file_url == old_url
+                    ).values(file_url=blob_url(storage_path))
+                )
+                attachment.blob_sha256 = sha256
+                attachment.file_path = blob_location(storage_path)
+                if attachment.file_type == "application/octet-stream":
+                    attachment.file_type = mime_type
+                acquire_blob(db, sha256)
+                db.commit()
+                _remove(old_path)
+                migrated += 1
+    finally:
+        db.close()
+    print(f"  ✓ {migrated} pièces jointes déplacées")
+
+
+def migrate_medical_documents():
+    db = SessionLocal()
+    migrated = 0
+    try:
+        last_id = 0
+        while True:
+            documents = db.query(MedicalDocument).filter(
+                MedicalDocument.blob_sha256.is_(None),
+                MedicalDocument.id > last_id
+            ).order_by(MedicalDocument.id).limit(BATCH_SIZE).all()
+            if not documents:
+                break
+            for document in documents:
+                last_id = document.id
+                old_path = os.path.join(auth.UPLOAD_DIR, document.filename)
+                adopted = _adopt_file(db, old_path, document.mime_type)
+                if adopted is None:
+                    continue
+                sha256 = adopted[0]
+                db.execute(
+                    update(MedicalDocument.__table__).where(
+                        MedicalDocument.id == last_id
+                    ).values(blob_sha256=sha256)
+                )
+                acquire_blob(db, sha256)
+                db.commit()
+                _remove(old_path)
+                migrated += 1
+    finally:
+        db.close()
+    print(f"  ✓ {migrated} documents médicaux déplacés")
+
+
+def recount_references():
+    """ref_count = nombre réel de références ; délai de grâce repoussé pour tous"""
+    references = union_all(
+        select(MedicalDocument.blob_sha256.label("sha256")).where(MedicalDocument.blob_sha256.isnot(None)),
+        select(ChatAttachment.blob_sha256.label("sha256")).where(ChatAttachment.blob_sha256.isnot(None))
+    ).subquery()
+    count = select(func.count()).select_from(references).where(
+        references.c.sha256 == FileBlob.sha256
+    ).scalar_subquery()
+    with engine.begin() as conn:
+        conn.execute(update(FileBlob.__table__).values(ref_count=count, touched_at=datetime.utcnow()))
+    print("  ✓ compteurs de références")
+
+
+def _local_blob_sources():
+    """Dossiers locaux qui peuvent encore contenir des blobs, hors stockage configuré"""
+    roots = [LEGACY_BLOB_DIR, BLOB_DIR]
+    if isinstance(storage, LocalStorage):
+        roots = [root for root in roots if os.path.realpath(root) != os.path.realpath(storage.root)]
+    return [LocalStorage(root) for root in dict.fromkeys(roots) if os.path.isdir(root)]
+
+
+def rehome_local_blobs():
+    """
+    Contenus de l'ancien dossier public (uploads/blobs) ou du dossier local
+    copiés vers le backend configuré ; anciennes URLs /uploads/blobs/...
+    remplacées par blob_url() dans tous les cas
+    """
+    sources = _local_blob_sources()
+    attachments = ChatAttachment.__table__
+    messages = Message.__table__
+    db = SessionLocal()
+    moved = 0
+    try:
+        last_sha256 = ""
+        while True:
+            blobs = db.query(FileBlob.sha256, FileBlob.storage_path, FileBlob.mime_type).filter(
+                FileBlob.sha256 > last_sha256
+            ).order_by(FileBlob.sha256).limit(BATCH_SIZE).all()
+            if not blobs:
+                break
+            copied = []
+            for blob in blobs:
+                last_sha256 = blob.sha256
+                for source in sources:
+                    local_path = source.local_path(blob.storage_path)
+                    if os.path.exists(local_path):
+                        # Copie : le fichier local reste en place jusqu'au commit du lot
+                        storage.put_file(local_path, blob.storage_path, blob.mime_type, keep_source=True)
+                        copied.append(local_path)
+                new_location = blob_location(blob.storage_path)
+                db.execute(
+                    update(attachments).where(
+                        attachments.c.blob_sha256 == blob.sha256,
+                        attachments.c.file_path != new_location
+                    ).values(file_path=new_location)
+                )
+                old_url = f"{BLOB_URL_PREFIX}/{blob.storage_path.replace(os.sep, '/')}"
+                db.execute(
+                    update(messages).where(
+                        messages.c.id.in_(
+                            select(attachments.c.message_id).where(attachments.c.blob_sha256 == blob.sha256)
+                        ),
+                        messages.c.file_url == old_url
+                    ).values(file_url=blob_url(blob.storage_path))
+                )
+            db.commit()
+            for path in copied:
+                _remove(path)
+            if copied:
+                moved += len(copied)
+                print(f"  … {moved} contenus copiés vers {storage.name}")
+    finally:
+        db.close()
+    print(f"  ✓ {moved} contenus déplacés vers {storage.name}, URLs /uploads/blobs remplacées")
+
+
+def migrate():
+    print("📦 Création des tables manquantes...")
+    Base.metadata.create_all(bind=engine)
+    print("📎 Pièces jointes des anciens messages...")
+    attach_legacy_chat_files()
+    print("🚚 Déplacement vers le stockage dédupliqué...")
+    migrate_chat_attachments()
+    migrate_medical_documents()
+    print("🔢 Recalcul des références...")
+    recount_references()
+    print("☁️ Contenus locaux vers le backend de stockage...")
+    rehome_local_blobs()
+    print("\n✅ Migration terminée!")
+
+
+if __name__ == "__main__":
+    migrate()
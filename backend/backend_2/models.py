@@ -1,10 +1,11 @@
 # backend/models.py
 from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, BigInteger
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from database import Base
 from datetime import datetime
 import enum
 import sqlalchemy
+import sqlalchemy.dialects.postgresql  # noqa: F401  (types de func.to_tsvector)
 
 
 class User(Base):
@@ -19,6 +20,8 @@ class User(Base):
     specialty = Column(String, nullable=True)
     phone = Column(String, nullable=True)
     address = Column(String, nullable=True)
+    # Dernière présence connue (instantanés périodiques du suivi de présence)
+    last_seen_at = Column(DateTime, nullable=True)
     
     # Relations existantes
     documents = relationship("MedicalDocument", back_populates="user", cascade="all, delete-orphan")
@@ -75,11 +78,78 @@ class MedicalDocument(Base):
     file_type = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
     mime_type = Column(String, nullable=True)
+    # Contenu dans le stockage adressé par hash (NULL : ancien fichier dans uploads/medical_documents)
+    blob_sha256 = Column(String(64), ForeignKey("file_blobs.sha256"), nullable=True, index=True)
     
     upload_date = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user = relationship("User", back_populates="documents")
+    blob = relationship("FileBlob", lazy="joined")
+    # Aperçu et texte du PDF, partagés par contenu (sans le texte complet, différé)
+    preview = relationship(
+        "DocumentPreview",
+        primaryjoin="foreign(MedicalDocument.blob_sha256) == DocumentPreview.sha256",
+        viewonly=True,
+        uselist=False,
+        lazy="joined"
+    )
+
+
+class FileBlob(Base):
+    """
+    Contenu de fichier stocké une seule fois, identifié par son SHA-256
+    (storage/blobs/ab/cd/<sha256>.<ext>). ref_count = nombre de
+    MedicalDocument et ChatAttachment qui le référencent ; un blob à 0
+    depuis BLOB_GC_GRACE_SECONDS est supprimé par blob_store.BlobCollector.
+    """
+    __tablename__ = "file_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(100), nullable=True)
+    # Relatif au dossier des blobs
+    storage_path = Column(String(500), nullable=False)
+    ref_count = Column(Integer, default=0, server_default="0", nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Dernière réservation ou libération : délai de grâce avant suppression
+    touched_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Analyse (file_validation) : en quarantaine tant que "pending",
+    # puis "clean", "rejected" (type ou image invalide) ou "infected"
+    scan_status = Column(String(20), default="pending", server_default="pending", nullable=False)
+    # Motif du refus ou signature détectée
+    scan_detail = Column(String(255), nullable=True)
+    # Durée de chaque étape en ms (JSON : {"fetch": .., "sniff": .., "image": .., "scan": ..})
+    scan_timings = Column(Text, nullable=True)
+    scanned_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        sqlalchemy.Index('ix_file_blobs_ref_count_touched_at', 'ref_count', 'touched_at'),
+        sqlalchemy.Index('ix_file_blobs_scan_status_created_at', 'scan_status', 'created_at'),
+    )
+
+
+class DocumentPreview(Base):
+    """
+    Aperçu de la première page et texte extrait d'un PDF, produits une fois
+    par contenu (document_previews.DocumentPreviewWorker) et partagés par
+    tous les documents qui le référencent.
+    """
+    __tablename__ = "document_previews"
+    
+    sha256 = Column(String(64), ForeignKey("file_blobs.sha256", ondelete="CASCADE"), primary_key=True)
+    # "ready", ou "failed" (PDF illisible ou protégé : pas de nouvel essai)
+    status = Column(String(20), nullable=False)
+    page_count = Column(Integer, nullable=True)
+    # Clé dans le backend de stockage : previews/ab/<sha256>_page1.webp
+    preview_path = Column(String(500), nullable=True)
+    # Début du texte, renvoyé avec la liste des documents
+    text_snippet = Column(String(300), nullable=True)
+    # Texte complet : chargé seulement à la demande
+    text_content = deferred(Column(Text, nullable=True))
+    error = Column(String(255), nullable=True)
+    render_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
 class AppointmentStatus(enum.Enum):
@@ -135,7 +205,15 @@ class Conversation(Base):
     patient_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     medecin_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    last_message_at = Column(DateTime, nullable=True)
+    last_message_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+    
+    # Résumé dénormalisé pour la liste des conversations (mis à jour à chaque écriture)
+    last_message_preview = Column(String(200), nullable=True)
+    last_message_type = Column(String(20), nullable=True)
+    patient_unread_count = Column(Integer, default=0, server_default="0", nullable=False)
+    medecin_unread_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # Dernier numéro de séquence attribué à un message de la conversation
+    last_seq = Column(Integer, default=0, server_default="0", nullable=False)
     
     # Relations
     patient = relationship(
@@ -158,11 +236,23 @@ class Conversation(Base):
     )
     
     # Contrainte unique pour éviter les doublons
+    # + index pour la boîte de réception triée par dernier message
     __table_args__ = (
         sqlalchemy.UniqueConstraint('patient_id', 'medecin_id', name='unique_conversation'),
+        sqlalchemy.Index('ix_conversations_patient_last_message', 'patient_id', 'last_message_at', 'id'),
+        sqlalchemy.Index('ix_conversations_medecin_last_message', 'medecin_id', 'last_message_at', 'id'),
     )
 
 
+# Configuration PostgreSQL de la recherche plein texte des messages
+# (la même expression est utilisée par l'index GIN et par message_search.py)
+MESSAGE_SEARCH_CONFIG = "french"
+
+
+def message_search_vector(content_column):
+    return sqlalchemy.func.to_tsvector(sqlalchemy.literal_column(f"'{MESSAGE_SEARCH_CONFIG}'"), content_column)
+
+
 class Message(Base):
     __tablename__ = "messages"
     
@@ -174,11 +264,55 @@ class Message(Base):
     file_url = Column(String(500), nullable=True)
     is_read = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # Numéro de séquence monotone dans la conversation (reprise après reconnexion)
+    seq = Column(Integer, nullable=True)
     
     # Relations
     conversation = relationship("Conversation", back_populates="messages")
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     attachments = relationship("ChatAttachment", back_populates="message", cascade="all, delete-orphan")
+    
+    # Index composite pour la pagination par curseur de l'historique
+    # + unicité du numéro de séquence dans une conversation
+    # + index GIN plein texte (PostgreSQL uniquement, ignoré ailleurs)
+    # SQLite : AUTOINCREMENT, sinon les id des derniers messages archivés
+    # seraient réattribués (collision avec messages_archive)
+    __table_args__ = (
+        sqlalchemy.Index('ix_messages_conversation_created_id', 'conversation_id', 'created_at', 'id'),
+        sqlalchemy.Index('ix_messages_conversation_seq', 'conversation_id', 'seq', unique=True),
+        sqlalchemy.Index(
+            'ix_messages_content_fts', message_search_vector(content), postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class MessageArchive(Base):
+    """
+    Tier froid des messages : mêmes colonnes et mêmes id que messages.
+    message_archive.py y déplace par lots les messages anciens, déjà lus et
+    sans pièce jointe ni notification ; les lectures interrogent les deux tables.
+    """
+    __tablename__ = "messages_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    content = Column(Text, nullable=False)
+    message_type = Column(String, default="text", nullable=False)
+    file_url = Column(String(500), nullable=True)
+    is_read = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    seq = Column(Integer, nullable=True)
+    
+    # Mêmes index que messages (pagination, reprise, plein texte)
+    __table_args__ = (
+        sqlalchemy.Index('ix_messages_archive_conversation_created_id', 'conversation_id', 'created_at', 'id'),
+        sqlalchemy.Index('ix_messages_archive_conversation_seq', 'conversation_id', 'seq', unique=True),
+        sqlalchemy.Index(
+            'ix_messages_archive_content_fts', message_search_vector(content), postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+    )
 
 
 class ChatAttachment(Base):
@@ -191,6 +325,8 @@ class ChatAttachment(Base):
     file_size = Column(BigInteger, nullable=True)
     file_path = Column(String(500), nullable=False)
     thumbnail_path = Column(String(500), nullable=True)
+    # Contenu partagé (NULL : ancien fichier propre à la pièce jointe)
+    blob_sha256 = Column(String(64), ForeignKey("file_blobs.sha256"), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Relation
@@ -198,17 +334,22 @@ class ChatAttachment(Base):
 
 
 class MessageReadStatus(Base):
-    """Table optionnelle pour tracker le statut de lecture détaillé"""
+    """
+    Filigrane de lecture : un utilisateur a lu tous les messages de la
+    conversation jusqu'au numéro de séquence last_read_seq inclus.
+    Une ligne par (conversation, participant), au lieu d'un drapeau par message.
+    """
     __tablename__ = "message_read_status"
     
     id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    last_read_seq = Column(Integer, default=0, server_default="0", nullable=False)
     read_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Contrainte unique
     __table_args__ = (
-        sqlalchemy.UniqueConstraint('message_id', 'user_id', name='unique_message_read'),
+        sqlalchemy.UniqueConstraint('conversation_id', 'user_id', name='unique_conversation_read'),
     )
 
 
@@ -221,4 +362,41 @@ class ChatNotification(Base):
     message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=True)
     notification_type = Column(String(50), nullable=False)  # new_message, new_conversation, etc.
     is_read = Column(Boolean, default=False, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    # File hors-ligne : frame à rejouer à la reconnexion (JSON), sauf pour
+    # new_message où message_id suffit à la reconstruire
+    payload = Column(Text, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+    
+    # Vidage de la file d'un utilisateur dans l'ordre
+    __table_args__ = (
+        sqlalchemy.Index('ix_chat_notifications_user_id_id', 'user_id', 'id'),
+    )
+
+
+class UploadSession(Base):
+    """
+    Upload reprenable (protocole type tus) : fichier reçu par morceaux dans
+    storage/partial/{id}.part, offset persisté après chaque PATCH. À la
+    finalisation, le Message + ChatAttachment ou le MedicalDocument est créé
+    une seule fois (result_id).
+    """
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(30), nullable=False)  # chat_attachment, medical_document
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=True)
+    document_type = Column(String(50), nullable=True)
+    original_filename = Column(String(255), nullable=False)
+    declared_mime_type = Column(String(100), nullable=True)
+    upload_length = Column(BigInteger, nullable=False)
+    upload_offset = Column(BigInteger, default=0, server_default="0", nullable=False)
+    status = Column(String(20), default="uploading", nullable=False)  # uploading, completed
+    # Message.id (chat_attachment) ou MedicalDocument.id (medical_document)
+    result_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Repoussé à chaque morceau reçu ; les sessions expirées sont purgées
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,277 @@
+# backend/offline_outbox.py
+"""
+File de livraison hors-ligne ("outbox") des événements temps réel.
+
+Quand un événement ne trouve aucune socket (ni sur ce worker, ni via le
+pub/sub), il est rangé dans chat_notifications pour son destinataire :
+
+- new_message : seul message_id est stocké, la frame est reconstruite au
+  vidage (contenu à jour, pas de JSON dupliqué par destinataire)
+- autres types : la frame JSON complète dans payload
+
+Les lignes sont écrites par lots (une fenêtre de flush, un INSERT
+multi-lignes). À la connexion suivante, la file de l'utilisateur est vidée
+dans l'ordre, par lots, AVANT les frames live :
+
+    {"type": "offline_batch", "events": [{"type": "new_message", ...}, ...]}
+    ...
+    {"type": "offline_complete", "delivered": 42}
+
+Écriture en échec (base indisponible) : le lot repasse en tête de la file
+en mémoire et l'écriture est retentée avec un délai croissant (jusqu'à
+CHAT_OUTBOX_RETRY_MAX_SECONDS) ; seules les entrées expirées entre-temps
+sont abandonnées.
+
+Les entrées non livrées expirent après CHAT_OUTBOX_TTL_HOURS et sont purgées
+périodiquement.
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from chat_resume import serialize_message
+from database import run_db
+from models import ChatNotification, Message, User
+from websocket_manager import ClientConnection
+
+OUTBOX_TTL_HOURS = float(os.getenv("CHAT_OUTBOX_TTL_HOURS", "72"))
+OUTBOX_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_OUTBOX_FLUSH_INTERVAL_MS", "100"))
+OUTBOX_MAX_BATCH = int(os.getenv("CHAT_OUTBOX_MAX_BATCH", "500"))
+OUTBOX_DRAIN_BATCH = int(os.getenv("CHAT_OUTBOX_DRAIN_BATCH", "200"))
+OUTBOX_PURGE_INTERVAL = float(os.getenv("CHAT_OUTBOX_PURGE_INTERVAL", "600"))
+OUTBOX_PURGE_BATCH = 5000
+# Délai maximal entre deux essais d'écriture après un échec
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("CHAT_OUTBOX_RETRY_MAX_SECONDS", "30"))
+
+# Types d'événements conservés pour les destinataires hors ligne
+OFFLINE_EVENT_TYPES = {"new_message", "messages_read"}
+
+
+def _insert_rows(db: Session, rows: List[dict]):
+    db.execute(insert(ChatNotification), rows)
+    db.commit()
+
+
+def _load_events(db: Session, user_id: int, after_id: int, limit: int) -> Tuple[List[dict], Optional[int]]:
+    """Prochain lot de la file (index user_id, id) : (frames, dernier id lu)"""
+    rows = db.query(ChatNotification, Message, User.name).outerjoin(
+        Message, Message.id == ChatNotification.message_id
+    ).outerjoin(
+        User, User.id == Message.sender_id
+    ).filter(
+        ChatNotification.user_id == user_id,
+        ChatNotification.id > after_id,
+        ChatNotification.expires_at > datetime.utcnow()
+    ).order_by(ChatNotification.id.asc()).limit(limit).all()
+
+    events = []
+    for notification, message, sender_name in rows:
+        if notification.payload is not None:
+            events.append(json.loads(notification.payload))
+        elif message is not None:
+            events.append({
+                "type": notification.notification_type,
+                "message": serialize_message(message, sender_name)
+            })
+        # sinon : message supprimé entre-temps, rien à livrer
+    last_id = rows[-1][0].id if rows else None
+    return events, last_id
+
+
+def _delete_up_to(db: Session, user_id: int, last_id: int):
+    db.execute(delete(ChatNotification).where(
+        ChatNotification.user_id == user_id,
+        ChatNotification.id <= last_id,
+        ChatNotification.expires_at.is_not(None)
+    ))
+    db.commit()
+
+
+def _purge_expired(db: Session, limit: int) -> int:
+    expired = select(ChatNotification.id).where(
+        ChatNotification.expires_at < datetime.utcnow()
+    ).limit(limit).scalar_subquery()
+    result = db.execute(delete(ChatNotification).where(ChatNotification.id.in_(expired)))
+    db.commit()
+    return result.rowcount or 0
+
+
+class OfflineOutbox:
+    """Écriture groupée, vidage à la connexion et purge des événements hors ligne"""
+
+    def __init__(
+        self,
+        max_batch: int = OUTBOX_MAX_BATCH,
+        flush_interval: float = OUTBOX_FLUSH_INTERVAL_MS / 1000,
+        ttl: timedelta = timedelta(hours=OUTBOX_TTL_HOURS)
+    ):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._pending: List[dict] = []
+        self._has_pending = asyncio.Event()
+        # Échecs d'écriture consécutifs (délai avant le prochain essai)
+        self._failures = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._purger: Optional[asyncio.Task] = None
+
+        # Métriques
+        self.stored_count = 0
+        self.delivered_count = 0
+        self.purged_count = 0
+        self.write_error_count = 0
+        self.expired_unwritten_count = 0
+
+    def start(self):
+        """Lancer les tâches de flush et de purge (idempotent)"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if self._purger is None or self._purger.done():
+            self._purger = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        """Écrire ce qui reste en attente puis arrêter les tâches"""
+        for task in (self._flusher, self._purger):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flusher = None
+        self._purger = None
+        if not await self.flush():
+            print(f"⚠️ Offline outbox stopped with {len(self._pending)} unwritten events")
+
+    def enqueue(self, user_ids: List[int], message: dict):
+        """
+        Ranger un événement pour des destinataires hors ligne (non bloquant).
+        Branché sur ConnectionManager.offline_sink.
+        """
+        event_type = message.get("type")
+        if event_type not in OFFLINE_EVENT_TYPES:
+            return
+
+        now = datetime.utcnow()
+        message_id = (message.get("message") or {}).get("id") if event_type == "new_message" else None
+        payload = None if message_id is not None else json.dumps(message, default=str)
+        for user_id in user_ids:
+            self._pending.append({
+                "user_id": user_id,
+                "message_id": message_id,
+                "notification_type": event_type,
+                "payload": payload,
+                "is_read": False,
+                "created_at": now,
+                "expires_at": now + self.ttl
+            })
+
+        self._has_pending.set()
+        try:
+            self.start()
+        except RuntimeError:
+            # Pas de boucle asyncio (script) : écrit au prochain flush()
+            pass
+
+    async def flush(self) -> bool:
+        """
+        Écrire immédiatement tout ce qui est en attente. En cas d'échec, le
+        lot repasse en tête de la file (sauf entrées expirées) et False est
+        retourné : la boucle de flush réessaiera.
+        """
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            try:
+                await run_db(_insert_rows, batch)
+            except Exception as e:
+                self.write_error_count += 1
+                now = datetime.utcnow()
+                kept = [row for row in batch if row["expires_at"] > now]
+                self.expired_unwritten_count += len(batch) - len(kept)
+                # En tête : l'ordre de livraison est conservé
+                self._pending[:0] = kept
+                print(f"❌ Offline outbox write failed ({len(batch)} events, {len(self._pending)} pending): {e}")
+                return False
+            self.stored_count += len(batch)
+        self._has_pending.clear()
+        return True
+
+    def _retry_delay(self) -> float:
+        return min(self.flush_interval * 2 ** self._failures, OUTBOX_RETRY_MAX_SECONDS)
+
+    async def _flush_loop(self):
+        while True:
+            await self._has_pending.wait()
+            if len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.flush_interval)
+            if await self.flush():
+                self._failures = 0
+            else:
+                # Base indisponible : délai croissant avant le prochain essai
+                self._failures += 1
+                await asyncio.sleep(self._retry_delay())
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(OUTBOX_PURGE_INTERVAL)
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                print(f"❌ Offline outbox purge failed: {e}")
+
+    async def purge_expired(self) -> int:
+        """Supprimer les entrées expirées, par lots"""
+        purged = 0
+        while True:
+            count = await run_db(_purge_expired, OUTBOX_PURGE_BATCH)
+            purged += count
+            if count < OUTBOX_PURGE_BATCH:
+                break
+        if purged:
+            self.purged_count += purged
+            print(f"🧹 Offline outbox: {purged} expired events purged")
+        return purged
+
+    async def drain(self, connection: ClientConnection, user_id: int) -> int:
+        """
+        Livrer la file d'un utilisateur qui vient de se connecter, dans l'ordre
+        et par lots, avant de relâcher les frames live. Retourne le nombre
+        d'événements livrés.
+        """
+        # Les événements encore en mémoire doivent passer avant le vidage
+        if any(row["user_id"] == user_id for row in self._pending):
+            await self.flush()
+
+        connection.pause()
+        delivered = 0
+        try:
+            after_id = 0
+            while True:
+                events, last_id = await run_db(_load_events, user_id, after_id, OUTBOX_DRAIN_BATCH)
+                if last_id is None:
+                    break
+                if events:
+                    await connection.send_direct({"type": "offline_batch", "events": events})
+                    delivered += len(events)
+                # Supprimé seulement après l'envoi : en cas de coupure, rejoué au prochain connect
+                await run_db(_delete_up_to, user_id, last_id)
+                after_id = last_id
+
+            if delivered:
+                await connection.send_direct({"type": "offline_complete", "delivered": delivered})
+                print(f"📬 User {user_id}: {delivered} offline events delivered")
+        finally:
+            connection.resume()
+
+        self.delivered_count += delivered
+        return delivered
+
+
+offline_outbox = OfflineOutbox()
@@ -0,0 +1,331 @@
+# backend/presence.py
+"""
+Présence (online / away / offline + last seen) et indicateurs de saisie.
+
+L'état de présence vit en mémoire, une entrée compacte par utilisateur
+connecté sur ce worker. Rien n'est écrit en base à chaque changement :
+
+- les changements sont regroupés et diffusés aux contacts toutes les
+  CHAT_PRESENCE_BROADCAST_MS (une connexion/déconnexion rapide ne produit
+  qu'une frame, voire aucune)
+- last_seen_at est écrit par instantanés, en un seul UPDATE groupé, toutes
+  les CHAT_PRESENCE_SNAPSHOT_INTERVAL secondes
+
+Frames envoyées aux contacts (utilisateurs partageant une conversation) :
+
+    {"type": "presence", "user_id": 3, "status": "away", "last_seen": "..."}
+
+Saisie : le client envoie {"type": "typing", "conversation_id": 12,
+"is_typing": true} à chaque frappe si besoin ; le serveur ne relaie qu'un
+"is_typing: true" toutes les CHAT_TYPING_MIN_INTERVAL_MS, plus le passage à
+false. L'indicateur expire côté client après "expires_in" secondes.
+
+Les deux types de frames sont fusionnables dans les files d'envoi : seule la
+dernière valeur par utilisateur (et par conversation) est envoyée.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.orm import Session
+
+from database import run_db
+from models import Conversation, User
+from websocket_manager import COALESCIBLE_FRAMES, ConnectionManager, manager
+
+PRESENCE_ONLINE = "online"
+PRESENCE_AWAY = "away"
+PRESENCE_OFFLINE = "offline"
+PRESENCE_STATUSES = {PRESENCE_ONLINE, PRESENCE_AWAY, PRESENCE_OFFLINE}
+
+PRESENCE_BROADCAST_INTERVAL = float(os.getenv("CHAT_PRESENCE_BROADCAST_MS", "1000")) / 1000
+# Sans aucune frame reçue pendant ce délai, l'utilisateur passe "away"
+PRESENCE_AWAY_AFTER = float(os.getenv("CHAT_PRESENCE_AWAY_AFTER", "300"))
+PRESENCE_SNAPSHOT_INTERVAL = float(os.getenv("CHAT_PRESENCE_SNAPSHOT_INTERVAL", "60"))
+TYPING_MIN_INTERVAL = float(os.getenv("CHAT_TYPING_MIN_INTERVAL_MS", "2000")) / 1000
+TYPING_TTL = 6
+CONTACTS_TTL = 300
+
+COALESCIBLE_FRAMES["presence"] = ("user_id",)
+COALESCIBLE_FRAMES["typing"] = ("conversation_id", "user_id")
+
+
+class PresenceState:
+    """État de présence d'un utilisateur connecté sur ce worker"""
+
+    __slots__ = ("status", "last_active", "last_seen", "idle_away")
+
+    def __init__(self):
+        self.status = PRESENCE_ONLINE
+        # Horloge monotone de la dernière frame reçue
+        self.last_active = time.monotonic()
+        self.last_seen = datetime.utcnow()
+        # True si "away" a été décidé par le serveur (inactivité)
+        self.idle_away = False
+
+
+def _load_contacts(db: Session, user_id: int) -> List[int]:
+    rows = db.query(Conversation.patient_id, Conversation.medecin_id).filter(
+        or_(Conversation.patient_id == user_id, Conversation.medecin_id == user_id)
+    ).all()
+    return list({row.medecin_id if row.patient_id == user_id else row.patient_id for row in rows})
+
+
+def _load_last_seen(db: Session, user_ids: List[int]) -> Dict[int, Optional[datetime]]:
+    rows = db.query(User.id, User.last_seen_at).filter(User.id.in_(user_ids)).all()
+    return {row.id: row.last_seen_at for row in rows}
+
+
+_last_seen_update = (
+    update(User.__table__)
+    .where(User.__table__.c.id == bindparam("uid"))
+    .values(last_seen_at=bindparam("seen"))
+)
+
+
+def _write_last_seen(db: Session, rows: List[dict]):
+    db.connection().execute(_last_seen_update, rows)
+    db.commit()
+
+
+class PresenceTracker:
+    """Suivi en mémoire de la présence et de la saisie, diffusion groupée"""
+
+    def __init__(self, connection_manager: ConnectionManager):
+        self.manager = connection_manager
+        self._states: Dict[int, PresenceState] = {}
+        # Utilisateurs dont la présence a changé depuis la dernière diffusion
+        self._changed: Set[int] = set()
+        # last_seen à écrire au prochain instantané (utilisateurs partis)
+        self._last_seen_pending: Dict[int, datetime] = {}
+        # (user_id, conversation_id) -> (dernier état relayé, instant du relais)
+        self._typing: Dict[Tuple[int, int], Tuple[bool, float]] = {}
+        # user_id -> (instant de chargement, contacts)
+        self._contacts: Dict[int, Tuple[float, List[int]]] = {}
+        self._broadcaster: Optional[asyncio.Task] = None
+        self._snapshotter: Optional[asyncio.Task] = None
+
+        # Métriques
+        self.broadcast_count = 0
+        self.typing_forwarded = 0
+        self.typing_suppressed = 0
+
+    def start(self):
+        """Lancer la diffusion groupée et les instantanés (idempotent)"""
+        if self._broadcaster is None or self._broadcaster.done():
+            self._broadcaster = asyncio.create_task(self._broadcast_loop())
+        if self._snapshotter is None or self._snapshotter.done():
+            self._snapshotter = asyncio.create_task(self._snapshot_loop())
+
+    async def stop(self):
+        """Arrêter les tâches et écrire un dernier instantané"""
+        for task in (self._broadcaster, self._snapshotter):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._broadcaster = None
+        self._snapshotter = None
+        now = datetime.utcnow()
+        for user_id in self._states:
+            self._last_seen_pending[user_id] = now
+        await self.flush_snapshot(include_connected=False)
+
+    # ============================================
+    # ÉVÉNEMENTS
+    # ============================================
+
+    def on_connection_change(self, user_id: int, online: bool):
+        """Branché sur ConnectionManager.presence_hook"""
+        if online:
+            self._states[user_id] = PresenceState()
+            self._last_seen_pending.pop(user_id, None)
+        else:
+            state = self._states.pop(user_id, None)
+            self._last_seen_pending[user_id] = datetime.utcnow()
+            for key in [k for k in self._typing if k[0] == user_id]:
+                del self._typing[key]
+            if state is None:
+                return
+        self._changed.add(user_id)
+
+    def touch(self, user_id: int):
+        """Frame reçue de l'utilisateur : il est actif"""
+        state = self._states.get(user_id)
+        if state is None:
+            return
+        state.last_active = time.monotonic()
+        if state.idle_away:
+            state.status = PRESENCE_ONLINE
+            state.idle_away = False
+            self._changed.add(user_id)
+
+    def set_status(self, user_id: int, status: str) -> bool:
+        """Statut choisi par le client (app au premier plan / en arrière-plan)"""
+        state = self._states.get(user_id)
+        if state is None or status not in (PRESENCE_ONLINE, PRESENCE_AWAY):
+            return False
+        state.idle_away = False
+        if state.status != status:
+            state.status = status
+            self._changed.add(user_id)
+        return True
+
+    def should_forward_typing(self, user_id: int, conversation_id: int, is_typing: bool) -> bool:
+        """Limiter le relais des frappes : un "true" par intervalle, plus le passage à false"""
+        key = (user_id, conversation_id)
+        now = time.monotonic()
+        last = self._typing.get(key)
+        if is_typing:
+            if last is not None and last[0] and now - last[1] < TYPING_MIN_INTERVAL:
+                self.typing_suppressed += 1
+                return False
+            self._typing[key] = (True, now)
+        else:
+            if last is None or not last[0]:
+                self.typing_suppressed += 1
+                return False
+            del self._typing[key]
+        self.typing_forwarded += 1
+        return True
+
+    def stop_typing(self, user_id: int, conversation_id: int):
+        """Message envoyé : la saisie en cours est terminée (le client efface l'indicateur)"""
+        self._typing.pop((user_id, conversation_id), None)
+
+    # ============================================
+    # LECTURE
+    # ============================================
+
+    def _frame(self, user_id: int) -> dict:
+        state = self._states.get(user_id)
+        if state is not None:
+            return {
+                "type": "presence",
+                "user_id": user_id,
+                "status": state.status,
+                "last_seen": state.last_seen.isoformat()
+            }
+        last_seen = self._last_seen_pending.get(user_id)
+        return {
+            "type": "presence",
+            "user_id": user_id,
+            "status": PRESENCE_OFFLINE,
+            "last_seen": last_seen.isoformat() if last_seen else None
+        }
+
+    async def get_presence(self, user_ids: Iterable[int]) -> List[dict]:
+        """Présence de plusieurs utilisateurs (mémoire, autres workers, puis base)"""
+        user_ids = list(dict.fromkeys(user_ids))
+        result: Dict[int, dict] = {}
+        unknown = []
+        # Un seul aller-retour au backend pour tous les utilisateurs absents de ce worker
+        elsewhere = await self.manager.backend.connected_elsewhere(
+            [user_id for user_id in user_ids if user_id not in self._states]
+        )
+        for user_id in user_ids:
+            if user_id in self._states:
+                result[user_id] = self._frame(user_id)
+            elif user_id in elsewhere:
+                result[user_id] = {"type": "presence", "user_id": user_id,
+                                   "status": PRESENCE_ONLINE, "last_seen": None}
+            else:
+                unknown.append(user_id)
+
+        if unknown:
+            stored = await run_db(_load_last_seen, unknown)
+            for user_id in unknown:
+                frame = self._frame(user_id)
+                if frame["last_seen"] is None and stored.get(user_id):
+                    frame["last_seen"] = stored[user_id].isoformat()
+                result[user_id] = frame
+        return [result[user_id] for user_id in user_ids]
+
+    async def get_contacts(self, user_id: int) -> List[int]:
+        cached = self._contacts.get(user_id)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < CONTACTS_TTL:
+            return cached[1]
+        contacts = await run_db(_load_contacts, user_id)
+        self._contacts[user_id] = (now, contacts)
+        return contacts
+
+    # ============================================
+    # TÂCHES PÉRIODIQUES
+    # ============================================
+
+    def _mark_idle_users(self):
+        deadline = time.monotonic() - PRESENCE_AWAY_AFTER
+        for user_id, state in self._states.items():
+            if state.status == PRESENCE_ONLINE and state.last_active < deadline:
+                state.status = PRESENCE_AWAY
+                state.idle_away = True
+                self._changed.add(user_id)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (_, at) in self._typing.items() if now - at > TYPING_TTL]:
+            del self._typing[key]
+        for user_id in [u for u, (at, _) in self._contacts.items() if now - at > CONTACTS_TTL]:
+            del self._contacts[user_id]
+
+    async def broadcast_changes(self):
+        """Diffuser l'état courant de chaque utilisateur dont la présence a changé"""
+        self._mark_idle_users()
+        changed, self._changed = self._changed, set()
+        elsewhere = await self.manager.backend.connected_elsewhere(
+            [user_id for user_id in changed if user_id not in self._states]
+        ) if changed else set()
+        for user_id in changed:
+            if user_id in elsewhere:
+                # Encore connecté via un autre worker : pas de "offline"
+                continue
+            try:
+                contacts = await self.get_contacts(user_id)
+            except Exception as e:
+                print(f"❌ Presence contacts error (user {user_id}): {e}")
+                continue
+            if contacts:
+                await self.manager.broadcast_to_conversation(self._frame(user_id), contacts)
+                self.broadcast_count += 1
+
+    async def _broadcast_loop(self):
+        while True:
+            await asyncio.sleep(PRESENCE_BROADCAST_INTERVAL)
+            try:
+                await self.broadcast_changes()
+                self._prune()
+            except Exception as e:
+                print(f"❌ Presence broadcast error: {e}")
+
+    async def flush_snapshot(self, include_connected: bool = True):
+        """Écrire last_seen_at des utilisateurs partis (et connectés) en un UPDATE groupé"""
+        now = datetime.utcnow()
+        pending, self._last_seen_pending = self._last_seen_pending, {}
+        if include_connected:
+            for user_id, state in self._states.items():
+                state.last_seen = now
+                pending[user_id] = now
+        if not pending:
+            return
+        rows = [{"uid": user_id, "seen": seen} for user_id, seen in pending.items()]
+        try:
+            await run_db(_write_last_seen, rows)
+        except Exception as e:
+            print(f"❌ Presence snapshot failed ({len(rows)} users): {e}")
+            for user_id, seen in pending.items():
+                self._last_seen_pending.setdefault(user_id, seen)
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(PRESENCE_SNAPSHOT_INTERVAL)
+            await self.flush_snapshot()
+
+
+presence = PresenceTracker(manager)
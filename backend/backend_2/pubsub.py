@@ -0,0 +1,278 @@
+# backend/pubsub.py
+"""
+Couche pub/sub pour la messagerie temps réel multi-workers.
+
+Chaque worker uvicorn possède ses propres WebSockets. Pour qu'un message
+émis sur le worker A atteigne un utilisateur connecté sur le worker B,
+le ConnectionManager passe par un backend pub/sub :
+
+- un registre "user_id -> workers qui détiennent ses sockets"
+- un canal par worker : on ne publie que vers les workers concernés,
+  le coût d'un envoi ne dépend donc pas du nombre total de workers.
+
+Backends disponibles :
+- InMemoryPubSub : un seul processus (dev, tests, un seul worker)
+- RedisPubSub    : plusieurs workers / machines via Redis (ou tout serveur
+                   compatible avec le protocole Redis)
+
+Le backend est choisi via la variable d'environnement CHAT_PUBSUB_URL
+(ex: redis://localhost:6379/0). Sans variable, on reste en mémoire.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+# Callback appelé quand un autre worker nous route un message
+DeliverCallback = Callable[[List[int], dict], Awaitable[None]]
+
+
+def generate_worker_id() -> str:
+    """Identifiant unique du worker courant (hôte + pid + suffixe aléatoire)"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class PubSubBackend:
+    """Interface commune à tous les backends pub/sub"""
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or generate_worker_id()
+        self._on_message: Optional[DeliverCallback] = None
+
+    async def start(self, on_message: DeliverCallback):
+        """Démarrer l'écoute des messages destinés à ce worker"""
+        self._on_message = on_message
+
+    async def stop(self):
+        """Arrêter l'écoute et libérer les ressources"""
+        self._on_message = None
+
+    async def register_user(self, user_id: int):
+        """Déclarer que ce worker détient au moins une socket de l'utilisateur"""
+        raise NotImplementedError
+
+    async def unregister_user(self, user_id: int):
+        """Déclarer que ce worker ne détient plus de socket de l'utilisateur"""
+        raise NotImplementedError
+
+    async def connected_elsewhere(self, user_ids: Iterable[int]) -> Set[int]:
+        """Parmi user_ids, ceux qui ont une socket sur un AUTRE worker (un seul aller-retour)"""
+        raise NotImplementedError
+
+    async def publish(self, message: dict, user_ids: Iterable[int]) -> Set[int]:
+        """
+        Router un message vers les AUTRES workers qui détiennent les sockets
+        des utilisateurs ciblés. Retourne les user_ids effectivement routés.
+        """
+        raise NotImplementedError
+
+
+# ============================================
+# BACKEND EN MÉMOIRE (UN SEUL PROCESSUS)
+# ============================================
+
+class InProcessHub:
+    """Registre partagé par tous les InMemoryPubSub d'un même processus"""
+
+    def __init__(self):
+        # user_id -> worker_ids
+        self.user_workers: Dict[int, Set[str]] = {}
+        # worker_id -> callback de livraison
+        self.workers: Dict[str, DeliverCallback] = {}
+
+
+_default_hub = InProcessHub()
+
+
+class InMemoryPubSub(PubSubBackend):
+    """
+    Backend en mémoire. Plusieurs instances partageant le même hub se
+    comportent comme des workers distincts, ce qui permet de tester le
+    routage sans broker.
+    """
+
+    def __init__(self, worker_id: Optional[str] = None, hub: Optional[InProcessHub] = None):
+        super().__init__(worker_id)
+        self.hub = hub or _default_hub
+
+    async def start(self, on_message: DeliverCallback):
+        await super().start(on_message)
+        self.hub.workers[self.worker_id] = on_message
+
+    async def stop(self):
+        self.hub.workers.pop(self.worker_id, None)
+        for workers in self.hub.user_workers.values():
+            workers.discard(self.worker_id)
+        await super().stop()
+
+    async def register_user(self, user_id: int):
+        self.hub.user_workers.setdefault(user_id, set()).add(self.worker_id)
+
+    async def unregister_user(self, user_id: int):
+        workers = self.hub.user_workers.get(user_id)
+        if workers is None:
+            return
+        workers.discard(self.worker_id)
+        if not workers:
+            del self.hub.user_workers[user_id]
+
+    async def connected_elsewhere(self, user_ids: Iterable[int]) -> Set[int]:
+        return {
+            user_id for user_id in user_ids
+            if any(w != self.worker_id for w in self.hub.user_workers.get(user_id, ()))
+        }
+
+    async def publish(self, message: dict, user_ids: Iterable[int]) -> Set[int]:
+        by_worker: Dict[str, List[int]] = {}
+        for user_id in dict.fromkeys(user_ids):
+            for worker_id in self.hub.user_workers.get(user_id, ()):
+                if worker_id != self.worker_id:
+                    by_worker.setdefault(worker_id, []).append(user_id)
+
+        routed: Set[int] = set()
+        tasks = []
+        for worker_id, targets in by_worker.items():
+            callback = self.hub.workers.get(worker_id)
+            if callback is None:
+                continue
+            tasks.append(callback(targets, message))
+            routed.update(targets)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return routed
+
+
+# ============================================
+# BACKEND REDIS (PLUSIEURS WORKERS)
+# ============================================
+
+class RedisPubSub(PubSubBackend):
+    """
+    Backend Redis.
+
+    - SET  chat:user:{user_id}:workers  -> workers détenant les sockets
+    - PUB  chat:worker:{worker_id}      -> canal propre à chaque worker
+
+    Un worker arrêté brutalement ne se désinscrit pas : quand un PUBLISH
+    n'atteint aucun abonné, on retire ce worker du registre des
+    utilisateurs concernés.
+    """
+
+    USER_KEY = "chat:user:{}:workers"
+    WORKER_CHANNEL = "chat:worker:{}"
+
+    def __init__(self, url: str, worker_id: Optional[str] = None):
+        super().__init__(worker_id)
+        self.url = url
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def channel(self) -> str:
+        return self.WORKER_CHANNEL.format(self.worker_id)
+
+    async def start(self, on_message: DeliverCallback):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("Le paquet 'redis' est requis pour CHAT_PUBSUB_URL=redis://...") from e
+
+        await super().start(on_message)
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen())
+        print(f"📡 Pub/sub Redis démarré (worker {self.worker_id})")
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+        await super().stop()
+
+    async def _listen(self):
+        """Boucle de réception des messages routés vers ce worker"""
+        async for item in self._pubsub.listen():
+            if item.get("type") != "message":
+                continue
+            try:
+                payload = json.loads(item["data"])
+                await self._on_message(payload["user_ids"], payload["message"])
+            except Exception as e:
+                print(f"❌ Pub/sub delivery error: {e}")
+
+    async def register_user(self, user_id: int):
+        if self._redis is not None:
+            await self._redis.sadd(self.USER_KEY.format(user_id), self.worker_id)
+
+    async def unregister_user(self, user_id: int):
+        if self._redis is not None:
+            await self._redis.srem(self.USER_KEY.format(user_id), self.worker_id)
+
+    async def connected_elsewhere(self, user_ids: Iterable[int]) -> Set[int]:
+        user_ids = list(dict.fromkeys(user_ids))
+        if self._redis is None or not user_ids:
+            return set()
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.smembers(self.USER_KEY.format(user_id))
+            results = await pipe.execute()
+        return {
+            user_id for user_id, workers in zip(user_ids, results)
+            if any(w != self.worker_id for w in workers)
+        }
+
+    async def publish(self, message: dict, user_ids: Iterable[int]) -> Set[int]:
+        if self._redis is None:
+            return set()
+
+        user_ids = list(dict.fromkeys(user_ids))
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.smembers(self.USER_KEY.format(user_id))
+            results = await pipe.execute()
+
+        # Regrouper les destinataires par worker : un seul PUBLISH par worker
+        by_worker: Dict[str, List[int]] = {}
+        for user_id, workers in zip(user_ids, results):
+            for worker_id in workers:
+                if worker_id != self.worker_id:
+                    by_worker.setdefault(worker_id, []).append(user_id)
+
+        routed: Set[int] = set()
+        for worker_id, targets in by_worker.items():
+            payload = json.dumps({"user_ids": targets, "message": message}, default=str)
+            receivers = await self._redis.publish(self.WORKER_CHANNEL.format(worker_id), payload)
+            if receivers:
+                routed.update(targets)
+            else:
+                # Worker mort : nettoyer le registre
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for user_id in targets:
+                        pipe.srem(self.USER_KEY.format(user_id), worker_id)
+                    await pipe.execute()
+        return routed
+
+
+def create_backend_from_env() -> PubSubBackend:
+    """Choisir le backend selon CHAT_PUBSUB_URL"""
+    url = os.getenv("CHAT_PUBSUB_URL", "")
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPubSub(url)
+    return InMemoryPubSub()
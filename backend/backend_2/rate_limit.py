@@ -0,0 +1,166 @@
+# backend/rate_limit.py
+"""
+Limitation de débit en entrée (seaux à jetons).
+
+- par socket      : toutes les frames reçues (CHAT_WS_FRAME_RATE / BURST)
+- par utilisateur : frames qui écrivent en base et diffusent, c'est-à-dire
+                    les messages (CHAT_USER_MESSAGE_RATE / BURST), toutes
+                    sockets de l'utilisateur confondues sur ce worker
+- par utilisateur : uploads REST (CHAT_UPLOAD_RATE_PER_MINUTE / BURST)
+
+Une frame refusée n'est pas traitée ; le client reçoit :
+
+    {"type": "rate_limited", "frame_type": "message", "retry_after_ms": 180,
+     "client_message_id": "..."}
+
+Après CHAT_WS_MAX_REJECTED refus consécutifs, la socket est fermée (1008).
+Un upload refusé reçoit 429 avec l'en-tête Retry-After (secondes).
+
+Coût mémoire : un seau = deux flottants (__slots__), créé à la première
+frame de la socket ; les seaux utilisateurs redevenus pleins sont purgés.
+Un débit à 0 désactive la limite correspondante.
+"""
+
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+WS_FRAME_RATE = float(os.getenv("CHAT_WS_FRAME_RATE", "10"))
+WS_FRAME_BURST = float(os.getenv("CHAT_WS_FRAME_BURST", "30"))
+USER_MESSAGE_RATE = float(os.getenv("CHAT_USER_MESSAGE_RATE", "5"))
+USER_MESSAGE_BURST = float(os.getenv("CHAT_USER_MESSAGE_BURST", "20"))
+UPLOAD_RATE_PER_MINUTE = float(os.getenv("CHAT_UPLOAD_RATE_PER_MINUTE", "10"))
+UPLOAD_BURST = float(os.getenv("CHAT_UPLOAD_BURST", "5"))
+WS_MAX_REJECTED = int(os.getenv("CHAT_WS_MAX_REJECTED", "100"))
+
+# Frames sans écriture de message : seule la limite par socket s'applique
+# (typing est en plus filtré par presence.should_forward_typing)
+LIGHT_FRAME_TYPES = {"typing", "read", "presence", "resume", "ping"}
+
+
+class TokenBucket:
+    """Jetons disponibles et date du dernier calcul ; débit et rafale portés par l'appelant"""
+
+    __slots__ = ("tokens", "stamp")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, rate: float, burst: float, now: float, cost: float = 1.0) -> float:
+        """Consommer cost jetons : 0 si accepté, sinon secondes avant qu'ils soient disponibles"""
+        tokens = min(burst, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        if tokens >= cost:
+            self.tokens = tokens - cost
+            return 0.0
+        self.tokens = tokens
+        return (cost - tokens) / rate
+
+
+class KeyedRateLimiter:
+    """Un seau par clé (user_id), supprimé une fois de nouveau plein"""
+
+    def __init__(self, rate: float, burst: float, sweep_interval: float = 60):
+        self.rate = rate
+        self.burst = burst
+        self.sweep_interval = sweep_interval
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+        self.rejected_count = 0
+
+    def take(self, key: int, now: Optional[float] = None, cost: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        wait = bucket.take(self.rate, self.burst, now, cost)
+        if wait:
+            self.rejected_count += 1
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(now)
+        return wait
+
+    def _sweep(self, now: float):
+        """Un seau inactif depuis burst / rate secondes est plein : inutile de le garder"""
+        refill_time = self.burst / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if now - bucket.stamp < refill_time
+        }
+        self._last_sweep = now
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+user_messages = KeyedRateLimiter(USER_MESSAGE_RATE, USER_MESSAGE_BURST)
+user_uploads = KeyedRateLimiter(UPLOAD_RATE_PER_MINUTE / 60, UPLOAD_BURST)
+
+
+# ============================================
+# FRAMES WEBSOCKET
+# ============================================
+
+def admit_frame(connection, frame_type: Optional[str]) -> float:
+    """
+    Décompter une frame reçue sur une ClientConnection.
+    Retourne 0 si elle peut être traitée, sinon le délai conseillé (secondes).
+    """
+    now = time.monotonic()
+    wait = 0.0
+    if WS_FRAME_RATE > 0:
+        if connection.ingress is None:
+            connection.ingress = TokenBucket(WS_FRAME_BURST, now)
+        wait = connection.ingress.take(WS_FRAME_RATE, WS_FRAME_BURST, now)
+    if not wait and frame_type not in LIGHT_FRAME_TYPES:
+        wait = user_messages.take(connection.user_id, now)
+
+    if wait:
+        connection.rejected_count += 1
+        connection.reject_streak += 1
+    else:
+        connection.reject_streak = 0
+    return wait
+
+
+def rejection_frame(data: dict, wait: float) -> dict:
+    return {
+        "type": "rate_limited",
+        "frame_type": data.get("type") or "message",
+        "retry_after_ms": math.ceil(wait * 1000),
+        "client_message_id": data.get("client_message_id")
+    }
+
+
+def should_disconnect(connection) -> bool:
+    """Client qui insiste malgré les refus : fermer la socket"""
+    return WS_MAX_REJECTED > 0 and connection.reject_streak >= WS_MAX_REJECTED
+
+
+# ============================================
+# UPLOADS REST
+# ============================================
+
+def check_upload_rate(user_id: int):
+    """Lever 429 (avec Retry-After) si l'utilisateur dépasse son débit d'uploads"""
+    wait = user_uploads.take(user_id)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Trop d'envois de fichiers, réessayez plus tard",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+
+def limiter_stats() -> dict:
+    return {
+        "user_message_buckets": len(user_messages),
+        "user_messages_rejected": user_messages.rejected_count,
+        "user_upload_buckets": len(user_uploads),
+        "user_uploads_rejected": user_uploads.rejected_count
+    }
@@ -0,0 +1,260 @@
+# backend/read_receipts.py
+"""
+Accusés de lecture par filigrane (watermark).
+
+Lire une conversation ne modifie plus chaque message : on avance, pour le
+lecteur, un seul filigrane "lu jusqu'au seq N" (table message_read_status).
+
+- non-lus = messages de l'autre participant dont seq > filigrane ; les
+  compteurs de la conversation n'en sont qu'un cache, recalculé à chaque
+  avancée du filigrane (parcours borné par l'index (conversation_id, seq))
+- is_read d'un message = seq <= filigrane de son destinataire
+
+Les lectures (REST ou frame WebSocket {"type": "read", "conversation_id": 12,
+"seq": 340}) sont regroupées dans une fenêtre de flush : une seule
+transaction par lot, et seule la position la plus avancée de chaque
+(conversation, lecteur) est retenue. L'autre participant reçoit ensuite :
+
+    {"type": "messages_read", "conversation_id": 12, "user_id": 7,
+     "seq": 340, "read_at": "..."}
+
+Frame fusionnable dans les files d'envoi : seule la dernière position compte.
+"""
+
+import asyncio
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from database import run_db
+from models import Conversation, Message, MessageReadStatus
+from websocket_manager import COALESCIBLE_FRAMES, ConnectionManager, manager
+
+READ_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_READ_FLUSH_INTERVAL_MS", "250"))
+
+COALESCIBLE_FRAMES["messages_read"] = ("conversation_id", "user_id")
+
+_watermarks = MessageReadStatus.__table__
+
+
+def _upsert_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT qui ne fait jamais reculer un filigrane"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    stmt = insert(_watermarks)
+    return stmt.on_conflict_do_update(
+        index_elements=[_watermarks.c.conversation_id, _watermarks.c.user_id],
+        set_={"last_read_seq": stmt.excluded.last_read_seq, "read_at": stmt.excluded.read_at},
+        where=_watermarks.c.last_read_seq < stmt.excluded.last_read_seq
+    )
+
+
+def _save_watermarks(db: Session, rows: List[dict]):
+    stmt = _upsert_statement(db.get_bind().dialect.name)
+    if stmt is not None:
+        db.execute(stmt, rows)
+        return
+    # Autres bases : lecture puis écriture
+    for row in rows:
+        status = db.query(MessageReadStatus).filter(
+            MessageReadStatus.conversation_id == row["conversation_id"],
+            MessageReadStatus.user_id == row["user_id"]
+        ).first()
+        if status is None:
+            db.add(MessageReadStatus(**row))
+        elif status.last_read_seq < row["last_read_seq"]:
+            status.last_read_seq = row["last_read_seq"]
+            status.read_at = row["read_at"]
+    db.flush()
+
+
+def unread_count_query(conversation_id, user_id, last_read_seq):
+    """Messages de l'autre participant au-delà du filigrane (sous-requête scalaire)"""
+    return select(func.count(Message.id)).where(
+        Message.conversation_id == conversation_id,
+        Message.seq > last_read_seq,
+        Message.sender_id != user_id
+    ).scalar_subquery()
+
+
+def load_watermarks(db: Session, conversation_id: int) -> Dict[int, int]:
+    """user_id -> last_read_seq pour une conversation"""
+    rows = db.query(MessageReadStatus.user_id, MessageReadStatus.last_read_seq).filter(
+        MessageReadStatus.conversation_id == conversation_id
+    ).all()
+    return {row.user_id: row.last_read_seq for row in rows}
+
+
+def apply_read_positions(db: Session, positions: Dict[Tuple[int, int], Optional[int]]) -> List[dict]:
+    """
+    Avancer les filigranes {(conversation_id, user_id): seq} (None = tout lu)
+    et recalculer les compteurs de non-lus. Retourne les avancées effectives.
+    Ne commit pas.
+    """
+    conversation_ids = list({conversation_id for conversation_id, _ in positions})
+    conversations = {
+        row.id: row for row in db.query(
+            Conversation.id, Conversation.patient_id, Conversation.medecin_id, Conversation.last_seq
+        ).filter(Conversation.id.in_(conversation_ids)).all()
+    }
+    current = {
+        (row.conversation_id, row.user_id): row.last_read_seq
+        for row in db.query(
+            MessageReadStatus.conversation_id, MessageReadStatus.user_id, MessageReadStatus.last_read_seq
+        ).filter(MessageReadStatus.conversation_id.in_(conversation_ids)).all()
+    }
+
+    now = datetime.utcnow()
+    advanced = []
+    for (conversation_id, user_id), seq in positions.items():
+        conversation = conversations.get(conversation_id)
+        if conversation is None or user_id not in (conversation.patient_id, conversation.medecin_id):
+            continue
+        # Impossible de lire au-delà du dernier message
+        target = conversation.last_seq if seq is None else min(seq, conversation.last_seq)
+        previous = current.get((conversation_id, user_id))
+        if previous is not None and target <= previous:
+            continue
+        advanced.append({
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "last_read_seq": target,
+            "read_at": now,
+            "other_id": conversation.medecin_id if user_id == conversation.patient_id else conversation.patient_id,
+            "is_patient": user_id == conversation.patient_id
+        })
+
+    if not advanced:
+        return []
+
+    _save_watermarks(db, [
+        {key: row[key] for key in ("conversation_id", "user_id", "last_read_seq", "read_at")}
+        for row in advanced
+    ])
+    # Recalcul dans le même UPDATE : pas de fenêtre avec un message écrit entre-temps
+    conversations_table = Conversation.__table__
+    for row in advanced:
+        counter = "patient_unread_count" if row["is_patient"] else "medecin_unread_count"
+        db.execute(
+            update(conversations_table)
+            .where(conversations_table.c.id == row["conversation_id"])
+            .values({counter: unread_count_query(row["conversation_id"], row["user_id"], row["last_read_seq"])})
+        )
+    return advanced
+
+
+def _flush_positions(db: Session, positions: Dict[Tuple[int, int], Optional[int]]) -> List[dict]:
+    try:
+        advanced = apply_read_positions(db, positions)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return advanced
+
+
+class ReadReceiptBatcher:
+    """Regroupe les lectures de toutes les sockets et requêtes REST"""
+
+    def __init__(
+        self,
+        connection_manager: ConnectionManager,
+        flush_interval: float = READ_FLUSH_INTERVAL_MS / 1000
+    ):
+        self.manager = connection_manager
+        self.flush_interval = flush_interval
+        # (conversation_id, user_id) -> seq le plus avancé (None = tout lu)
+        self._pending: Dict[Tuple[int, int], Optional[int]] = {}
+        self._waiters: List[asyncio.Future] = []
+        self._has_pending = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+        # Métriques
+        self.flush_count = 0
+        self.receipts_count = 0
+        self.merged_count = 0
+
+    def start(self):
+        """Lancer la tâche de flush (idempotent)"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Écrire les lectures en attente puis arrêter la tâche de flush"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def mark_read(self, conversation_id: int, user_id: int, seq: Optional[int] = None):
+        """Enregistrer une lecture jusqu'à seq (None = jusqu'au dernier message), sans attendre"""
+        key = (conversation_id, user_id)
+        if key in self._pending:
+            self.merged_count += 1
+            previous = self._pending[key]
+            if previous is None or (seq is not None and seq <= previous):
+                return
+        self._pending[key] = seq
+        self._has_pending.set()
+        self.start()
+
+    async def mark_read_and_wait(self, conversation_id: int, user_id: int, seq: Optional[int] = None):
+        """Comme mark_read, mais attendre que le lot soit écrit (REST)"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self.mark_read(conversation_id, user_id, seq)
+        await future
+
+    async def _flush_loop(self):
+        while True:
+            await self._has_pending.wait()
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        positions, self._pending = self._pending, {}
+        waiters, self._waiters = self._waiters, []
+        self._has_pending.clear()
+        if not positions:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            return
+
+        try:
+            advanced = await run_db(_flush_positions, positions)
+        except Exception as e:
+            print(f"❌ Read receipts flush failed ({len(positions)} positions): {e}")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+
+        self.flush_count += 1
+        self.receipts_count += len(advanced)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+        for row in advanced:
+            await self.manager.broadcast_to_conversation({
+                "type": "messages_read",
+                "conversation_id": row["conversation_id"],
+                "user_id": row["user_id"],
+                "seq": row["last_read_seq"],
+                "read_at": row["read_at"].isoformat()
+            }, [row["other_id"]])
+
+
+read_receipts = ReadReceiptBatcher(manager)
@@ -0,0 +1,402 @@
+# backend/resumable_uploads.py
+"""
+Uploads reprenables (inspirés de tus) pour les pièces jointes du chat et
+les documents médicaux.
+
+    POST   /upload-sessions        -> 201, upload_id, Location
+    HEAD   /upload-sessions/{id}   -> Upload-Offset / Upload-Length
+    PATCH  /upload-sessions/{id}   Upload-Offset: n, corps = octets suivants
+    GET    /upload-sessions/{id}   -> état, et résultat une fois terminé
+    DELETE /upload-sessions/{id}   -> abandon
+
+Après une coupure, le client relit l'offset (HEAD) et reprend à partir de
+là : les octets reçus avant la coupure sont conservés. Le dernier PATCH
+finalise : contrôle du type réel, SHA-256, dépôt dans le stockage
+dédupliqué (blob_store) et création des lignes (Message + ChatAttachment,
+ou MedicalDocument) dans la MÊME transaction que le passage de la session
+à "completed" : une finalisation rejouée ou concurrente ne crée rien de plus.
+
+Les sessions sans nouvelle donnée depuis UPLOAD_SESSION_TTL_HOURS sont
+purgées (fichier partiel compris) par UploadSessionJanitor.
+"""
+
+import asyncio
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+
+import auth
+from blob_store import acquire_blob, blob_location, blob_url, install_blob, reserve_blob
+from database import run_db
+from message_writer import update_conversation_summaries
+from models import ChatAttachment, MedicalDocument, Message, UploadSession, User
+from utils.file_handler import MAX_FILE_SIZE, SNIFF_BYTES, UPLOAD_CHUNK_SIZE, sniff_mime_type
+
+# Hors de uploads/ : contenu pas encore analysé, jamais servi tel quel
+PARTIAL_DIR = os.getenv("UPLOAD_PARTIAL_DIR", "storage/partial")
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+UPLOAD_PURGE_INTERVAL = float(os.getenv("UPLOAD_PURGE_INTERVAL", "900"))
+UPLOAD_PURGE_BATCH = 500
+
+KIND_CHAT_ATTACHMENT = "chat_attachment"
+KIND_MEDICAL_DOCUMENT = "medical_document"
+MAX_SIZES = {
+    KIND_CHAT_ATTACHMENT: MAX_FILE_SIZE,
+    KIND_MEDICAL_DOCUMENT: auth.MAX_DOCUMENT_SIZE,
+}
+DOCUMENT_TYPES = ["mutuelle", "ordonnance", "analyse", "radio", "autre"]
+
+STATUS_UPLOADING = "uploading"
+STATUS_COMPLETED = "completed"
+
+os.makedirs(PARTIAL_DIR, exist_ok=True)
+
+
+class UploadConflict(Exception):
+    """Offset inattendu, ou session déjà modifiée ailleurs"""
+
+
+def partial_path(upload_id: str) -> str:
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+
+def _expiry(now: datetime) -> datetime:
+    return now + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+
+
+# ============================================
+# CRÉATION ET ÉCRITURE DES MORCEAUX
+# ============================================
+
+def create_session(db: Session, user_id: int, kind: str, length: int, filename: str,
+                   mime_type: Optional[str] = None, conversation_id: Optional[int] = None,
+                   document_type: Optional[str] = None) -> UploadSession:
+    """Créer la session et son fichier partiel vide (les accès sont vérifiés par l'appelant)"""
+    now = datetime.utcnow()
+    session = UploadSession(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        kind=kind,
+        conversation_id=conversation_id,
+        document_type=document_type,
+        original_filename=filename,
+        declared_mime_type=mime_type,
+        upload_length=length,
+        upload_offset=0,
+        status=STATUS_UPLOADING,
+        created_at=now,
+        updated_at=now,
+        expires_at=_expiry(now)
+    )
+    open(partial_path(session.id), "wb").close()
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return session
+
+
+def get_live_session(db: Session, upload_id: str) -> Optional[UploadSession]:
+    """Session existante et non expirée"""
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if session is None or session.expires_at <= datetime.utcnow():
+        return None
+    return session
+
+
+def session_state(db: Session, upload_id: str) -> Optional[dict]:
+    """Instantané d'une session vivante (sans objet ORM), résultat compris si terminée"""
+    session = get_live_session(db, upload_id)
+    if session is None:
+        return None
+    state = {
+        "upload_id": session.id,
+        "kind": session.kind,
+        "status": session.status,
+        "conversation_id": session.conversation_id,
+        "offset": session.upload_offset,
+        "length": session.upload_length,
+        "expires_at": session.expires_at,
+        "result": None
+    }
+    if session.status == STATUS_COMPLETED:
+        state["result"] = session_result(db, session)
+    return state
+
+
+def open_partial(upload_id: str, offset: int):
+    """Fichier partiel positionné à offset (tout octet au-delà est écarté)"""
+    part = open(partial_path(upload_id), "r+b")
+    part.truncate(offset)
+    part.seek(offset)
+    return part
+
+
+def record_offset(db: Session, upload_id: str, expected: int, offset: int):
+    """Persister le nouvel offset, seulement s'il n'a pas bougé entre-temps"""
+    now = datetime.utcnow()
+    table = UploadSession.__table__
+    result = db.execute(
+        update(table).where(
+            table.c.id == upload_id,
+            table.c.upload_offset == expected,
+            table.c.status == STATUS_UPLOADING
+        ).values(upload_offset=offset, updated_at=now, expires_at=_expiry(now))
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        raise UploadConflict(upload_id)
+    db.commit()
+
+
+# ============================================
+# FINALISATION (UNE SEULE FOIS)
+# ============================================
+
+def _hash_file(path: str) -> Tuple[str, bytes]:
+    digest = hashlib.sha256()
+    head = b""
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(head) < SNIFF_BYTES:
+                head += chunk[:SNIFF_BYTES - len(head)]
+            digest.update(chunk)
+    return digest.hexdigest(), head
+
+
+def _document_filename(session: UploadSession, now: datetime) -> str:
+    """Nom logique d'un document médical (le contenu est dans le stockage dédupliqué)"""
+    extension = os.path.splitext(session.original_filename)[1]
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    return f"{session.user_id}_{session.document_type}_{timestamp}_{session.id[:8]}{extension}"
+
+
+def _create_rows(db: Session, session: UploadSession, storage_path: str, sha256: str,
+                 mime_type: str, now: datetime) -> int:
+    """Lignes métier de l'upload terminé ; retourne leur id (Message ou MedicalDocument)"""
+    acquire_blob(db, sha256)
+    if session.kind == KIND_MEDICAL_DOCUMENT:
+        document = MedicalDocument(
+            user_id=session.user_id,
+            filename=_document_filename(session, now),
+            original_filename=session.original_filename,
+            file_type=session.document_type,
+            file_size=session.upload_length,
+            mime_type=mime_type,
+            blob_sha256=sha256
+        )
+        db.add(document)
+        db.flush()
+        return document.id
+
+    row = {
+        "conversation_id": session.conversation_id,
+        "sender_id": session.user_id,
+        "content": session.original_filename,
+        "message_type": "image" if mime_type.startswith("image/") else "document",
+        "file_url": blob_url(storage_path),
+        "is_read": False,
+        "created_at": now
+    }
+    # Résumé de la conversation + numéro de séquence, dans la même transaction
+    update_conversation_summaries(db, [row])
+    message = Message(**row)
+    db.add(message)
+    db.flush()
+    db.add(ChatAttachment(
+        message_id=message.id,
+        file_name=session.original_filename,
+        file_type=mime_type,
+        file_size=session.upload_length,
+        file_path=blob_location(storage_path),
+        blob_sha256=sha256
+    ))
+    return message.id
+
+
+def finalize_session(db: Session, upload_id: str) -> Tuple[dict, bool]:
+    """
+    Finaliser un upload complet. Retourne (résultat, créé par cet appel).
+    Une session déjà finalisée retourne son résultat sans rien recréer.
+    """
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if session is None:
+        raise UploadConflict(upload_id)
+    if session.status == STATUS_COMPLETED:
+        return session_result(db, session), False
+    if session.upload_offset != session.upload_length:
+        raise UploadConflict(upload_id)
+
+    part = partial_path(upload_id)
+    sha256, head = _hash_file(part)
+    mime_type = sniff_mime_type(head, session.declared_mime_type)
+    # Contenu réservé (transaction courte) avant la finalisation proprement dite
+    storage_path = reserve_blob(db, sha256, session.upload_length, mime_type)
+
+    now = datetime.utcnow()
+    table = UploadSession.__table__
+    # Le passage à "completed" réserve la finalisation (verrou d'écriture jusqu'au commit)
+    claimed = db.execute(
+        update(table).where(
+            table.c.id == upload_id,
+            table.c.status == STATUS_UPLOADING,
+            table.c.upload_offset == table.c.upload_length
+        ).values(status=STATUS_COMPLETED, updated_at=now, expires_at=_expiry(now))
+    ).rowcount
+    if claimed != 1:
+        db.rollback()
+        session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+        if session is None or session.status != STATUS_COMPLETED:
+            raise UploadConflict(upload_id)
+        return session_result(db, session), False
+
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    # Lien (ou copie) du fichier partiel : il reste intact si la transaction échoue
+    install_blob(part, storage_path, keep_source=True, content_type=mime_type)
+    try:
+        session.result_id = _create_rows(db, session, storage_path, sha256, mime_type, now)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    try:
+        os.unlink(part)
+    except FileNotFoundError:
+        pass
+    result = session_result(db, session)
+    result["sha256"] = sha256
+    return result, True
+
+
+def session_result(db: Session, session: UploadSession) -> dict:
+    """Ce que l'upload a créé (message du chat ou document médical)"""
+    if session.kind == KIND_MEDICAL_DOCUMENT:
+        document = db.query(MedicalDocument).filter(MedicalDocument.id == session.result_id).first()
+        if document is None:
+            return {"kind": session.kind, "document": None}
+        return {
+            "kind": session.kind,
+            "document": {
+                "id": document.id,
+                "filename": document.filename,
+                "original_filename": document.original_filename,
+                "file_type": document.file_type,
+                "upload_date": document.upload_date.isoformat(),
+                "file_size": document.file_size,
+                "mime_type": document.mime_type
+            }
+        }
+
+    row = db.query(Message, User.name).outerjoin(User, User.id == Message.sender_id).filter(
+        Message.id == session.result_id
+    ).first()
+    if row is None:
+        return {"kind": session.kind, "message": None}
+    message, sender_name = row
+    return {
+        "kind": session.kind,
+        "message": {
+            "id": message.id,
+            "conversation_id": message.conversation_id,
+            "seq": message.seq,
+            "sender_id": message.sender_id,
+            "sender_name": sender_name,
+            "content": message.content,
+            "message_type": message.message_type,
+            "file_url": message.file_url,
+            "created_at": message.created_at.isoformat(),
+            "is_read": False
+        }
+    }
+
+
+# ============================================
+# PURGE DES SESSIONS ABANDONNÉES
+# ============================================
+
+def _purge_expired(db: Session, limit: int) -> int:
+    now = datetime.utcnow()
+    rows = db.query(UploadSession.id, UploadSession.status).filter(
+        UploadSession.expires_at <= now
+    ).limit(limit).all()
+    if not rows:
+        return 0
+    for row in rows:
+        if row.status == STATUS_UPLOADING:
+            try:
+                os.unlink(partial_path(row.id))
+            except FileNotFoundError:
+                pass
+    db.execute(delete(UploadSession.__table__).where(
+        UploadSession.__table__.c.id.in_([row.id for row in rows]),
+        UploadSession.__table__.c.expires_at <= now
+    ))
+    db.commit()
+    return len(rows)
+
+
+def discard_session(db: Session, upload_id: str) -> bool:
+    """Abandon explicite d'un upload en cours"""
+    table = UploadSession.__table__
+    deleted = db.execute(delete(table).where(
+        table.c.id == upload_id, table.c.status == STATUS_UPLOADING
+    )).rowcount
+    db.commit()
+    if deleted:
+        try:
+            os.unlink(partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+    return bool(deleted)
+
+
+class UploadSessionJanitor:
+    """Purge périodique des sessions expirées et de leurs fichiers partiels"""
+
+    def __init__(self, interval: float = UPLOAD_PURGE_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.purged_count = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception as e:
+                print(f"❌ Upload sessions purge failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def purge_expired(self) -> int:
+        purged = 0
+        while True:
+            count = await run_db(_purge_expired, UPLOAD_PURGE_BATCH)
+            purged += count
+            if count < UPLOAD_PURGE_BATCH:
+                break
+        if purged:
+            self.purged_count += purged
+            print(f"🧹 Upload sessions: {purged} expired sessions purged")
+        return purged
+
+
+upload_janitor = UploadSessionJanitor()
@@ -1,14 +1,32 @@
-from fastapi import APIRouter, WebSocket, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, WebSocket, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from sqlalchemy import case, tuple_
+from sqlalchemy.orm import Session, aliased
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 import os
-import uuid
 
-from database import get_db
-from models import Conversation, Message, User
+from database import get_db, run_db
+from models import ChatAttachment, Conversation, Message, User
 from websocket_manager import manager
+from message_writer import message_writer, update_conversation_summaries
+from conversation_cache import fetch_participants, get_participants
+from chat_resume import parse_resume_request, replay_missed_messages
+from offline_outbox import offline_outbox
+from presence import TYPING_TTL, presence
+from read_receipts import load_watermarks, read_receipts
+from message_search import SEARCH_MAX_OFFSET, search_messages
+from message_archive import find_message_position, load_history_page, message_archiver
+from rate_limit import admit_frame, check_upload_rate, limiter_stats, rejection_frame, should_disconnect
+from blob_store import (
+    acquire_blob, blob_scan_status, blob_sha256_from_name, find_blob, release_blob, serve_blob, store_upload
+)
+from document_previews import document_preview_worker
+from file_validation import file_validation_worker
+from image_variants import image_variant_worker, variant_key, variant_urls
+from utils.file_response import file_response
+from utils.image_processing import remove_variants
+from utils.file_handler import MAX_FILE_SIZE, UPLOAD_DIR as CHAT_UPLOAD_DIR
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -26,6 +44,7 @@ class MessageResponse(BaseModel):
     is_read: bool
     created_at: datetime
     sender_name: Optional[str] = None
+    seq: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -46,6 +65,22 @@ class ConversationResponse(BaseModel):
 class StatusResponse(BaseModel):
     status: str
 
+class SearchHit(BaseModel):
+    message_id: int
+    conversation_id: int
+    sender_id: int
+    sender_name: Optional[str] = None
+    message_type: str
+    created_at: datetime
+    seq: Optional[int] = None
+    rank: float
+    snippet: str
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+
 # ============================================
 # FONCTIONS UTILITAIRES
 # ============================================
@@ -56,33 +91,94 @@ async def save_message(
     content: str,
     message_type: str,
     db: Session,
-    file_url: Optional[str] = None
+    file_url: Optional[str] = None,
+    attachment: Optional[dict] = None
 ) -> Message:
-    """Sauvegarder un message dans la base de données"""
-    message = Message(
-        conversation_id=conversation_id,
-        sender_id=sender_id,
-        content=content,
-        message_type=message_type,
-        file_url=file_url,
-        is_read=False
-    )
+    """
+    Sauvegarder un message et mettre à jour la conversation en un seul commit.
+    attachment : fichier déjà dans le stockage dédupliqué (store_upload),
+    référencé dans la même transaction.
+    """
+    row = {
+        "conversation_id": conversation_id,
+        "sender_id": sender_id,
+        "content": content,
+        "message_type": message_type,
+        "file_url": file_url,
+        "is_read": False,
+        "created_at": datetime.utcnow()
+    }
+    
+    # Résumé de la conversation + numéro de séquence, dans la même transaction
+    update_conversation_summaries(db, [row])
+    message = Message(**row)
     db.add(message)
+    if attachment is not None:
+        acquire_blob(db, attachment["sha256"])
+        message.attachments.append(ChatAttachment(
+            file_name=attachment["original_name"],
+            file_type=attachment["mime_type"],
+            file_size=attachment["size"],
+            file_path=attachment["file_path"],
+            blob_sha256=attachment["sha256"]
+        ))
     db.commit()
     db.refresh(message)
     
-    # Mettre à jour last_message_at dans la conversation
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    if conversation:
-        conversation.last_message_at = message.created_at
-        db.commit()
-    
     return message
 
+def _get_user_name(db: Session, user_id: int) -> Optional[str]:
+    """Nom d'un utilisateur (appelé dans le pool DB)"""
+    row = db.query(User.name).filter(User.id == user_id).first()
+    return row.name if row else None
+
 async def get_conversation(conversation_id: int, db: Session) -> Optional[Conversation]:
     """Récupérer une conversation"""
     return db.query(Conversation).filter(Conversation.id == conversation_id).first()
 
+async def handle_typing_frame(connection, user_id: int, data: dict):
+    """{"type": "typing", "conversation_id": 12, "is_typing": true} -> l'autre participant"""
+    try:
+        conversation_id = int(data.get("conversation_id"))
+    except (TypeError, ValueError):
+        connection.enqueue({"type": "error", "message": "Missing required field: conversation_id"})
+        return
+    
+    participants = await fetch_participants(conversation_id)
+    if participants is None or user_id not in participants:
+        connection.enqueue({"type": "error", "message": "Conversation not found"})
+        return
+    
+    is_typing = bool(data.get("is_typing", True))
+    if not presence.should_forward_typing(user_id, conversation_id, is_typing):
+        return
+    
+    patient_id, medecin_id = participants
+    recipient_id = medecin_id if user_id == patient_id else patient_id
+    await manager.send_personal_message({
+        "type": "typing",
+        "conversation_id": conversation_id,
+        "user_id": user_id,
+        "is_typing": is_typing,
+        "expires_in": TYPING_TTL
+    }, recipient_id)
+
+async def handle_read_frame(connection, user_id: int, data: dict):
+    """{"type": "read", "conversation_id": 12, "seq": 340} (sans seq : tout est lu)"""
+    try:
+        conversation_id = int(data.get("conversation_id"))
+        seq = int(data["seq"]) if data.get("seq") is not None else None
+    except (TypeError, ValueError):
+        connection.enqueue({"type": "error", "message": "Invalid read frame: conversation_id, seq"})
+        return
+    
+    participants = await fetch_participants(conversation_id)
+    if participants is None or user_id not in participants:
+        connection.enqueue({"type": "error", "message": "Conversation not found"})
+        return
+    
+    read_receipts.mark_read(conversation_id, user_id, seq)
+
 # ============================================
 # WEBSOCKET ENDPOINT - VERSION UNIQUE CORRIGÉE
 # ============================================
@@ -91,95 +187,151 @@ async def get_conversation(conversation_id: int, db: Session) -> Optional[Conver
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     """WebSocket pour la messagerie en temps réel"""
     
-    # Obtenir la session DB
-    from database import SessionLocal
-    db = SessionLocal()
-    
-    # Récupérer le nom de l'utilisateur AVANT de connecter
+    # Aucune requête bloquante sur la boucle : tout passe par le pool DB dédié
     try:
-        sender = db.query(User).filter(User.id == user_id).first()
-        sender_name = sender.name if sender else f"User {user_id}"
+        sender_name = await run_db(_get_user_name, user_id)
     except Exception as e:
         print(f"❌ Error fetching user {user_id}: {e}")
-        sender_name = f"User {user_id}"
+        sender_name = None
+    sender_name = sender_name or f"User {user_id}"
     
-    # Connecter le websocket
-    await manager.connect(websocket, user_id)
+    # Connecter le websocket (les réponses passent par sa file d'envoi)
+    connection = await manager.connect(websocket, user_id)
     print(f"🔌 WebSocket connected for {sender_name} (ID: {user_id})")
     
     try:
+        # Livrer d'abord les événements reçus pendant l'absence
+        await offline_outbox.drain(connection, user_id)
+        
         while True:
             # Recevoir les données
-            data = await websocket.receive_json()
+            data = await connection.receive()
+            presence.touch(user_id)
+            frame_type = data.get("type")
+            
+            # Débit d'entrée : frame refusée (avec délai conseillé) plutôt qu'écrite
+            wait = admit_frame(connection, frame_type)
+            if wait:
+                if should_disconnect(connection):
+                    print(f"🚫 Flood from user {user_id}: closing socket ({connection.rejected_count} frames refused)")
+                    await websocket.close(code=1008)
+                    break
+                connection.enqueue(rejection_frame(data, wait))
+                continue
+            
+            # Heartbeat initié par le client (compté dans le débit ci-dessus)
+            if frame_type == "ping":
+                connection.answer_ping(data)
+                continue
+            
+            # Saisie en cours : relayée au plus une fois par intervalle, sans log par frappe
+            if frame_type == "typing":
+                await handle_typing_frame(connection, user_id, data)
+                continue
+            
             print(f"📩 Received from {sender_name}: {data}")
             
+            # Reprise après reconnexion : rejouer uniquement les messages manquants
+            if frame_type == "resume":
+                await replay_missed_messages(connection, user_id, parse_resume_request(data))
+                continue
+            
+            # Lecture jusqu'à un seq : regroupée puis notifiée à l'autre participant
+            if frame_type == "read":
+                await handle_read_frame(connection, user_id, data)
+                continue
+            
+            # Statut choisi par l'app (premier plan / arrière-plan)
+            if frame_type == "presence":
+                if not presence.set_status(user_id, data.get("status")):
+                    connection.enqueue({
+                        "type": "error",
+                        "message": "Invalid presence status (online, away)"
+                    })
+                continue
+            
             # Valider les données reçues
             if not all(key in data for key in ["conversation_id", "content"]):
-                await websocket.send_json({
+                connection.enqueue({
                     "type": "error",
                     "message": "Missing required fields: conversation_id, content"
                 })
                 continue
             
-            # Sauvegarder le message en DB
             try:
-                message = await save_message(
-                    conversation_id=data["conversation_id"],
+                conversation_id = int(data["conversation_id"])
+            except (TypeError, ValueError):
+                connection.enqueue({
+                    "type": "error",
+                    "message": "Invalid conversation_id"
+                })
+                continue
+
+            # Participants depuis le cache (pas de requête par frame)
+            participants = await fetch_participants(conversation_id)
+            if participants is None or user_id not in participants:
+                print(f"⚠️ Conversation {conversation_id} not found")
+                connection.enqueue({
+                    "type": "error",
+                    "message": "Conversation not found"
+                })
+                continue
+            
+            patient_id, medecin_id = participants
+            recipient_id = medecin_id if user_id == patient_id else patient_id
+            message_type = data.get("message_type", "text")
+            
+            # Sauvegarder le message en DB (écriture groupée avec les autres sockets)
+            try:
+                saved = await message_writer.submit(
+                    conversation_id=conversation_id,
                     sender_id=user_id,
                     content=data["content"],
-                    message_type=data.get("message_type", "text"),
-                    db=db
+                    message_type=message_type
                 )
             except Exception as e:
                 print(f"❌ Error saving message: {e}")
-                await websocket.send_json({
+                connection.enqueue({
                     "type": "error",
                     "message": f"Failed to save message: {str(e)}"
                 })
                 continue
             
-            # Récupérer la conversation et envoyer aux participants
-            conversation = await get_conversation(data["conversation_id"], db)
+            # Accusé de réception avec l'id durable
+            connection.enqueue({
+                "type": "message_ack",
+                "client_message_id": data.get("client_message_id"),
+                "message_id": saved["id"],
+                "conversation_id": conversation_id,
+                "seq": saved["seq"],
+                "created_at": saved["created_at"].isoformat()
+            })
             
-            if conversation:
-                # Déterminer le destinataire
-                recipient_id = (
-                    conversation.medecin_id 
-                    if user_id == conversation.patient_id 
-                    else conversation.patient_id
-                )
-                
-                # Construire le message à envoyer
-                message_data = {
-                    "type": "new_message",
-                    "message": {
-                        "id": message.id,
-                        "conversation_id": message.conversation_id,
-                        "sender_id": message.sender_id,
-                        "sender_name": sender_name,
-                        "content": message.content,
-                        "message_type": message.message_type,
-                        "file_url": message.file_url,
-                        "created_at": message.created_at.isoformat(),
-                        "is_read": False
-                    }
+            # Construire le message à envoyer
+            message_data = {
+                "type": "new_message",
+                "message": {
+                    "id": saved["id"],
+                    "conversation_id": conversation_id,
+                    "seq": saved["seq"],
+                    "sender_id": user_id,
+                    "sender_name": sender_name,
+                    "content": data["content"],
+                    "message_type": message_type,
+                    "file_url": None,
+                    "created_at": saved["created_at"].isoformat(),
+                    "is_read": False
                 }
-                
-                print(f"📤 Broadcasting message to users: [{user_id}, {recipient_id}]")
-                
-                # Envoyer à tous les participants
-                await manager.broadcast_to_conversation(
-                    message_data, 
-                    [user_id, recipient_id]
-                )
-                
-                print(f"✅ Message broadcasted successfully")
-            else:
-                print(f"⚠️ Conversation {data['conversation_id']} not found")
-                await websocket.send_json({
-                    "type": "error",
-                    "message": "Conversation not found"
-                })
+            }
+            
+            presence.stop_typing(user_id, conversation_id)
+            print(f"📤 Broadcasting message to users: [{user_id}, {recipient_id}]")
+            
+            # Envoyer à tous les participants
+            await manager.broadcast_to_conversation(
+                message_data, 
+                [user_id, recipient_id]
+            )
     
     except Exception as e:
         print(f"❌ WebSocket error for user {user_id}: {e}")
@@ -190,7 +342,6 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
         # Toujours déconnecter proprement
         print(f"🔌 Disconnecting user {user_id}")
         await manager.disconnect(websocket, user_id)
-        db.close()
         print(f"✅ User {user_id} fully disconnected")
 
 # ============================================
@@ -200,117 +351,209 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def get_user_conversations(
     user_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Récupérer toutes les conversations d'un utilisateur"""
-    
-    conversations = db.query(Conversation).filter(
+    """
+    Récupérer les conversations d'un utilisateur, de la plus récente à la plus ancienne.
+    
+    Une seule requête : noms, aperçu du dernier message et non-lus sont lus
+    depuis le résumé maintenu sur la conversation. Pour la page suivante,
+    passer before/before_id = last_message_at/id du dernier élément reçu.
+    """
+    Patient = aliased(User)
+    Medecin = aliased(User)
+    
+    query = db.query(
+        Conversation.id,
+        Conversation.patient_id,
+        Conversation.medecin_id,
+        Conversation.last_message_at,
+        Conversation.last_message_preview,
+        Patient.name.label("patient_name"),
+        Medecin.name.label("medecin_name"),
+        case(
+            (Conversation.patient_id == user_id, Conversation.patient_unread_count),
+            else_=Conversation.medecin_unread_count
+        ).label("unread_count")
+    ).outerjoin(
+        Patient, Patient.id == Conversation.patient_id
+    ).outerjoin(
+        Medecin, Medecin.id == Conversation.medecin_id
+    ).filter(
         (Conversation.patient_id == user_id) | (Conversation.medecin_id == user_id)
-    ).all()
-    
-    result = []
-    for conv in conversations:
-        # Récupérer les noms
-        patient = db.query(User).filter(User.id == conv.patient_id).first()
-        medecin = db.query(User).filter(User.id == conv.medecin_id).first()
-        
-        # Récupérer le dernier message
-        last_msg = db.query(Message).filter(
-            Message.conversation_id == conv.id
-        ).order_by(Message.created_at.desc()).first()
-        
-        # Compter les messages non lus
-        unread_count = db.query(Message).filter(
-            Message.conversation_id == conv.id,
-            Message.sender_id != user_id,
-            Message.is_read == False
-        ).count()
-        
-        result.append(ConversationResponse(
-            id=conv.id,
-            patient_id=conv.patient_id,
-            medecin_id=conv.medecin_id,
-            patient_name=patient.name if patient else "Unknown",
-            medecin_name=medecin.name if medecin else "Unknown",
-            last_message=last_msg.content if last_msg else None,
-            last_message_at=conv.last_message_at,
-            unread_count=unread_count
-        ))
-    
-    # Trier par date du dernier message
-    result.sort(key=lambda x: x.last_message_at or datetime.min, reverse=True)
+    )
     
-    return result
+    # Pagination par curseur (last_message_at, id)
+    if before is not None:
+        query = query.filter(
+            tuple_(Conversation.last_message_at, Conversation.id) < tuple_(before, before_id)
+            if before_id is not None else Conversation.last_message_at < before
+        )
+    
+    rows = query.order_by(
+        Conversation.last_message_at.desc().nulls_last(), Conversation.id.desc()
+    ).limit(limit).all()
+    
+    return [
+        ConversationResponse(
+            id=row.id,
+            patient_id=row.patient_id,
+            medecin_id=row.medecin_id,
+            patient_name=row.patient_name or "Unknown",
+            medecin_name=row.medecin_name or "Unknown",
+            last_message=row.last_message_preview,
+            last_message_at=row.last_message_at,
+            unread_count=row.unread_count or 0
+        )
+        for row in rows
+    ]
 
 @router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_conversation_messages(
     conversation_id: int,
     user_id: int,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=200),
     offset: int = 0,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Récupérer les messages d'une conversation"""
+    """
+    Récupérer les messages d'une conversation, en ordre chronologique.
     
-    # Vérifier que l'utilisateur fait partie de la conversation
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        (Conversation.patient_id == user_id) | (Conversation.medecin_id == user_id)
-    ).first()
+    - before_id : les `limit` messages précédant ce message (remonter l'historique)
+    - after_id  : les `limit` messages suivant ce message (rattraper les nouveaux)
+    - sans curseur : pagination limit/offset historique depuis le début
     
-    if not conversation:
+    Les curseurs s'appuient sur l'index (conversation_id, created_at, id) :
+    le coût d'une page ne dépend pas de la longueur de la conversation.
+    Les messages archivés (messages_archive) sont inclus.
+    """
+    
+    # Vérifier que l'utilisateur fait partie de la conversation
+    participants = get_participants(conversation_id, db)
+    if participants is None or user_id not in participants:
         raise HTTPException(status_code=403, detail="Accès non autorisé")
     
-    # Récupérer les messages (du plus ancien au plus récent pour l'affichage)
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(
-        Message.created_at.asc()  # ✅ ASC pour ordre chronologique
-    ).limit(limit).offset(offset).all()
-    
-    # Enrichir avec le nom de l'expéditeur
-    result = []
-    for msg in messages:
-        sender = db.query(User).filter(User.id == msg.sender_id).first()
-        result.append(MessageResponse(
+    # Curseur : position (created_at, id) du message, archivé ou non
+    cursor_id = before_id if before_id is not None else after_id
+    cursor_position = None
+    if cursor_id is not None:
+        cursor_position = find_message_position(db, conversation_id, cursor_id)
+        if cursor_position is None:
+            raise HTTPException(status_code=400, detail="Curseur invalide")
+    
+    # Tiers chaud et archive fusionnés, nom de l'expéditeur résolu dans la même requête
+    rows = load_history_page(
+        db, conversation_id, limit,
+        before=cursor_position if before_id is not None else None,
+        after=cursor_position if before_id is None else None,
+        offset=offset if cursor_id is None else 0
+    )
+    
+    # Lu = seq <= filigrane du destinataire du message
+    watermarks = load_watermarks(db, conversation_id)
+    patient_id, medecin_id = participants
+    
+    def is_read(msg) -> bool:
+        recipient_id = medecin_id if msg.sender_id == patient_id else patient_id
+        return msg.is_read or (msg.seq is not None and msg.seq <= watermarks.get(recipient_id, 0))
+    
+    return [
+        MessageResponse(
             id=msg.id,
             conversation_id=msg.conversation_id,
             sender_id=msg.sender_id,
             content=msg.content,
             message_type=msg.message_type,
             file_url=msg.file_url,
-            is_read=msg.is_read,
+            is_read=is_read(msg),
             created_at=msg.created_at,
-            sender_name=sender.name if sender else None
-        ))
-    
-    return result
+            sender_name=sender_name,
+            seq=msg.seq
+        )
+        for msg, sender_name in rows
+    ]
+
+@router.get("/connections/stats")
+async def get_connection_stats(user_id: Optional[int] = None):
+    """Métriques des files d'envoi WebSocket de ce worker (détail par socket si user_id)"""
+    return manager.get_connection_stats(user_id)
+
+@router.get("/workers/stats")
+async def get_worker_stats():
+    """Métriques des traitements de fond de ce worker (fichiers, archivage, limites de débit)"""
+    return {
+        "file_validation": file_validation_worker.stats(),
+        "image_variants": image_variant_worker.stats(),
+        "document_previews": document_preview_worker.stats(),
+        "message_archive": message_archiver.stats(),
+        "rate_limits": limiter_stats()
+    }
+
+@router.get("/presence")
+async def get_presence(user_ids: str = Query(..., description="ids séparés par des virgules, ex: 3,7,12")):
+    """Présence (online / away / offline) et dernière activité de plusieurs utilisateurs"""
+    try:
+        ids = [int(part) for part in user_ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="user_ids invalide")
+    if len(ids) > 200:
+        raise HTTPException(status_code=400, detail="200 utilisateurs maximum")
+    return await presence.get_presence(ids)
+
+@router.get("/search", response_model=SearchResponse)
+async def search_conversation_messages(
+    user_id: int,
+    q: str = Query(..., min_length=2, max_length=200),
+    conversation_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    db: Session = Depends(get_db)
+):
+    """
+    Rechercher dans les messages de ses conversations (ou d'une seule).
+    
+    Syntaxe : mots (tous requis), "phrase exacte", -mot pour exclure.
+    Résultats classés par pertinence, extraits avec les termes entre
+    <mark></mark> ; next_offset est null sur la dernière page.
+    """
+    if conversation_id is not None:
+        participants = get_participants(conversation_id, db)
+        if participants is None or user_id not in participants:
+            raise HTTPException(status_code=403, detail="Accès non autorisé")
+    
+    results, next_offset = await run_db(search_messages, user_id, q, conversation_id, limit, offset)
+    return SearchResponse(
+        query=q,
+        results=[SearchHit(**result) for result in results],
+        next_offset=next_offset
+    )
 
 @router.post("/conversations/{conversation_id}/read", response_model=StatusResponse)
 async def mark_messages_as_read(
     conversation_id: int,
     user_id: int,
+    up_to_seq: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Marquer les messages comme lus"""
+    """
+    Marquer les messages comme lus (jusqu'à up_to_seq, sinon jusqu'au dernier).
     
-    # Vérifier l'accès
-    conversation = db.query(Conversation).filter(
-        Conversation.id == conversation_id,
-        (Conversation.patient_id == user_id) | (Conversation.medecin_id == user_id)
-    ).first()
+    Avance le filigrane de lecture du lecteur au lieu de modifier chaque
+    message ; l'autre participant est notifié par WebSocket (messages_read).
+    """
     
-    if not conversation:
+    # Vérifier l'accès
+    participants = get_participants(conversation_id, db)
+    if participants is None or user_id not in participants:
         raise HTTPException(status_code=403, detail="Accès non autorisé")
     
-    # Marquer comme lus
-    db.query(Message).filter(
-        Message.conversation_id == conversation_id,
-        Message.sender_id != user_id,
-        Message.is_read == False
-    ).update({"is_read": True})
-    
-    db.commit()
+    # Écrit avec les autres lectures du même lot, la réponse part une fois durable
+    await read_receipts.mark_read_and_wait(conversation_id, user_id, up_to_seq)
     
     return StatusResponse(status="success")
 
@@ -323,6 +566,9 @@ async def upload_file(
 ):
     """Upload un fichier (image, document)"""
     
+    # Débit d'uploads par utilisateur (429 + Retry-After)
+    check_upload_rate(sender_id)
+    
     # Vérifier l'accès à la conversation
     conversation = db.query(Conversation).filter(
         Conversation.id == conversation_id,
@@ -332,31 +578,15 @@ async def upload_file(
     if not conversation:
         raise HTTPException(status_code=403, detail="Accès non autorisé")
     
-    # Créer le dossier uploads s'il n'existe pas
-    UPLOAD_DIR = "uploads/chat"
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    
-    # Vérifier la taille du fichier (max 10MB)
-    content = await file.read()
-    if len(content) > 10 * 1024 * 1024:  # 10MB
-        raise HTTPException(status_code=400, detail="Fichier trop volumineux (max 10MB)")
-    
-    # Générer un nom unique
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    # Sauvegarder le fichier
-    with open(file_path, "wb") as buffer:
-        buffer.write(content)
+    # Écrit en flux (taille vérifiée au fil de l'eau, type réel détecté),
+    # une seule fois par contenu
+    stored = await store_upload(file, MAX_FILE_SIZE)
+    unique_filename = os.path.basename(stored["storage_path"])
     
     # Déterminer le type de message
-    mime_type = file.content_type or "application/octet-stream"
+    mime_type = stored["mime_type"]
     if mime_type.startswith("image/"):
         message_type = "image"
-    elif mime_type in ["application/pdf", "application/msword", 
-                       "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
-        message_type = "document"
     else:
         message_type = "document"
     
@@ -364,29 +594,29 @@ async def upload_file(
     sender = db.query(User).filter(User.id == sender_id).first()
     sender_name = sender.name if sender else None
     
-    # Créer un message avec le fichier
-    file_url = f"/uploads/chat/{unique_filename}"
-    message = Message(
+    # Créer un message avec le fichier (et sa pièce jointe)
+    file_url = stored["url"]
+    message = await save_message(
         conversation_id=conversation_id,
         sender_id=sender_id,
         content=file.filename,
         message_type=message_type,
+        db=db,
         file_url=file_url,
-        is_read=False
+        attachment=stored
     )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
     
-    # Mettre à jour la conversation
-    conversation.last_message_at = message.created_at
-    db.commit()
+    # Contenu en quarantaine jusqu'à son analyse (frame attachment_status) ;
+    # puis variantes des images (frame attachment_variants)
+    validation_queued = file_validation_worker.submit(stored["sha256"], message.id)
+    variants_pending = message_type == "image" and validation_queued
     
     return {
         "success": True,
         "message": {
             "id": message.id,
             "conversation_id": message.conversation_id,
+            "seq": message.seq,
             "sender_id": message.sender_id,
             "sender_name": sender_name,  # ✅ Ajouté
             "content": message.content,
@@ -399,21 +629,59 @@ async def upload_file(
             "filename": unique_filename,
             "original_name": file.filename,
             "url": file_url,
-            "size": len(content)
-        }
+            "size": stored["size"],
+            "sha256": stored["sha256"]
+        },
+        "variants_pending": variants_pending
     }
 
-@router.get("/download/{filename}")
-async def download_file(filename: str):
-    """Télécharger un fichier"""
-    from fastapi.responses import FileResponse
+@router.get("/messages/{message_id}/variants")
+async def get_message_variants(message_id: int, user_id: int, db: Session = Depends(get_db)):
+    """Variantes des images d'un message (status pending tant qu'elles ne sont pas prêtes)"""
+    message = db.query(Message).filter(Message.id == message_id).first()
+    participants = get_participants(message.conversation_id, db) if message else None
+    if participants is None or user_id not in participants:
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
     
-    file_path = os.path.join("uploads/chat", filename)
+    attachments = []
+    for attachment in message.attachments:
+        if not attachment.file_type.startswith("image/"):
+            continue
+        variants = variant_urls(attachment.thumbnail_path)
+        if attachment.thumbnail_path is None:
+            status = "pending"
+        else:
+            status = "ready" if variants else "failed"
+        attachments.append({"attachment_id": attachment.id, "status": status, "variants": variants})
+    
+    return {"message_id": message_id, "attachments": attachments}
+
+@router.get("/download/{filename}")
+async def download_file(filename: str, request: Request):
+    """Télécharger un fichier (ETag, 304, Range / 206)"""
+    
+    # Contenu dédupliqué (<sha256>.<ext>) : immuable, ETag = hash
+    # (stockage distant : redirection vers une URL pré-signée)
+    storage_path = find_blob(filename)
+    if storage_path:
+        sha256 = blob_sha256_from_name(filename)
+        return serve_blob(
+            request,
+            storage_path,
+            sha256,
+            await run_db(blob_scan_status, sha256),
+            media_type="application/octet-stream",
+            filename=filename
+        )
+    
+    # Ancien fichier de uploads/chat
+    file_path = os.path.join(CHAT_UPLOAD_DIR, os.path.basename(filename))
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Fichier non trouvé")
     
-    return FileResponse(
+    return file_response(
+        request,
         file_path,
         media_type="application/octet-stream",
         filename=filename
@@ -473,10 +741,17 @@ async def delete_attachment(
     if not message:
         raise HTTPException(status_code=403, detail="Accès non autorisé")
     
-    # Supprimer le fichier physique si présent
-    if message.file_url:
+    # Contenus partagés : une référence de moins (fichier et variantes effacés par la collecte)
+    for attachment in message.attachments:
+        if attachment.blob_sha256:
+            release_blob(db, attachment.blob_sha256)
+        else:
+            remove_variants(variant_key(attachment.id, None))
+    
+    # Ancien fichier propre au message : supprimé tout de suite
+    if message.file_url and message.file_url.startswith("/uploads/chat/"):
         filename = message.file_url.split("/")[-1]
-        file_path = os.path.join("uploads/chat", filename)
+        file_path = os.path.join(CHAT_UPLOAD_DIR, filename)
         if os.path.exists(file_path):
             os.remove(file_path)
     
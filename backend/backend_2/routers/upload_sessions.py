@@ -0,0 +1,218 @@
+import asyncio
+import os
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from conversation_cache import fetch_participants, get_participants
+from database import get_db, run_db
+from file_validation import file_validation_worker
+from models import User
+from rate_limit import check_upload_rate
+from resumable_uploads import (
+    DOCUMENT_TYPES, KIND_CHAT_ATTACHMENT, MAX_SIZES, STATUS_COMPLETED,
+    UploadConflict, create_session, discard_session, finalize_session, open_partial,
+    record_offset, session_state
+)
+from websocket_manager import manager
+
+router = APIRouter(prefix="/upload-sessions", tags=["Resumable uploads"])
+
+OFFSET_CONTENT_TYPE = "application/offset+octet-stream"
+
+# Un seul PATCH à la fois par session sur ce worker
+_session_locks: Dict[str, asyncio.Lock] = {}
+
+# ============================================
+# PYDANTIC SCHEMAS
+# ============================================
+
+class UploadSessionCreate(BaseModel):
+    user_id: int
+    kind: str  # chat_attachment, medical_document
+    size: int
+    filename: str
+    mime_type: Optional[str] = None
+    conversation_id: Optional[int] = None  # chat_attachment
+    document_type: Optional[str] = "mutuelle"  # medical_document
+
+# ============================================
+# FONCTIONS UTILITAIRES
+# ============================================
+
+def _offset_headers(state: dict, offset: Optional[int] = None) -> dict:
+    expires_at = state["expires_at"].replace(tzinfo=timezone.utc)
+    return {
+        "Upload-Offset": str(state["offset"] if offset is None else offset),
+        "Upload-Length": str(state["length"]),
+        "Upload-Expires": format_datetime(expires_at, usegmt=True),
+        "Cache-Control": "no-store"
+    }
+
+async def _load_state(upload_id: str) -> dict:
+    state = await run_db(session_state, upload_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Upload inconnu ou expiré")
+    return state
+
+def _close_partial(part):
+    part.flush()
+    os.fsync(part.fileno())
+    part.close()
+
+async def _announce_message(result: dict):
+    """Upload finalisé : contenu mis en analyse ; pièce jointe diffusée comme un message du chat"""
+    message = result.get("message")
+    # Quarantaine levée par file_validation (puis variantes des images)
+    file_validation_worker.submit(result["sha256"], message["id"] if message else None)
+    if message is None:
+        return
+    participants = await fetch_participants(message["conversation_id"])
+    if participants:
+        await manager.broadcast_to_conversation({"type": "new_message", "message": message}, list(participants))
+
+# ============================================
+# ENDPOINTS
+# ============================================
+
+@router.post("", status_code=201)
+async def create_upload_session(payload: UploadSessionCreate, db: Session = Depends(get_db)):
+    """Ouvrir un upload reprenable (pièce jointe du chat ou document médical)"""
+
+    if payload.kind not in MAX_SIZES:
+        raise HTTPException(status_code=400, detail=f"kind invalide: {payload.kind}")
+    max_size = MAX_SIZES[payload.kind]
+    if payload.size <= 0:
+        raise HTTPException(status_code=400, detail="Taille invalide")
+    if payload.size > max_size:
+        raise HTTPException(status_code=413, detail=f"Fichier trop volumineux (max {max_size // (1024 * 1024)}MB)")
+
+    document_type = None
+    if payload.kind == KIND_CHAT_ATTACHMENT:
+        participants = get_participants(payload.conversation_id, db) if payload.conversation_id else None
+        if participants is None or payload.user_id not in participants:
+            raise HTTPException(status_code=403, detail="Accès non autorisé")
+    else:
+        if not db.query(User.id).filter(User.id == payload.user_id).first():
+            raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+        document_type = payload.document_type if payload.document_type in DOCUMENT_TYPES else "autre"
+
+    # Débit d'uploads par utilisateur (429 + Retry-After)
+    check_upload_rate(payload.user_id)
+
+    session = create_session(
+        db, payload.user_id, payload.kind, payload.size, payload.filename,
+        mime_type=payload.mime_type,
+        conversation_id=payload.conversation_id if payload.kind == KIND_CHAT_ATTACHMENT else None,
+        document_type=document_type
+    )
+    upload_url = f"{router.prefix}/{session.id}"
+    state = {"offset": 0, "length": session.upload_length, "expires_at": session.expires_at}
+    return JSONResponse(
+        status_code=201,
+        content={
+            "upload_id": session.id,
+            "upload_url": upload_url,
+            "offset": 0,
+            "length": session.upload_length,
+            "expires_at": session.expires_at.isoformat()
+        },
+        headers={"Location": upload_url, **_offset_headers(state)}
+    )
+
+@router.head("/{upload_id}")
+async def get_upload_offset(upload_id: str):
+    """Offset à partir duquel reprendre l'envoi"""
+    state = await _load_state(upload_id)
+    return Response(status_code=200, headers=_offset_headers(state))
+
+@router.get("/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """État de l'upload, et ce qu'il a créé une fois terminé"""
+    state = await _load_state(upload_id)
+    return JSONResponse(
+        content={**state, "expires_at": state["expires_at"].isoformat()},
+        headers=_offset_headers(state)
+    )
+
+@router.patch("/{upload_id}")
+async def append_upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset")
+):
+    """
+    Ajouter les octets suivants à partir de Upload-Offset.
+    Réponse 204 (Upload-Offset = nouvel offset), ou 200 avec le résultat
+    quand le dernier octet est reçu. Une coupure en cours de corps conserve
+    les octets déjà reçus.
+    """
+    if request.headers.get("content-type") != OFFSET_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Content-Type attendu: {OFFSET_CONTENT_TYPE}")
+
+    state = await _load_state(upload_id)
+    if state["status"] == STATUS_COMPLETED:
+        # Dernier PATCH rejoué (réponse perdue) : même résultat, rien de recréé
+        return JSONResponse(content=state["result"], headers=_offset_headers(state))
+    if upload_offset != state["offset"]:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Upload-Offset ne correspond pas", "offset": state["offset"]},
+            headers=_offset_headers(state)
+        )
+
+    lock = _session_locks.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Un envoi est déjà en cours pour cet upload")
+
+    async with lock:
+        try:
+            written = upload_offset
+            too_long = False
+            part = open_partial(upload_id, upload_offset)
+            try:
+                async for chunk in request.stream():
+                    if written + len(chunk) > state["length"]:
+                        too_long = True
+                        break
+                    part.write(chunk)
+                    written += len(chunk)
+            except ClientDisconnect:
+                # Connexion coupée : on garde ce qui est arrivé, le client reprendra
+                pass
+            finally:
+                await asyncio.get_running_loop().run_in_executor(None, _close_partial, part)
+
+            if written != upload_offset:
+                await run_db(record_offset, upload_id, upload_offset, written)
+        except UploadConflict:
+            raise HTTPException(status_code=409, detail="Upload modifié par une autre requête")
+        finally:
+            _session_locks.pop(upload_id, None)
+
+    if too_long:
+        raise HTTPException(status_code=413, detail="Données au-delà de Upload-Length")
+
+    if written < state["length"]:
+        return Response(status_code=204, headers=_offset_headers(state, written))
+
+    try:
+        result, created = await run_db(finalize_session, upload_id)
+    except UploadConflict:
+        raise HTTPException(status_code=409, detail="Upload incomplet ou modifié par une autre requête")
+    if created:
+        await _announce_message(result)
+    return JSONResponse(content=result, headers=_offset_headers(state, written))
+
+@router.delete("/{upload_id}", status_code=204)
+async def cancel_upload_session(upload_id: str):
+    """Abandonner un upload en cours (fichier partiel supprimé)"""
+    if not await run_db(discard_session, upload_id):
+        raise HTTPException(status_code=404, detail="Upload inconnu, terminé ou expiré")
+    return Response(status_code=204)
@@ -0,0 +1,233 @@
+# backend/storage.py
+"""
+Stockage des fichiers uploadés, derrière une interface commune.
+
+Les clés sont des chemins relatifs déjà répartis par le hash du contenu
+(blob_store.storage_path_for) :
+
+    ab/cd/abcd1234...<64 hex>.pdf
+
+Sur disque, aucun dossier ne dépasse 256 entrées de sous-dossiers même
+avec des millions de fichiers ; sur S3, les préfixes répartissent la charge.
+
+Backends disponibles :
+- LocalStorage : dossier local (BLOB_STORE_DIR), servi par l'application
+                 (file_response : ETag, Range, sendfile / X-Accel-Redirect)
+- S3Storage    : bucket S3 ou compatible (MinIO, Ceph RGW...) ; les
+                 téléchargements sont redirigés vers une URL pré-signée, le
+                 stockage gère alors lui-même Range et ETag
+
+Le backend est choisi via la variable d'environnement FILE_STORAGE_URL
+(ex: s3://mon-bucket/prefixe). Sans variable, on reste sur disque.
+Pour MinIO : FILE_STORAGE_ENDPOINT_URL=http://localhost:9000 ; identifiants
+via les variables AWS habituelles (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY).
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.file_response import IMMUTABLE_CACHE_CONTROL, content_disposition
+
+FILE_STORAGE_ENDPOINT_URL = os.getenv("FILE_STORAGE_ENDPOINT_URL")
+FILE_STORAGE_REGION = os.getenv("FILE_STORAGE_REGION")
+# Durée de validité des URLs de téléchargement pré-signées (secondes)
+FILE_STORAGE_URL_EXPIRES = int(os.getenv("FILE_STORAGE_URL_EXPIRES", "300"))
+
+
+class StorageBackend:
+    """Interface commune à tous les backends de stockage"""
+
+    name = "base"
+
+    def put_file(self, source_path: str, key: str, content_type: Optional[str] = None,
+                 keep_source: bool = False) -> bool:
+        """
+        Déposer un fichier local sous key, s'il n'y est pas déjà. Retourne
+        True si le contenu a été écrit, False s'il était déjà stocké.
+        Sans keep_source, le fichier source est consommé (déplacé ou supprimé).
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """Supprimer le contenu (sans erreur s'il est déjà absent)"""
+        raise NotImplementedError
+
+    def location(self, key: str) -> str:
+        """Emplacement complet, enregistré en base (ChatAttachment.file_path)"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Chemin sur disque, ou None si le contenu n'est pas local"""
+        return None
+
+    def fetch(self, key: str) -> Tuple[str, bool]:
+        """
+        Chemin local lisible du contenu : (chemin, temporaire). Un fichier
+        temporaire est à supprimer par l'appelant.
+        """
+        raise NotImplementedError
+
+    def download_url(self, key: str, filename: Optional[str] = None,
+                     media_type: Optional[str] = None, inline: bool = False) -> Optional[str]:
+        """URL de téléchargement directe (hors application), ou None"""
+        return None
+
+
+# ============================================
+# BACKEND DISQUE LOCAL
+# ============================================
+
+class LocalStorage(StorageBackend):
+    """Dossier local : key = chemin relatif sous root"""
+
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def location(self, key: str) -> str:
+        return self.local_path(key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def put_file(self, source_path: str, key: str, content_type: Optional[str] = None,
+                 keep_source: bool = False) -> bool:
+        target = self.local_path(key)
+        if os.path.exists(target):
+            if not keep_source:
+                os.unlink(source_path)
+            return False
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not keep_source:
+            os.replace(source_path, target)
+            return True
+        try:
+            os.link(source_path, target)
+        except FileExistsError:
+            return False
+        except OSError:
+            # Autre système de fichiers : copie puis renommage atomique
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".blob-", suffix=".part")
+            os.close(fd)
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, target)
+        return True
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, key: str) -> Tuple[str, bool]:
+        return self.local_path(key), False
+
+
+# ============================================
+# BACKEND S3 (OU COMPATIBLE)
+# ============================================
+
+class S3Storage(StorageBackend):
+    """
+    Bucket S3 : key = prefix + clé. Envoi en plusieurs parties au-delà de
+    8 Mo (boto3). Le contenu étant adressé par son hash, un objet déjà
+    présent n'est jamais réécrit.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, url_expires: int = FILE_STORAGE_URL_EXPIRES):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("Le paquet 'boto3' est requis pour FILE_STORAGE_URL=s3://...") from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.url_expires = url_expires
+        # Serveur compatible (MinIO) : adressage par chemin, pas de sous-domaine par bucket
+        config = Config(
+            signature_version="s3v4",
+            s3={"addressing_style": "path"} if endpoint_url else {}
+        )
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region, config=config)
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + key.replace(os.sep, "/")
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._object_key(key)}"
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_file(self, source_path: str, key: str, content_type: Optional[str] = None,
+                 keep_source: bool = False) -> bool:
+        created = not self.exists(key)
+        if created:
+            extra = {"CacheControl": IMMUTABLE_CACHE_CONTROL}
+            if content_type:
+                extra["ContentType"] = content_type
+            self._client.upload_file(source_path, self.bucket, self._object_key(key), ExtraArgs=extra)
+        if not keep_source:
+            os.unlink(source_path)
+        return created
+
+    def delete(self, key: str):
+        # DeleteObject ne lève pas d'erreur pour un objet absent
+        self._client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def fetch(self, key: str) -> Tuple[str, bool]:
+        fd, temp_path = tempfile.mkstemp(prefix="storage-", suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self._client.download_file(self.bucket, self._object_key(key), temp_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path, True
+
+    def download_url(self, key: str, filename: Optional[str] = None,
+                     media_type: Optional[str] = None, inline: bool = False) -> str:
+        params = {"Bucket": self.bucket, "Key": self._object_key(key)}
+        if filename is not None:
+            params["ResponseContentDisposition"] = content_disposition(filename, inline)
+        if media_type:
+            params["ResponseContentType"] = media_type
+        return self._client.generate_presigned_url("get_object", Params=params, ExpiresIn=self.url_expires)
+
+
+def create_storage_from_env(local_root: str) -> StorageBackend:
+    """Choisir le backend selon FILE_STORAGE_URL (disque local sous local_root par défaut)"""
+    url = os.getenv("FILE_STORAGE_URL", "")
+    if url.startswith("s3://"):
+        parsed = urlparse(url)
+        return S3Storage(
+            parsed.netloc,
+            prefix=parsed.path,
+            endpoint_url=FILE_STORAGE_ENDPOINT_URL,
+            region=FILE_STORAGE_REGION
+        )
+    return LocalStorage(local_root)
@@ -0,0 +1,262 @@
+# backend/upgrade_chat_schema.py
+"""
+Script de mise à niveau du schéma pour une base existante.
+
+Base.metadata.create_all() crée les tables manquantes mais n'ajoute ni les
+colonnes ni les index apparus dans models.py depuis. Ce script :
+1. remplace les tables dont la structure a changé (message_read_status,
+   messages sous SQLite sans AUTOINCREMENT)
+2. ajoute les colonnes manquantes (ALTER TABLE ... ADD COLUMN)
+3. remplit les colonnes dénormalisées à partir des données existantes
+4. crée les index manquants
+
+Il est idempotent : on peut le relancer sans risque.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import MetaData, func, insert, inspect, literal, select, text, update
+from sqlalchemy.schema import CreateTable
+
+from database import engine, Base
+from models import ChatAttachment, ChatNotification, Conversation, Message, MessageArchive, MessageReadStatus
+import models  # noqa: F401  (enregistre tous les modèles)
+
+
+def _column_ddl(column) -> str:
+    """Définition SQL d'une colonne pour ALTER TABLE ADD COLUMN"""
+    ddl = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        # Texte : littéral SQL entre apostrophes (les nombres restent tels quels)
+        if isinstance(default, str) and not default.lstrip("-").isdigit():
+            default = "'" + default.replace("'", "''") + "'"
+        ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def replace_legacy_read_status():
+    """
+    message_read_status était une table par message (message_id), jamais
+    alimentée ; elle devient le filigrane de lecture par conversation.
+    Une ancienne table non vide est conservée sous message_read_status_legacy.
+    """
+    inspector = inspect(engine)
+    if "message_read_status" not in inspector.get_table_names():
+        return
+    columns = {col["name"] for col in inspector.get_columns("message_read_status")}
+    if "message_id" not in columns:
+        return
+    with engine.begin() as conn:
+        rows = conn.execute(text("SELECT COUNT(*) FROM message_read_status")).scalar()
+        if rows:
+            conn.execute(text("ALTER TABLE message_read_status RENAME TO message_read_status_legacy"))
+            print(f"  ✓ ancienne message_read_status renommée ({rows} lignes conservées)")
+        else:
+            conn.execute(text("DROP TABLE message_read_status"))
+            print("  ✓ ancienne message_read_status (vide) supprimée")
+
+
+def rebuild_sqlite_messages():
+    """
+    SQLite sans AUTOINCREMENT réattribue l'id des derniers messages une fois
+    archivés : l'archivage suivant échoue sur la clé primaire de
+    messages_archive et les lectures fusionnées voient deux messages sous le
+    même id. On reconstruit la table avec AUTOINCREMENT (les index sont recréés
+    par create_missing_indexes), on repart au-dessus du plus grand id des deux
+    tiers, et les messages déjà en collision avec l'archive reçoivent un nouvel id.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    inspector = inspect(engine)
+    if "messages" not in inspector.get_table_names():
+        return
+    with engine.begin() as conn:
+        ddl = conn.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+        )).scalar()
+        if "AUTOINCREMENT" in ddl.upper():
+            return
+
+        # Clés étrangères non activées sur ce moteur (pas de PRAGMA foreign_keys) :
+        # pièces jointes et notifications gardent leur référence à "messages"
+        metadata = MetaData()
+        for foreign_key in Message.__table__.foreign_keys:
+            foreign_key.column.table.to_metadata(metadata)
+        rebuilt = Message.__table__.to_metadata(metadata, name="messages_rebuild")
+        conn.execute(CreateTable(rebuilt))
+        existing = {col["name"] for col in inspector.get_columns("messages")}
+        columns = ", ".join(col.name for col in rebuilt.columns if col.name in existing)
+        conn.execute(text(f"INSERT INTO messages_rebuild ({columns}) SELECT {columns} FROM messages"))
+        conn.execute(text("DROP TABLE messages"))
+        conn.execute(text("ALTER TABLE messages_rebuild RENAME TO messages"))
+
+        tables = set(inspector.get_table_names())
+        last_id = conn.execute(select(func.max(Message.id))).scalar() or 0
+        colliding = []
+        if MessageArchive.__tablename__ in tables:
+            last_id = max(last_id, conn.execute(select(func.max(MessageArchive.id))).scalar() or 0)
+            colliding = conn.execute(
+                select(Message.id).where(Message.id.in_(select(MessageArchive.id))).order_by(Message.id)
+            ).scalars().all()
+        for old_id in colliding:
+            last_id += 1
+            for column in (Message.id, ChatAttachment.message_id, ChatNotification.message_id):
+                if column.table.name not in tables:
+                    continue
+                conn.execute(update(column.table).where(column == old_id).values({column.name: last_id}))
+        conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'messages'"))
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', :seq)"), {"seq": last_id})
+    print(f"  ✓ messages reconstruite avec AUTOINCREMENT ({len(colliding)} id en collision renumérotés)")
+
+
+def add_missing_columns():
+    """Ajouter les colonnes définies dans models.py mais absentes de la base"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column)}"))
+                    print(f"  ✓ {table.name}.{column.name}")
+
+
+def create_missing_indexes():
+    """Créer les index définis dans models.py mais absents de la base"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            # Index réservé à un autre SGBD (ex: GIN plein texte PostgreSQL)
+            ddl_if = index._ddl_if
+            if ddl_if is not None and ddl_if.dialect not in (None, engine.dialect.name):
+                continue
+            if index.name not in existing:
+                index.create(bind=engine)
+                print(f"  ✓ index {index.name}")
+
+
+# ============================================
+# REMPLISSAGE DES COLONNES DÉNORMALISÉES
+# ============================================
+
+def backfill_conversation_summaries():
+    """last_message_at, aperçu du dernier message et compteurs de non-lus (d'après les filigranes)"""
+    def unread_for(participant_column):
+        watermark = select(MessageReadStatus.last_read_seq).where(
+            MessageReadStatus.conversation_id == Conversation.id,
+            MessageReadStatus.user_id == participant_column
+        ).scalar_subquery()
+        return select(func.count(Message.id)).where(
+            Message.conversation_id == Conversation.id,
+            Message.sender_id != participant_column,
+            Message.seq > func.coalesce(watermark, 0)
+        ).scalar_subquery()
+
+    def last_field(column):
+        return select(column).where(
+            Message.conversation_id == Conversation.id
+        ).order_by(Message.created_at.desc(), Message.id.desc()).limit(1).scalar_subquery()
+
+    with engine.begin() as conn:
+        conn.execute(
+            update(Conversation.__table__).values(
+                last_message_at=func.coalesce(
+                    last_field(Message.created_at), Conversation.last_message_at, Conversation.created_at
+                ),
+                last_message_preview=func.substr(last_field(Message.content), 1, 200),
+                last_message_type=last_field(Message.message_type),
+                patient_unread_count=unread_for(Conversation.patient_id),
+                medecin_unread_count=unread_for(Conversation.medecin_id)
+            )
+        )
+    print("  ✓ résumés des conversations")
+
+
+def backfill_message_seq():
+    """Numéroter les messages antérieurs aux numéros de séquence"""
+    pending = select(Message.conversation_id).where(Message.seq.is_(None)).distinct()
+    numbered = select(
+        Message.id,
+        func.row_number().over(
+            partition_by=Message.conversation_id,
+            order_by=(Message.created_at, Message.id)
+        ).label("rn")
+    ).where(Message.conversation_id.in_(pending)).subquery()
+
+    with engine.begin() as conn:
+        conn.execute(
+            update(Message.__table__).where(Message.id == numbered.c.id).values(seq=numbered.c.rn)
+        )
+        conn.execute(
+            update(Conversation.__table__).values(
+                last_seq=func.coalesce(
+                    select(func.max(Message.seq)).where(
+                        Message.conversation_id == Conversation.id
+                    ).scalar_subquery(),
+                    0
+                )
+            )
+        )
+    print("  ✓ numéros de séquence des messages")
+
+
+def backfill_read_watermarks():
+    """Filigrane initial de chaque participant : dernier message reçu marqué is_read"""
+    with engine.begin() as conn:
+        for participant in (Conversation.patient_id, Conversation.medecin_id):
+            last_read = select(func.max(Message.seq)).where(
+                Message.conversation_id == Conversation.id,
+                Message.sender_id != participant,
+                Message.is_read == True  # noqa: E712
+            ).scalar_subquery()
+            existing = select(MessageReadStatus.id).where(
+                MessageReadStatus.conversation_id == Conversation.id,
+                MessageReadStatus.user_id == participant
+            ).exists()
+            conn.execute(insert(MessageReadStatus.__table__).from_select(
+                ["conversation_id", "user_id", "last_read_seq", "read_at"],
+                select(
+                    Conversation.id, participant, func.coalesce(last_read, 0),
+                    literal(datetime.utcnow())
+                ).where(~existing)
+            ))
+    print("  ✓ filigranes de lecture")
+
+
+# L'ordre compte : seq -> filigranes -> compteurs de non-lus
+BACKFILLS = [
+    backfill_message_seq,
+    backfill_read_watermarks,
+    backfill_conversation_summaries,
+]
+
+
+def upgrade():
+    print("♻️  Remplacement des tables restructurées...")
+    replace_legacy_read_status()
+    rebuild_sqlite_messages()
+    print("📦 Création des tables manquantes...")
+    Base.metadata.create_all(bind=engine)
+    print("🧱 Ajout des colonnes manquantes...")
+    add_missing_columns()
+    print("🔁 Remplissage des données dénormalisées...")
+    for backfill in BACKFILLS:
+        backfill()
+    # Après le remplissage : certains index sont uniques (ex: messages.seq)
+    print("🗂️  Création des index manquants...")
+    create_missing_indexes()
+    print("\n✅ Schéma à jour!")
+
+
+if __name__ == "__main__":
+    upgrade()
@@ -1,13 +1,17 @@
 import os
 import uuid
-import aiofiles
+import hashlib
+import tempfile
 from fastapi import UploadFile, HTTPException
-from typing import Tuple
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, Set, Tuple
 import mimetypes
 
 # Configuration
 UPLOAD_DIR = "uploads/chat"
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 512
 ALLOWED_IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
 ALLOWED_DOCUMENT_TYPES = {
     'application/pdf',
@@ -43,39 +47,160 @@ def validate_file(file: UploadFile, content: bytes) -> Tuple[bool, str]:
     
     return True, "OK"
 
-async def save_upload_file(file: UploadFile) -> dict:
-    """Sauvegarde le fichier et retourne les informations"""
-    
-    # Lire le contenu
-    content = await file.read()
-    
-    # Valider
-    is_valid, message = validate_file(file, content)
-    if not is_valid:
-        raise HTTPException(status_code=400, detail=message)
-    
-    # Générer un nom unique
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    # Sauvegarder
-    async with aiofiles.open(file_path, 'wb') as f:
-        await f.write(content)
+# ============================================
+# UPLOAD EN FLUX (MORCEAUX -> FICHIER TEMPORAIRE -> RENOMMAGE)
+# ============================================
+
+# Signatures (premiers octets) des formats acceptés
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+]
+_ZIP_SIGNATURE = b"PK\x03\x04"
+_OLE_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+# Conteneurs : le type déclaré ne sert qu'à distinguer Word / Excel
+_ZIP_TYPES = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+_OLE_TYPES = {'application/msword', 'application/vnd.ms-excel'}
+
+class UploadTooLarge(Exception):
+    """Le flux dépasse la taille maximale"""
+
+def sniff_mime_type(head: bytes, declared: Optional[str] = None) -> str:
+    """Type MIME réel d'après les premiers octets (le type déclaré par le client n'est pas fiable)"""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(_ZIP_SIGNATURE):
+        return declared if declared in _ZIP_TYPES else "application/zip"
+    if head.startswith(_OLE_SIGNATURE):
+        return declared if declared in _OLE_TYPES else "application/x-ole-storage"
+    if head and b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+            return "text/plain"
+        except UnicodeDecodeError as e:
+            # Caractère multi-octets coupé en fin d'échantillon
+            if e.start >= len(head) - 3:
+                return "text/plain"
+    return "application/octet-stream"
+
+def _copy_to_temp(source, directory: str, max_size: int) -> Tuple[str, int, str, bytes]:
+    """
+    Copier un flux par morceaux dans un fichier temporaire du dossier cible.
+    Retourne (chemin temporaire, taille, sha256, premiers octets).
+    """
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(size)
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return temp_path, size, digest.hexdigest(), head
+
+async def spool_upload(
+    file: UploadFile,
+    directory: str,
+    max_size: int = MAX_FILE_SIZE,
+    allowed_types: Optional[Set[str]] = None
+) -> dict:
+    """
+    Copier un upload par morceaux de UPLOAD_CHUNK_SIZE dans un fichier
+    temporaire de directory (taille vérifiée au fil de l'eau, SHA-256 et type
+    MIME calculés au passage), sans le renommer : temp_path est à déplacer
+    ou supprimer par l'appelant.
+    Lève 413 si trop volumineux, 400 si le type réel n'est pas autorisé.
+    """
+    os.makedirs(directory, exist_ok=True)
+    try:
+        temp_path, size, sha256, head = await run_in_threadpool(
+            _copy_to_temp, file.file, directory, max_size
+        )
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Fichier trop volumineux (max {max_size // (1024 * 1024)}MB)"
+        )
     
-    # Déterminer la catégorie
-    category = get_file_category(file.content_type)
+    mime_type = sniff_mime_type(head, file.content_type)
+    if allowed_types is not None and mime_type not in allowed_types:
+        os.unlink(temp_path)
+        raise HTTPException(status_code=400, detail=f"Type de fichier non autorisé: {mime_type}")
     
     return {
-        "filename": unique_filename,
+        "temp_path": temp_path,
         "original_name": file.filename,
-        "file_path": file_path,
-        "url": f"/uploads/chat/{unique_filename}",
-        "size": len(content),
-        "mime_type": file.content_type,
-        "category": category
+        "size": size,
+        "mime_type": mime_type,
+        "declared_mime_type": file.content_type,
+        "sha256": sha256
     }
 
+async def stream_upload(
+    file: UploadFile,
+    directory: str,
+    max_size: int = MAX_FILE_SIZE,
+    allowed_types: Optional[Set[str]] = None,
+    filename: Optional[str] = None
+) -> dict:
+    """
+    Enregistrer un upload sans le charger en mémoire (spool_upload), puis
+    renommage atomique en directory/filename.
+    """
+    spooled = await spool_upload(file, directory, max_size, allowed_types)
+    temp_path = spooled.pop("temp_path")
+    
+    if filename is None:
+        filename = f"{uuid.uuid4()}{os.path.splitext(file.filename or '')[1]}"
+    file_path = os.path.join(directory, filename)
+    # Même dossier, donc même système de fichiers : rename atomique
+    os.replace(temp_path, file_path)
+    
+    return {"filename": filename, "file_path": file_path, **spooled}
+
+async def save_upload_file(file: UploadFile) -> dict:
+    """
+    Sauvegarde le fichier (en flux) dans le stockage dédupliqué, disque ou
+    S3 selon FILE_STORAGE_URL, et retourne les informations.
+    L'appelant référence le contenu avec blob_store.acquire_blob(db, sha256).
+    """
+    # Import local : blob_store s'appuie lui-même sur ce module (spool_upload)
+    from blob_store import store_upload
+    
+    file_info = await store_upload(
+        file, MAX_FILE_SIZE, allowed_types=ALLOWED_IMAGE_TYPES | ALLOWED_DOCUMENT_TYPES
+    )
+    file_info["filename"] = os.path.basename(file_info["storage_path"])
+    # Catégorie d'après le type réel, pas celui annoncé par le client
+    file_info["category"] = get_file_category(file_info["mime_type"])
+    return file_info
+
 def generate_thumbnail(image_path: str, thumbnail_path: str, size=(200, 200)):
     """Génère une miniature pour les images"""
     try:
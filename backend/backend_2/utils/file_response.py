@@ -0,0 +1,236 @@
+# utils/file_response.py
+"""
+Réponses fichier avec GET conditionnel, requêtes partielles et envoi sans copie.
+
+- ETag fort = SHA-256 du contenu (stockage dédupliqué), sinon ETag faible
+  dérivé de la date de modification et de la taille (anciens fichiers)
+- If-None-Match (prioritaire) / If-Modified-Since : 304 sans corps
+- Range: bytes=a-b, a-, -n : 206 + Content-Range ; If-Range respecté ;
+  hors limites : 416. Plusieurs plages : fichier entier (200), comme le
+  permet la RFC 9110
+- contenu immuable (URL adressée par hash) : Cache-Control long + immutable
+- envoi : extension ASGI http.response.zerocopysend (sendfile) si le serveur
+  la propose, sinon lecture par blocs de FILE_CHUNK_SIZE dans un thread.
+  Derrière nginx, FILE_ACCEL_REDIRECT_PREFIX délègue l'envoi des fichiers
+  situés sous FILE_ACCEL_ROOT (sendfile et plages) : la réponse ne porte
+  que l'en-tête X-Accel-Redirect.
+"""
+
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+
+FILE_CHUNK_SIZE = 256 * 1024
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+# ex: "/protected/" -> location interne nginx qui pointe sur FILE_ACCEL_ROOT
+FILE_ACCEL_REDIRECT_PREFIX = os.getenv("FILE_ACCEL_REDIRECT_PREFIX")
+# Dossier servi par cette location ; fichiers hors de ce dossier : envoi par l'application
+FILE_ACCEL_ROOT = os.getenv("FILE_ACCEL_ROOT", "uploads")
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Comparaison faible (If-None-Match) : W/ ignoré"""
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (début, fin incluse) d'une plage unique. None : en-tête ignoré (fichier
+    entier). ValueError : plage hors du fichier (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first == "":
+            # Suffixe : les n derniers octets
+            length = int(last)
+            if length <= 0:
+                raise ValueError(header)
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def _accel_path(path: str) -> Optional[str]:
+    """Chemin relatif à FILE_ACCEL_ROOT pour X-Accel-Redirect, ou None si le fichier est hors de ce dossier"""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(FILE_ACCEL_ROOT))
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return None
+    return relative.replace(os.sep, "/")
+
+
+def content_disposition(filename: str, inline: bool) -> str:
+    kind = "inline" if inline else "attachment"
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{kind}; filename*=utf-8''{quoted}"
+    return f'{kind}; filename="{filename}"'
+
+
+class FileRangeResponse(Response):
+    """Corps = octets start..end (inclus) du fichier, envoyés sans le charger en mémoire"""
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict,
+                 media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        self.send_body = send_body
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers
+        })
+        if not self.send_body or self.count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                # Le serveur fait le sendfile(2) : aucun octet ne passe par Python
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False
+                })
+                return
+            await anyio.to_thread.run_sync(file.seek, self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(file.read, min(FILE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # Fichier raccourci pendant l'envoi
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+
+
+def file_response(
+    request: Request,
+    path: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    sha256: Optional[str] = None,
+    immutable: bool = False,
+    inline: bool = False
+) -> Response:
+    """
+    Réponse pour un fichier existant : 304, 206, 416 ou 200 selon les
+    en-têtes de la requête. sha256 : ETag fort ; immutable : contenu qui ne
+    changera jamais pour cette URL.
+    """
+    stat = os.stat(path)
+    etag = f'"{sha256}"' if sha256 else f'W/"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        "accept-ranges": "bytes"
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_type or "application/octet-stream"
+    if filename is not None:
+        headers["content-disposition"] = content_disposition(filename, inline)
+
+    relative = _accel_path(path) if FILE_ACCEL_REDIRECT_PREFIX else None
+    if relative is not None:
+        # nginx envoie le fichier (sendfile, Range) ; en-têtes ci-dessus conservés
+        headers["x-accel-redirect"] = FILE_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative)
+        return Response(status_code=200, headers=headers, media_type=media_type)
+
+    size = stat.st_size
+    send_body = request.method != "HEAD"
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and size > 0:
+        if_range = request.headers.get("if-range")
+        # If-Range : plage seulement si la copie du client est la bonne (comparaison forte)
+        if if_range is None or if_range == headers["last-modified"] or (
+            not etag.startswith("W/") and if_range == etag
+        ):
+            try:
+                byte_range = _parse_range(range_header, size)
+            except ValueError:
+                return Response(
+                    status_code=416,
+                    headers={**headers, "content-range": f"bytes */{size}"}
+                )
+
+    if byte_range is None:
+        return FileRangeResponse(path, 0, size - 1, 200, headers, media_type, send_body)
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return FileRangeResponse(path, start, end, 206, headers, media_type, send_body)
+
+
+class PublicStaticFiles(StaticFiles):
+    """
+    Montage StaticFiles qui ne sert jamais les dossiers privés placés sous
+    son répertoire (contenus en quarantaine, uploads partiels) : 404.
+    """
+
+    def __init__(self, directory: str, private_dirs: Iterable[str] = ()):
+        super().__init__(directory=directory)
+        self.private_dirs = [os.path.realpath(path) for path in private_dirs]
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        full_path, stat_result = super().lookup_path(path)
+        if full_path and any(
+            os.path.commonpath([full_path, private]) == private for private in self.private_dirs
+        ):
+            return "", None
+        return full_path, stat_result
@@ -1,23 +1,178 @@
 # utils/file_validator.py
-from PIL import Image
-import magic
+"""
+Étapes de validation d'un fichier uploadé, exécutées hors requête par
+file_validation.FileValidationWorker :
+
+1. type réel (libmagic si python-magic est installé, sinon signatures de
+   file_handler.sniff_mime_type) comparé au type enregistré
+2. images : décodage de contrôle (Pillow)
+3. antivirus : scanner choisi via FILE_SCANNER_URL
+   - tcp://clamav:3310 ou unix:///var/run/clamav/clamd.ctl : clamd (INSTREAM)
+   - sans variable : étape sautée (NullScanner)
+
+Fonctions bloquantes, sans accès à la base : appelées dans un pool de threads.
+"""
+
 import os
+import socket
+import struct
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.file_handler import SNIFF_BYTES, sniff_mime_type
+from utils.image_processing import MAX_IMAGE_PIXELS
+
+FILE_SCAN_TIMEOUT = float(os.getenv("FILE_SCAN_TIMEOUT", "30"))
+SCAN_CHUNK_SIZE = 64 * 1024
+
+# Jamais acceptés, quel que soit le type annoncé (exécutables, scripts, contenu actif)
+BLOCKED_MIME_TYPES = {
+    "application/x-dosexec",
+    "application/x-msdownload",
+    "application/x-msi",
+    "application/x-executable",
+    "application/x-sharedlib",
+    "application/x-pie-executable",
+    "application/x-mach-binary",
+    "application/java-archive",
+    "application/x-sh",
+    "text/x-shellscript",
+    "text/html",
+    "image/svg+xml",
+}
+
+
+class ScannerError(Exception):
+    """Antivirus injoignable ou réponse inattendue : le fichier reste en quarantaine"""
+
 
 def validate_image_content(file_path: str) -> bool:
-    """Valide que le fichier est vraiment une image"""
+    """
+    Valide que le fichier est vraiment une image (structure et taille en pixels).
+    ImportError si Pillow n'est pas installé.
+    """
+    from PIL import Image
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
     try:
         with Image.open(file_path) as img:
             img.verify()
         return True
-    except:
+    except Exception:
         return False
 
+
 def get_real_mime_type(file_path: str) -> str:
     """Obtenir le vrai type MIME du fichier"""
-    mime = magic.Magic(mime=True)
-    return mime.from_file(file_path)
+    try:
+        import magic
+    except ImportError:
+        # Sans libmagic : signatures des formats acceptés
+        with open(file_path, "rb") as source:
+            return sniff_mime_type(source.read(SNIFF_BYTES))
+    return magic.from_file(file_path, mime=True)
+
+
+def check_mime_type(file_path: str, expected: Optional[str]) -> Tuple[str, Optional[str]]:
+    """(type réel, motif de refus ou None)"""
+    real = get_real_mime_type(file_path)
+    if real in BLOCKED_MIME_TYPES:
+        return real, f"type interdit: {real}"
+    expected = expected or ""
+    if expected.startswith("image/") and not real.startswith("image/"):
+        return real, f"type annoncé {expected}, contenu {real}"
+    if expected == "application/pdf" and real != "application/pdf":
+        return real, f"type annoncé {expected}, contenu {real}"
+    return real, None
+
+
+# ============================================
+# ANTIVIRUS
+# ============================================
+
+class MalwareScanner:
+    """Interface commune des antivirus"""
+
+    name = "base"
+
+    def scan(self, file_path: str) -> Optional[str]:
+        """Nom de la signature détectée, ou None si le fichier est sain. ScannerError sinon."""
+        raise NotImplementedError
+
+
+class NullScanner(MalwareScanner):
+    """Aucun antivirus configuré : étape sautée"""
+
+    name = "none"
+
+    def scan(self, file_path: str) -> Optional[str]:
+        return None
+
+
+class ClamdScanner(MalwareScanner):
+    """
+    Démon clamd (ou serveur compatible) : commande INSTREAM, le fichier est
+    envoyé par morceaux préfixés de leur taille (4 octets, big-endian),
+    terminés par un morceau vide. Réponse : "stream: OK" ou
+    "stream: <signature> FOUND".
+    """
+
+    name = "clamd"
+
+    def __init__(self, url: str, timeout: float = FILE_SCAN_TIMEOUT):
+        parsed = urlparse(url)
+        self.url = url
+        self.timeout = timeout
+        if parsed.scheme == "unix":
+            self.family, self.address = socket.AF_UNIX, parsed.path
+        else:
+            self.family, self.address = socket.AF_INET, (parsed.hostname or "localhost", parsed.port or 3310)
+
+    def _connect(self) -> socket.socket:
+        if self.family == socket.AF_UNIX:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            return sock
+        return socket.create_connection(self.address, timeout=self.timeout)
+
+    def scan(self, file_path: str) -> Optional[str]:
+        try:
+            with self._connect() as sock, open(file_path, "rb") as source:
+                sock.sendall(b"zINSTREAM\0")
+                while True:
+                    chunk = source.read(SCAN_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sock.sendall(struct.pack("!L", len(chunk)) + chunk)
+                sock.sendall(struct.pack("!L", 0))
+                reply = b""
+                while not reply.endswith(b"\0"):
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    reply += data
+        except OSError as e:
+            raise ScannerError(f"clamd injoignable ({self.url}): {e}") from e
+
+        answer = reply.rstrip(b"\0").decode("utf-8", "replace").strip()
+        # "stream: OK" / "stream: Eicar-Test-Signature FOUND" / "... ERROR"
+        _, _, verdict = answer.partition(": ")
+        if verdict == "OK":
+            return None
+        if verdict.endswith(" FOUND"):
+            return verdict[:-len(" FOUND")]
+        raise ScannerError(f"réponse clamd inattendue: {answer!r}")
+
+
+def create_scanner_from_env() -> MalwareScanner:
+    """Choisir l'antivirus selon FILE_SCANNER_URL"""
+    url = os.getenv("FILE_SCANNER_URL", "")
+    if url.startswith(("tcp://", "unix://")):
+        return ClamdScanner(url)
+    return NullScanner()
+
 
 def scan_for_malware(file_path: str) -> bool:
-    """Scanner le fichier pour les malwares (intégrer avec ClamAV)"""
-    # TODO: Implémenter selon vos besoins
-    return True
\ No newline at end of file
+    """Scanner le fichier pour les malwares (antivirus de FILE_SCANNER_URL)"""
+    return create_scanner_from_env().scan(file_path) is None
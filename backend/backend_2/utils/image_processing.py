@@ -0,0 +1,99 @@
+# utils/image_processing.py
+"""
+Variantes WebP des images du chat (miniature de liste, bulle, plein écran).
+
+Fonctions exécutées dans les processus de image_variants.ImageVariantWorker :
+ce module n'importe que Pillow (pas la base, pas FastAPI), pour que le
+démarrage d'un processus du pool reste léger.
+
+Les variantes sont rangées d'après une clé (SHA-256 du contenu) :
+
+    uploads/variants/ab/<sha256>_thumb.webp
+    uploads/variants/ab/<sha256>_bubble.webp
+    uploads/variants/ab/<sha256>_full.webp
+
+Le même contenu envoyé plusieurs fois n'est donc décodé qu'une fois.
+"""
+
+import os
+import tempfile
+from typing import Dict, List
+
+VARIANT_DIR = os.getenv("IMAGE_VARIANT_DIR", "uploads/variants")
+
+# nom -> (plus grand côté en pixels, qualité WebP)
+VARIANTS = {
+    "thumb": (200, 70),
+    "bubble": (640, 80),
+    "full": (1600, 85),
+}
+# Nom de la variante enregistrée dans ChatAttachment.thumbnail_path
+THUMBNAIL_VARIANT = "thumb"
+
+# Au-delà, l'image est refusée (bombe de décompression)
+MAX_IMAGE_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(60_000_000)))
+
+
+def variant_path(key: str, name: str) -> str:
+    return os.path.join(VARIANT_DIR, key[:2], f"{key}_{name}.webp")
+
+
+def variant_paths(key: str) -> Dict[str, str]:
+    return {name: variant_path(key, name) for name in VARIANTS}
+
+
+def variant_files(key: str) -> List[str]:
+    """Variantes déjà présentes sur disque pour une clé"""
+    return [path for path in variant_paths(key).values() if os.path.exists(path)]
+
+
+def remove_variants(key: str):
+    for path in variant_files(key):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def save_webp(image, path: str, quality: int):
+    """Écriture dans un fichier temporaire du même dossier, puis renommage atomique"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".variant-", suffix=".webp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            image.save(out, format="WEBP", quality=quality, method=4)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def render_variants(source_path: str, key: str) -> Dict[str, str]:
+    """
+    Produire les variantes manquantes d'une image. Retourne {nom: chemin}.
+    Lève une exception si le fichier n'est pas une image lisible.
+    """
+    paths = variant_paths(key)
+    missing = {name: path for name, path in paths.items() if not os.path.exists(path)}
+    if not missing:
+        return paths
+
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    largest = max(VARIANTS[name][0] for name in missing)
+    with Image.open(source_path) as img:
+        # JPEG : décodage directement à une échelle réduite (1/2, 1/4, 1/8)
+        img.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(img)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    os.makedirs(os.path.dirname(next(iter(paths.values()))), exist_ok=True)
+    # Du plus grand au plus petit : chaque réduction part de la précédente
+    for name in sorted(missing, key=lambda n: VARIANTS[n][0], reverse=True):
+        size, quality = VARIANTS[name]
+        image.thumbnail((size, size), Image.LANCZOS)
+        save_webp(image, missing[name], quality)
+    return paths
@@ -0,0 +1,83 @@
+# utils/pdf_preview.py
+"""
+Aperçu de la première page et texte d'un PDF (documents médicaux).
+
+Fonctions exécutées dans les processus de document_previews.DocumentPreviewWorker
+(pdfium n'est pas utilisable depuis plusieurs threads) : ce module n'importe
+que pypdfium2 et Pillow, pas la base ni FastAPI.
+
+L'aperçu est écrit dans un fichier temporaire, puis déposé par le worker
+dans le backend de storage.py sous une clé dérivée du SHA-256 du contenu :
+
+    previews/ab/<sha256>_page1.webp
+
+Il n'est jamais servi tel quel : GET /users/document/preview/... vérifie
+que le document appartient à l'utilisateur.
+"""
+
+import os
+import re
+from typing import Dict
+
+from utils.image_processing import save_webp
+
+# Largeur de l'aperçu en pixels (liste des documents sur le téléphone)
+PREVIEW_WIDTH = int(os.getenv("PDF_PREVIEW_WIDTH", "600"))
+PREVIEW_QUALITY = 80
+# Texte extrait des premières pages seulement (ordonnances, comptes rendus : 1 à 3 pages)
+PDF_TEXT_MAX_PAGES = int(os.getenv("PDF_TEXT_MAX_PAGES", "20"))
+PDF_TEXT_MAX_CHARS = 100_000
+SNIPPET_CHARS = 280
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def preview_key(sha256: str) -> str:
+    """Clé de l'aperçu dans le backend de stockage"""
+    return f"previews/{sha256[:2]}/{sha256}_page1.webp"
+
+
+def make_snippet(text: str, length: int = SNIPPET_CHARS) -> str:
+    """Début du texte sur une ligne, coupé à la fin d'un mot"""
+    flat = _WHITESPACE.sub(" ", text).strip()
+    if len(flat) <= length:
+        return flat
+    cut = flat[:length].rsplit(" ", 1)[0]
+    return cut + "…"
+
+
+def render_pdf_preview(source_path: str, output_path: str) -> Dict:
+    """
+    Aperçu WebP de la première page (écrit dans output_path) et texte des
+    PDF_TEXT_MAX_PAGES premières pages. Retourne {page_count, text}.
+    Lève une exception si le PDF est illisible ou protégé par mot de passe.
+    """
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(source_path)
+    try:
+        page_count = len(pdf)
+        if page_count == 0:
+            raise ValueError("PDF sans page")
+
+        first_page = pdf[0]
+        # Petites pages (tickets, étiquettes) : agrandissement limité
+        scale = min(PREVIEW_WIDTH / first_page.get_width(), 4.0)
+        image = first_page.render(scale=scale).to_pil().convert("RGB")
+        save_webp(image, output_path, PREVIEW_QUALITY)
+
+        texts = []
+        length = 0
+        for index in range(min(page_count, PDF_TEXT_MAX_PAGES)):
+            text = pdf[index].get_textpage().get_text_range()
+            texts.append(text)
+            length += len(text)
+            if length >= PDF_TEXT_MAX_CHARS:
+                break
+    finally:
+        pdf.close()
+
+    # NUL refusé par PostgreSQL dans une colonne texte
+    text = "\n".join(texts).replace("\r\n", "\n").replace("\r", "\n").replace("\x00", "")
+    text = text[:PDF_TEXT_MAX_CHARS]
+    return {"page_count": page_count, "text": text}
@@ -0,0 +1,99 @@
+# utils/upload_limit.py
+"""
+Middleware ASGI : taille maximale du corps des requêtes d'upload.
+
+FastAPI lit tout le formulaire multipart avant d'appeler l'endpoint : sans
+ce garde-fou, un fichier trop gros est entièrement reçu (et écrit dans un
+fichier temporaire) avant d'être refusé. Ici :
+
+- Content-Length annoncé au-delà de la limite : 413 immédiat, corps non lu
+- corps envoyé sans Content-Length (chunked) : octets comptés au fil de la
+  réception, lecture interrompue et 413 dès que la limite est franchie
+"""
+
+import json
+from typing import Dict, Optional
+
+# En-têtes multipart et champs du formulaire, en plus du fichier
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        # préfixe de chemin -> taille maximale du fichier
+        self.limits = limits
+
+    def _limit_for(self, path: str) -> Optional[int]:
+        for prefix, limit in self.limits.items():
+            if path.startswith(prefix):
+                return limit + MULTIPART_OVERHEAD
+        return None
+
+    async def _reject(self, send, limit: int):
+        body = json.dumps({
+            "detail": f"Fichier trop volumineux (max {(limit - MULTIPART_OVERHEAD) // (1024 * 1024)}MB)"
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    announced = int(value)
+                except ValueError:
+                    break
+                if announced > limit:
+                    return await self._reject(send, limit)
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                # La réponse d'erreur produite en aval (parsing interrompu) est remplacée
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send, limit)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except BodyTooLarge:
+            if not response_started:
+                await self._reject(send, limit)
@@ -1,40 +1,503 @@
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Callable, Awaitable, Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
+from collections import deque
+from datetime import datetime
 import json
 import asyncio
+import os
+import time
+
+from pubsub import PubSubBackend, create_backend_from_env
+from ws_codec import JSON_CODEC, FrameCodec, OutboundFrame, negotiate, receive_frame, send_frame
+
+# ============================================
+# FILES D'ENVOI PAR SOCKET
+# ============================================
+
+# Politiques en cas de file pleine
+OVERFLOW_DROP_OLDEST = "drop_oldest"   # jeter la frame la plus ancienne
+OVERFLOW_COALESCE = "coalesce"         # fusionner les frames d'état, sinon jeter la plus ancienne
+OVERFLOW_DISCONNECT = "disconnect"     # fermer la socket (le client se reconnectera)
+OVERFLOW_POLICIES = {OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT}
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+SEND_OVERFLOW_POLICY = os.getenv("WS_SEND_OVERFLOW_POLICY", OVERFLOW_COALESCE)
+# Un envoi bloqué plus longtemps que ça = client trop lent, on l'évince
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+
+# Frames "d'état" : seule la dernière valeur compte (type -> champs de la clé)
+COALESCIBLE_FRAMES: Dict[str, Tuple[str, ...]] = {
+    # Un seul ping en attente par socket, une seule réponse aux pings du client
+    "ping": (),
+    "pong": (),
+}
+
+# ============================================
+# HEARTBEAT ET NETTOYAGE DES SOCKETS INACTIVES
+# ============================================
+
+# Le serveur envoie {"type": "ping", "ts": ...} toutes les WS_HEARTBEAT_INTERVAL
+# secondes ; le client répond {"type": "pong", "ts": <même valeur>}.
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+# Un client qui a déjà répondu à un ping est évincé après ce nombre
+# d'intervalles sans aucune frame reçue (connexion à moitié ouverte)
+HEARTBEAT_MISSED = int(os.getenv("WS_HEARTBEAT_MISSED", "3"))
+# Toute socket sans aucune frame reçue depuis ce délai est évincée, y compris
+# les clients qui ne répondent pas aux pings (0 = désactivé)
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "3600"))
+
+REAPED_HEARTBEAT = "heartbeat"
+REAPED_IDLE = "idle"
+
+
+def coalesce_key(message: dict) -> Optional[tuple]:
+    """Clé de fusion d'une frame, ou None si la frame ne doit jamais être fusionnée"""
+    fields = COALESCIBLE_FRAMES.get(message.get("type"))
+    if fields is None:
+        return None
+    return (message["type"],) + tuple(message.get(field) for field in fields)
+
+
+class ClientConnection:
+    """
+    Une socket avec sa file d'envoi bornée.
+
+    La tâche d'écriture n'existe que tant que la file contient des frames :
+    une socket inactive ne coûte qu'un enregistrement compact (__slots__).
+    """
+
+    __slots__ = (
+        "websocket", "user_id", "max_queue", "policy", "codec", "closed",
+        "connected_at", "last_activity", "heartbeat_acked", "rtt_ms",
+        "_on_dead", "_spawn", "_queue", "_writer", "_paused", "_send_lock",
+        "ingress", "reject_streak",
+        "sent_count", "bytes_sent", "dropped_count", "coalesced_count", "max_queue_depth", "rejected_count",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        on_dead: Callable[["ClientConnection"], Awaitable[None]],
+        spawn: Callable[[Awaitable[None]], asyncio.Task] = asyncio.create_task,
+        max_queue: int = SEND_QUEUE_SIZE,
+        policy: str = SEND_OVERFLOW_POLICY,
+        codec: FrameCodec = JSON_CODEC
+    ):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politique de débordement inconnue: {policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.policy = policy
+        # Encodage négocié à l'ouverture (JSON par défaut)
+        self.codec = codec
+        self.closed = False
+        # Horodatages epoch : ouverture et dernière frame reçue du client
+        self.connected_at = time.time()
+        self.last_activity = self.connected_at
+        # True dès le premier pong : le client participe au heartbeat
+        self.heartbeat_acked = False
+        self.rtt_ms: Optional[float] = None
+        self._on_dead = on_dead
+        # Lancement des tâches de fond (ConnectionManager.spawn : référence gardée)
+        self._spawn = spawn
+        # (clé de fusion, frame)
+        self._queue: Deque[Tuple[Optional[tuple], OutboundFrame]] = deque()
+        # Tâche d'écriture en cours (None quand la file est vide)
+        self._writer: Optional[asyncio.Task] = None
+        # Pause des frames "live" pendant un rattrapage (resume)
+        self._paused = False
+        # Un seul envoi à la fois sur la socket (writer ou envoi direct)
+        self._send_lock = asyncio.Lock()
+        # Seau à jetons des frames reçues (créé par rate_limit à la première frame)
+        self.ingress = None
+        self.reject_streak = 0
+
+        # Métriques
+        self.sent_count = 0
+        self.bytes_sent = 0
+        self.dropped_count = 0
+        self.coalesced_count = 0
+        self.max_queue_depth = 0
+        self.rejected_count = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, message: Union[dict, OutboundFrame]) -> bool:
+        """
+        Mettre une frame en file sans jamais bloquer l'appelant.
+        Retourne False si la socket est fermée ou vient d'être évincée.
+        """
+        if self.closed:
+            return False
+
+        frame = message if isinstance(message, OutboundFrame) else OutboundFrame(message)
+        key = coalesce_key(frame.message) if self.policy == OVERFLOW_COALESCE else None
+        if key is not None:
+            for index, (queued_key, _) in enumerate(self._queue):
+                if queued_key == key:
+                    self._queue[index] = (key, frame)
+                    self.coalesced_count += 1
+                    return True
+
+        if len(self._queue) >= self.max_queue:
+            if self.policy == OVERFLOW_DISCONNECT:
+                print(f"🐢 Slow consumer evicted (user {self.user_id}, {len(self._queue)} frames en attente)")
+                self.closed = True
+                self._spawn(self._on_dead(self))
+                return False
+            self._drop_one()
+
+        self._queue.append((key, frame))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._schedule_write()
+        return True
+
+    def _drop_one(self):
+        """Libérer une place : une frame d'état en priorité (coalesce), sinon la plus ancienne"""
+        if self.policy == OVERFLOW_COALESCE:
+            for index, (queued_key, _) in enumerate(self._queue):
+                if queued_key is not None:
+                    del self._queue[index]
+                    self.dropped_count += 1
+                    return
+        self._queue.popleft()
+        self.dropped_count += 1
+
+    def pause(self):
+        """Retenir les frames en file (elles restent soumises à la politique de débordement)"""
+        self._paused = True
+
+    def resume(self):
+        """Reprendre l'envoi des frames en file"""
+        self._paused = False
+        self._schedule_write()
+
+    async def send_direct(self, message: Union[dict, OutboundFrame]):
+        """Envoyer immédiatement, en contournant la file (utilisé pendant une pause)"""
+        frame = message if isinstance(message, OutboundFrame) else OutboundFrame(message)
+        async with self._send_lock:
+            self.bytes_sent += await asyncio.wait_for(
+                send_frame(self.websocket, self.codec, frame), timeout=SEND_TIMEOUT
+            )
+        self.sent_count += 1
+
+    async def receive(self) -> dict:
+        """
+        Recevoir une frame du client, décodée selon l'encodage négocié.
+        Les réponses aux pings du serveur (pong) sont traitées ici et jamais
+        retournées ; les pings du client sont retournés à l'endpoint, qui y
+        répond (answer_ping) après la limite de débit.
+        """
+        while True:
+            message = await receive_frame(self.websocket, self.codec)
+            self.last_activity = time.time()
+            frame_type = message.get("type")
+            if frame_type == "pong":
+                self.heartbeat_acked = True
+                if isinstance(message.get("ts"), (int, float)):
+                    self.rtt_ms = max(0.0, self.last_activity * 1000 - message["ts"])
+                continue
+            return message
+
+    def answer_ping(self, message: dict):
+        """Heartbeat initié par le client"""
+        self.enqueue({"type": "pong", "ts": message.get("ts")})
+
+    def is_dead(self, now: float) -> Optional[str]:
+        """Raison de l'éviction si la socket ne donne plus signe de vie, sinon None"""
+        silent = now - self.last_activity
+        if self.heartbeat_acked and silent > HEARTBEAT_INTERVAL * HEARTBEAT_MISSED:
+            return REAPED_HEARTBEAT
+        if IDLE_TIMEOUT and silent > IDLE_TIMEOUT:
+            return REAPED_IDLE
+        return None
+
+    def _schedule_write(self):
+        """Lancer la tâche d'écriture si des frames attendent et qu'aucune ne tourne"""
+        if self._writer is None and self._queue and not self._paused and not self.closed:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        """Vider la file vers la socket, une frame à la fois, puis s'arrêter"""
+        try:
+            while self._queue and not self._paused and not self.closed:
+                _, frame = self._queue.popleft()
+                async with self._send_lock:
+                    self.bytes_sent += await asyncio.wait_for(
+                        send_frame(self.websocket, self.codec, frame), timeout=SEND_TIMEOUT
+                    )
+                self.sent_count += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error sending to user {self.user_id}: {e!r}")
+            self._writer = None
+            self.closed = True
+            await self._on_dead(self)
+            return
+        # File vide (ou pause) : plus de tâche jusqu'à la prochaine frame
+        self._writer = None
+
+    async def close(self):
+        """Arrêter la tâche d'écriture (la socket est fermée par le manager)"""
+        self.closed = True
+        self._queue.clear()
+        writer, self._writer = self._writer, None
+        if writer and writer is not asyncio.current_task():
+            writer.cancel()
+            try:
+                await writer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "connected_at": datetime.utcfromtimestamp(self.connected_at).isoformat(),
+            "last_activity": datetime.utcfromtimestamp(self.last_activity).isoformat(),
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "queue_capacity": self.max_queue,
+            "policy": self.policy,
+            "codec": self.codec.name,
+            "sent": self.sent_count,
+            "bytes_sent": self.bytes_sent,
+            "heartbeat": self.heartbeat_acked,
+            "rtt_ms": self.rtt_ms,
+            "dropped": self.dropped_count,
+            "coalesced": self.coalesced_count,
+            "rejected": self.rejected_count
+        }
+
+
+# ============================================
+# REGISTRE DES CONNEXIONS
+# ============================================
+
+REGISTRY_SHARDS = int(os.getenv("WS_REGISTRY_SHARDS", "64"))
+
+
+class RegistryShard:
+    """Utilisateurs d'un shard : user_id -> {id(websocket): connexion}"""
+
+    __slots__ = ("lock", "users")
 
-class ConnectionManager:
     def __init__(self):
-        # user_id -> List[WebSocket]
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-        # Lock pour éviter les race conditions
-        self._lock = asyncio.Lock()
-
-    async def connect(self, websocket: WebSocket, user_id: int):
-        """Accepter une connexion WebSocket"""
-        await websocket.accept()
-        
-        async with self._lock:
-            if user_id not in self.active_connections:
-                self.active_connections[user_id] = []
-            self.active_connections[user_id].append(websocket)
-        
-        print(f"✅ User {user_id} connected. Total connections: {len(self.active_connections[user_id])}")
+        # Sérialise ajout/retrait ET inscription pub/sub des utilisateurs du shard
+        self.lock = asyncio.Lock()
+        self.users: Dict[int, Dict[int, ClientConnection]] = {}
+
+
+class ConnectionRegistry:
+    """
+    Sockets de ce worker, réparties en shards par user_id.
+
+    Ajout, retrait et recherche en O(1). Chaque shard a son propre verrou :
+    les connexions/déconnexions d'utilisateurs différents ne s'attendent pas.
+    Les méthodes ne font aucun await ; l'appelant prend shard(user_id).lock
+    quand la décision "première / dernière socket" doit rester cohérente avec
+    l'inscription pub/sub.
+    """
+
+    def __init__(self, shards: int = REGISTRY_SHARDS):
+        self._shards = [RegistryShard() for _ in range(max(1, shards))]
+        self._count = 0
+
+    def shard(self, user_id: int) -> RegistryShard:
+        return self._shards[user_id % len(self._shards)]
+
+    def add(self, connection: ClientConnection) -> bool:
+        """Inscrire une connexion. Retourne True si c'est la première de l'utilisateur"""
+        connections = self.shard(connection.user_id).users.setdefault(connection.user_id, {})
+        connections[id(connection.websocket)] = connection
+        self._count += 1
+        return len(connections) == 1
+
+    def remove(self, connection: ClientConnection) -> Tuple[bool, bool]:
+        """Retirer une connexion. Retourne (elle y était, c'était la dernière de l'utilisateur)"""
+        users = self.shard(connection.user_id).users
+        connections = users.get(connection.user_id)
+        key = id(connection.websocket)
+        if connections is None or connections.get(key) is not connection:
+            return False, False
+        del connections[key]
+        self._count -= 1
+        if not connections:
+            del users[connection.user_id]
+            return True, True
+        return True, False
+
+    def find(self, user_id: int, websocket: WebSocket) -> Optional[ClientConnection]:
+        connections = self.shard(user_id).users.get(user_id)
+        return connections.get(id(websocket)) if connections else None
+
+    def connections_of(self, user_id: int) -> List[ClientConnection]:
+        connections = self.shard(user_id).users.get(user_id)
+        return list(connections.values()) if connections else []
+
+    def count_of(self, user_id: int) -> int:
+        return len(self.shard(user_id).users.get(user_id, ()))
+
+    def user_ids(self) -> List[int]:
+        return [user_id for shard in self._shards for user_id in shard.users]
+
+    def all_connections(self) -> Iterator[ClientConnection]:
+        for shard in self._shards:
+            for connections in list(shard.users.values()):
+                yield from list(connections.values())
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class ConnectionManager:
+    def __init__(self, backend: Optional[PubSubBackend] = None, shards: int = REGISTRY_SHARDS):
+        # user_id -> sockets de ce worker (shards à verrous indépendants)
+        self.registry = ConnectionRegistry(shards)
+        # Pub/sub pour atteindre les sockets détenues par les autres workers
+        self.backend = backend or create_backend_from_env()
+        self._started = False
+        # Compteur des connexions évincées (lentes ou mortes)
+        self.evicted_count = 0
+        # Connexions fermées par le reaper, par raison (heartbeat / idle)
+        self.reaped_counts: Dict[str, int] = {REAPED_HEARTBEAT: 0, REAPED_IDLE: 0}
+        self._reaper: Optional[asyncio.Task] = None
+        # Appelé avec (user_ids, message) pour les destinataires connectés nulle part
+        self.offline_sink: Optional[Callable[[List[int], dict], None]] = None
+        # Appelé avec (user_id, True) à la première socket, (user_id, False) à la dernière
+        self.presence_hook: Optional[Callable[[int, bool], None]] = None
+        # Tâches lancées sans attente (évictions) : référence gardée jusqu'à leur fin
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    def spawn(self, coro: Awaitable[None]) -> asyncio.Task:
+        """create_task dont la tâche ne peut pas être collectée par le GC avant sa fin"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def start(self):
+        """Démarrer l'écoute du backend pub/sub (idempotent)"""
+        if self._started:
+            return
+        self._started = True
+        await self.backend.start(self._deliver_from_backend)
+        if HEARTBEAT_INTERVAL > 0:
+            self._reaper = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        """Se désinscrire du registre pub/sub et arrêter le backend"""
+        if not self._started:
+            return
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        for user_id in self.registry.user_ids():
+            await self.backend.unregister_user(user_id)
+        await self.backend.stop()
+        self._started = False
+
+    async def connect(self, websocket: WebSocket, user_id: int) -> ClientConnection:
+        """Accepter une connexion WebSocket (encodage négocié via Sec-WebSocket-Protocol)"""
+        offered = websocket.scope.get("subprotocols", [])
+        codec = negotiate(offered)
+        await websocket.accept(subprotocol=codec.subprotocol if codec.subprotocol in offered else None)
+        await self.start()
+
+        connection = ClientConnection(websocket, user_id, on_dead=self._evict, spawn=self.spawn, codec=codec)
+
+        async with self.registry.shard(user_id).lock:
+            first_connection = self.registry.add(connection)
+            # Première socket de cet utilisateur sur ce worker : s'inscrire
+            if first_connection:
+                await self.backend.register_user(user_id)
+
+        if first_connection:
+            self._notify_presence(user_id, True)
+
+        print(f"✅ User {user_id} connected. Total connections: {self.registry.count_of(user_id)}")
+        return connection
+
+    async def _remove(self, connection: ClientConnection) -> bool:
+        """Retirer une connexion du registre. Retourne True si elle y était"""
+        user_id = connection.user_id
+        async with self.registry.shard(user_id).lock:
+            removed, last_connection = self.registry.remove(connection)
+            # Plus aucune socket de cet utilisateur sur ce worker
+            if last_connection:
+                await self.backend.unregister_user(user_id)
+
+        if last_connection:
+            self._notify_presence(user_id, False)
+
+        await connection.close()
+        return removed
+
+    def _notify_presence(self, user_id: int, online: bool):
+        if self.presence_hook is None:
+            return
+        try:
+            self.presence_hook(user_id, online)
+        except Exception as e:
+            print(f"❌ Presence hook error: {e}")
+
+    async def _evict(self, connection: ClientConnection):
+        """Socket morte ou trop lente : la retirer et la fermer"""
+        if await self._remove(connection):
+            self.evicted_count += 1
+        try:
+            await connection.websocket.close(code=1013)
+        except Exception:
+            pass
+
+    async def _heartbeat_loop(self):
+        """Envoyer les pings et évincer les sockets silencieuses"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.reap_and_ping()
+            except Exception as e:
+                print(f"❌ Heartbeat error: {e}")
+
+    async def reap_and_ping(self) -> int:
+        """Un passage du reaper. Retourne le nombre de sockets évincées"""
+        now = time.time()
+        ping = OutboundFrame({"type": "ping", "ts": int(now * 1000)})
+        dead: List[Tuple[ClientConnection, str]] = []
+        for connection in self.registry.all_connections():
+            reason = connection.is_dead(now)
+            if reason is not None:
+                dead.append((connection, reason))
+            else:
+                connection.enqueue(ping)
+
+        for connection, reason in dead:
+            if await self._remove(connection):
+                self.reaped_counts[reason] += 1
+                print(f"💀 Reaped socket of user {connection.user_id} ({reason}, "
+                      f"silent {now - connection.last_activity:.1f}s)")
+            try:
+                await connection.websocket.close(code=1001)
+            except Exception:
+                pass
+        return len(dead)
 
     async def disconnect(self, websocket: WebSocket, user_id: int):
         """Déconnecter un WebSocket"""
-        async with self._lock:
-            if user_id in self.active_connections:
-                # ✅ FIX: Vérifier que le websocket existe avant de le retirer
-                if websocket in self.active_connections[user_id]:
-                    self.active_connections[user_id].remove(websocket)
-                
-                # Nettoyer si plus aucune connexion
-                if not self.active_connections[user_id]:
-                    del self.active_connections[user_id]
-        
+        connection = self.registry.find(user_id, websocket)
+        if connection is not None:
+            await self._remove(connection)
+
         print(f"❌ User {user_id} disconnected")
-        
+
         # ✅ FIX: Fermer proprement le websocket
         try:
             await websocket.close()
@@ -42,57 +505,90 @@ class ConnectionManager:
             print(f"⚠️ Error closing websocket for user {user_id}: {e}")
 
     async def send_personal_message(self, message: dict, user_id: int):
-        """Envoyer un message à un utilisateur spécifique"""
-        if user_id not in self.active_connections:
+        """Envoyer un message à un utilisateur spécifique (tous workers confondus)"""
+        delivered = await self._send_local(OutboundFrame(message), user_id)
+        routed = await self.backend.publish(message, [user_id])
+
+        if not delivered and not routed:
             print(f"⚠️ User {user_id} not connected")
+            self._store_offline([user_id], message)
+
+    def _store_offline(self, user_ids: List[int], message: dict):
+        """Confier à la file hors-ligne les frames sans destinataire connecté"""
+        if self.offline_sink is None or not user_ids:
             return
-        
-        # FIX: Copier la liste pour éviter les modifications pendant l'itération
-        connections = list(self.active_connections.get(user_id, []))
-        dead_connections = []
-        
+        try:
+            self.offline_sink(user_ids, message)
+        except Exception as e:
+            print(f"❌ Offline store error: {e}")
+
+    async def _send_local(self, frame: OutboundFrame, user_id: int) -> bool:
+        """
+        Mettre la frame dans la file de chaque socket de CE worker.
+        Ne bloque jamais sur une socket lente. Retourne True si au moins une existe.
+        """
+        connections = self.registry.connections_of(user_id)
+        if not connections:
+            return False
+
         for connection in connections:
-            try:
-                await connection.send_json(message)
-                print(f"📤 Message sent to user {user_id}")
-            except Exception as e:
-                print(f"❌ Error sending to user {user_id}: {e}")
-                dead_connections.append(connection)
-        
-        #FIX: Nettoyer les connexions mortes
-        if dead_connections:
-            async with self._lock:
-                for dead_conn in dead_connections:
-                    if user_id in self.active_connections and dead_conn in self.active_connections[user_id]:
-                        self.active_connections[user_id].remove(dead_conn)
-                        try:
-                            await dead_conn.close()
-                        except:
-                            pass
+            connection.enqueue(frame)
+        return True
 
     async def broadcast_to_conversation(self, message: dict, user_ids: List[int]):
         """Diffuser un message à plusieurs utilisateurs"""
         print(f"📢 Broadcasting to users: {user_ids}")
-        
-        tasks = []
+
+        # Encodée une seule fois par encodage, pour toutes les sockets
+        frame = OutboundFrame(message)
+        delivered = set()
         for user_id in user_ids:
-            task = self.send_personal_message(message, user_id)
-            tasks.append(task)
-        
-        #FIX: Envoyer en parallèle plutôt que séquentiellement
-        await asyncio.gather(*tasks, return_exceptions=True)
+            if await self._send_local(frame, user_id):
+                delivered.add(user_id)
+
+        # Un seul passage par le pub/sub pour les sockets des autres workers
+        routed = await self.backend.publish(message, user_ids)
+
+        offline = [uid for uid in dict.fromkeys(user_ids) if uid not in delivered and uid not in routed]
+        self._store_offline(offline, message)
+
+    async def _deliver_from_backend(self, user_ids: List[int], message: dict):
+        """Message routé par un autre worker : livrer uniquement en local"""
+        frame = OutboundFrame(message)
+        for user_id in user_ids:
+            await self._send_local(frame, user_id)
 
     def get_active_users(self) -> List[int]:
-        """Obtenir la liste des utilisateurs connectés"""
-        return list(self.active_connections.keys())
+        """Obtenir la liste des utilisateurs connectés sur ce worker"""
+        return self.registry.user_ids()
 
     def get_user_connection_count(self, user_id: int) -> int:
         """Obtenir le nombre de connexions pour un utilisateur"""
-        return len(self.active_connections.get(user_id, []))
+        return self.registry.count_of(user_id)
+
+    def get_connection_stats(self, user_id: Optional[int] = None) -> dict:
+        """Métriques des files d'envoi (toutes les sockets ou celles d'un utilisateur)"""
+        if user_id is not None:
+            connections = self.registry.connections_of(user_id)
+        else:
+            connections = list(self.registry.all_connections())
+
+        return {
+            "connections": len(connections),
+            "users": len(self.registry.user_ids()) if user_id is None else int(bool(connections)),
+            "queued_frames": sum(c.queue_depth for c in connections),
+            "bytes_sent": sum(c.bytes_sent for c in connections),
+            "dropped_frames": sum(c.dropped_count for c in connections),
+            "coalesced_frames": sum(c.coalesced_count for c in connections),
+            "rejected_frames": sum(c.rejected_count for c in connections),
+            "evicted_connections": self.evicted_count,
+            "reaped_connections": dict(self.reaped_counts),
+            "per_connection": [c.stats() for c in connections] if user_id is not None else None
+        }
 
     async def broadcast_to_all(self, message: dict):
         """Diffuser un message à tous les utilisateurs connectés"""
         all_user_ids = self.get_active_users()
         await self.broadcast_to_conversation(message, all_user_ids)
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
@@ -0,0 +1,204 @@
+# backend/ws_codec.py
+"""
+Encodage des frames WebSocket du chat, négocié par sous-protocole.
+
+Le client annonce les encodages qu'il comprend dans Sec-WebSocket-Protocol :
+
+- chat.msgpack.v1 : MessagePack, clés courtes (voir COMPACT_KEYS) et dates
+                    en millisecondes epoch (UTC) ; frames binaires
+- chat.json.v1    : JSON compact ; frames texte
+
+Sans sous-protocole (client actuel), on reste en JSON, comme avant.
+MessagePack est optionnel : sans le paquet msgpack, seul JSON est proposé.
+
+La compression permessage-deflate est négociée par uvicorn lui-même
+(uvicorn[standard], option --ws-per-message-deflate, activée par défaut) :
+elle s'applique quel que soit l'encodage choisi.
+
+Une frame diffusée à plusieurs sockets est enveloppée dans un OutboundFrame :
+elle est encodée une seule fois par encodage, puis les mêmes octets sont
+envoyés à toutes les sockets.
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Union
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # optionnel
+    msgpack = None
+
+SUBPROTOCOL_MSGPACK = "chat.msgpack.v1"
+SUBPROTOCOL_JSON = "chat.json.v1"
+
+# Clés longues -> clés courtes (encodage compact uniquement).
+# Une clé absente de la table est transmise telle quelle.
+COMPACT_KEYS: Dict[str, str] = {
+    "type": "t",
+    "id": "i",
+    "message": "m",
+    "messages": "ms",
+    "events": "ev",
+    "conversation_id": "c",
+    "conversations": "cs",
+    "seq": "q",
+    "sender_id": "s",
+    "sender_name": "n",
+    "content": "b",
+    "message_type": "k",
+    "file_url": "f",
+    "created_at": "at",
+    "is_read": "r",
+    "user_id": "u",
+    "status": "st",
+    "last_seen": "ls",
+    "is_typing": "ty",
+    "expires_in": "ex",
+    "client_message_id": "cm",
+    "message_id": "mi",
+    "truncated": "tr",
+    "delivered": "dl",
+}
+EXPANDED_KEYS: Dict[str, str] = {short: long for long, short in COMPACT_KEYS.items()}
+
+# Champs horodatés : chaîne ISO (naïve = UTC) -> millisecondes epoch
+TIME_FIELDS = {"created_at", "last_seen", "read_at", "last_message_at"}
+
+# Valeurs transmises telles quelles par compact (test de type exact, sans appel)
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def _to_epoch_ms(value) -> Union[int, str, None]:
+    if value.__class__ is str:
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        # Arithmétique entière : évite timestamp() et son passage par le flottant
+        return (value - (_EPOCH if value.tzinfo is None else _EPOCH_UTC)) // _MILLISECOND
+    return value
+
+
+def _compact_dict(message: dict) -> dict:
+    result = {}
+    for key, item in message.items():
+        if key in TIME_FIELDS:
+            item = _to_epoch_ms(item)
+        elif item.__class__ not in _PLAIN_TYPES:
+            item = compact(item)
+        result[COMPACT_KEYS.get(key, key)] = item
+    return result
+
+
+def compact(value):
+    """Raccourcir les clés et convertir les dates, récursivement"""
+    if isinstance(value, dict):
+        return _compact_dict(value)
+    if isinstance(value, list):
+        return [
+            _compact_dict(item) if item.__class__ is dict else compact(item)
+            for item in value
+        ]
+    if isinstance(value, datetime):
+        return _to_epoch_ms(value)
+    return value
+
+
+def expand(value):
+    """Inverse de compact pour les frames reçues (les dates restent telles quelles)"""
+    if isinstance(value, dict):
+        return {EXPANDED_KEYS.get(key, key): expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+    return value
+
+
+class FrameCodec:
+    """Encodage JSON (frames texte) : comportement historique de send_json"""
+
+    name = "json"
+    subprotocol: Optional[str] = SUBPROTOCOL_JSON
+    binary = False
+
+    def encode(self, message: dict) -> Union[str, bytes]:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        return json.loads(data)
+
+
+class MsgpackCodec(FrameCodec):
+    """MessagePack, clés courtes et dates en ms epoch (frames binaires)"""
+
+    name = "msgpack"
+    subprotocol = SUBPROTOCOL_MSGPACK
+    binary = True
+
+    def encode(self, message: dict) -> bytes:
+        return msgpack.packb(compact(message), use_bin_type=True, default=str)
+
+    def decode(self, data: Union[str, bytes]) -> dict:
+        if isinstance(data, str):
+            # Une frame texte reste du JSON, même sur une socket msgpack
+            return json.loads(data)
+        return expand(msgpack.unpackb(data, raw=False))
+
+
+JSON_CODEC = FrameCodec()
+MSGPACK_CODEC = MsgpackCodec() if msgpack is not None else None
+
+# Par ordre de préférence du serveur
+AVAILABLE_CODECS = [codec for codec in (MSGPACK_CODEC, JSON_CODEC) if codec is not None]
+
+
+def negotiate(offered: Iterable[str]) -> FrameCodec:
+    """Choisir l'encodage parmi les sous-protocoles proposés par le client"""
+    offered = set(offered or ())
+    for codec in AVAILABLE_CODECS:
+        if codec.subprotocol in offered:
+            return codec
+    return JSON_CODEC
+
+
+class OutboundFrame:
+    """Frame à envoyer, encodée au plus une fois par encodage"""
+
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def encoded(self, codec: FrameCodec) -> Union[str, bytes]:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.message)
+        return data
+
+
+async def send_frame(websocket: WebSocket, codec: FrameCodec, frame: OutboundFrame) -> int:
+    """Envoyer une frame encodée ; retourne sa taille (octets avant compression)"""
+    data = frame.encoded(codec)
+    if codec.binary:
+        await websocket.send_bytes(data)
+        return len(data)
+    await websocket.send_text(data)
+    return len(data) if data.isascii() else len(data.encode("utf-8"))
+
+
+async def receive_frame(websocket: WebSocket, codec: FrameCodec) -> dict:
+    """Recevoir et décoder une frame (texte JSON ou binaire selon l'encodage)"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return codec.decode(message["bytes"])
+    return codec.decode(message["text"])